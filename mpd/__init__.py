@@ -0,0 +1,14 @@
+"""
+monophonic pitch detection
+- transcribe: async generator of the note events of an audio source (see mpd.aio)
+the submodules are imported on first use, e.g. `import mpd.pipeline` loads neither the audio sources nor madmom
+"""
+
+__all__ = ['transcribe']
+
+
+def __getattr__(name):
+    if name == 'transcribe':
+        from .aio import transcribe
+        return transcribe
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
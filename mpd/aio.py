@@ -0,0 +1,86 @@
+"""
+asyncio interface: the DSP runs in a worker thread in batches of hops, so the event loop is never blocked by it
+- transcribe: async generator of the NoteEvents of a source (async for event in mpd.transcribe(src))
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from .source import create_source
+from .pipeline import NoteTranscriber, create_transcriber
+
+
+def _process_batch(transcriber: NoteTranscriber, src, batch_hops: int):
+    """ (events, finished) of the next batch_hops hops of src, runs in the executor """
+    events = []
+    for _ in range(batch_hops):
+        samples, read = src()
+        if read < src.hop_size:
+            return events, True
+        event = transcriber.process_hop(samples)
+        if event is not None:
+            events.append(event)
+    return events, False
+
+
+async def transcribe(source, transcriber: NoteTranscriber=None, hop_size: int=512, batch_hops: int=16,
+                     max_events: int=16, executor: ThreadPoolExecutor=None):
+    """ async generator of the NoteEvents of source (path or mpd.source object)
+
+    The hops are processed by the transcriber (default: create_transcriber(hop_size)) in batches of batch_hops in
+    the executor (a thread pool, by default a thread per call). The next batch is only started while less than
+    max_events events are waiting to be consumed (back-pressure). When the generator is closed or cancelled, the
+    running batch is finished and the detector objects of the transcriber are released.
+    """
+    loop = asyncio.get_running_loop()
+    own_executor = executor is None
+    if own_executor:
+        executor = ThreadPoolExecutor(1, thread_name_prefix='mpd')
+    if transcriber is None:
+        transcriber = create_transcriber(hop_size)
+    queue = asyncio.Queue(max_events)
+    finished = object()
+    batch = None  # concurrent.futures.Future of the running batch
+
+    async def produce():
+        nonlocal batch
+        try:
+            if isinstance(source, str):
+                batch = executor.submit(create_source, source, transcriber.hop_size, False)
+                src = await asyncio.wrap_future(batch)
+            else:
+                src = source
+            batch = executor.submit(transcriber.reset, src.samplerate)
+            await asyncio.wrap_future(batch)
+            done = False
+            while not done:
+                batch = executor.submit(_process_batch, transcriber, src, batch_hops)
+                events, done = await asyncio.wrap_future(batch)
+                for event in events:
+                    await queue.put(event)
+            await queue.put(finished)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:  # raised in the consumer
+            await queue.put(e)
+
+    producer = loop.create_task(produce())
+    try:
+        while True:
+            item = await queue.get()
+            if item is finished:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        producer.cancel()
+        try:
+            await producer
+        except asyncio.CancelledError:
+            pass
+        if batch is not None and not batch.done():  # the detectors are still in use by the worker thread
+            await asyncio.wait([asyncio.wrap_future(batch)])
+        transcriber.close()
+        if own_executor:
+            executor.shutdown(wait=False)
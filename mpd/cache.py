@@ -0,0 +1,242 @@
+"""
+persistent on-disk feature cache
+- FeatureCache: arrays stored as .npy files (loaded memory-mapped), keyed by the content hash of the audio file plus
+  the parameters they were computed with, bounded in size (least recently used entries are evicted first)
+- file_hash: content hash of a file
+- detector_params: configuration of a detector, used as part of the cache key
+- cached_audio / cached_source: decoded float32 audio
+- cached_outputs: per hop process_next outputs of a detector
+- cached_raw_track: the raw detector outputs of mpd.sweep
+"""
+
+import os
+import json
+import hashlib
+import numpy as np
+
+from .source import create_source, ArraySource, open_hdf5, split_hdf5_path
+from .sweep import RawTrack, onset_function
+from .pitch import pitch_track
+from . import yin
+
+_hashes = {}  # (path, mtime, size): hash, so every file is hashed at most once per process
+
+
+def file_hash(path: str) -> str:
+    """ sha1 of the file content (of the dataset for 'container.hdf5::dataset' paths) """
+    hdf5_path = split_hdf5_path(path)
+    container = path if hdf5_path is None else hdf5_path[0]
+    stat = os.stat(container)
+    key = (os.path.realpath(container), stat.st_mtime_ns, stat.st_size, path)
+    if key not in _hashes:
+        sha1 = hashlib.sha1()
+        if hdf5_path is not None:
+            dataset = open_hdf5(container)[hdf5_path[1]]
+            step = 1 << 18
+            for start in range(0, dataset.shape[0], step):
+                sha1.update(dataset[start:start + step].tobytes())
+        else:
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    sha1.update(block)
+        _hashes[key] = sha1.hexdigest()
+    return _hashes[key]
+
+
+class FeatureCache:
+    """ Directory of .npy arrays (+ a .json file with their key parameters and attributes) keyed by a content hash
+    and parameters. Hits are loaded memory-mapped (read-only) and refresh the modification time of the entry, when
+    the cache grows above max_size_mb the entries with the oldest modification time are deleted.
+    Entries are written to a temporary file and renamed, so several worker processes can share a cache directory.
+    """
+
+    def __init__(self, directory: str, max_size_mb: float=2048):
+        self.directory = directory
+        self.max_size = int(max_size_mb * 2 ** 20)
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, content_hash: str, name: str, params: dict) -> str:
+        text = json.dumps([content_hash, name, params], sort_keys=True, default=str)
+        return name + '_' + hashlib.sha1(text.encode()).hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key + '.npy')
+
+    def load(self, key: str):
+        """ (data, attrs) or (None, None) if the entry doesn't exist """
+        path = self.path(key)
+        try:
+            with open(path[:-3] + 'json', mode='r') as f:
+                attrs = json.load(f)['attrs']
+            data = np.load(path, mmap_mode='r')
+            os.utime(path)  # least recently used = oldest modification time
+        except (OSError, ValueError):
+            return None, None
+        return data, attrs
+
+    def store(self, key: str, data, params: dict=None, attrs: dict=None):
+        path = self.path(key)
+        tmp = f"{path[:-4]}.{os.getpid()}.tmp"
+        with open(tmp, mode='w') as f:
+            json.dump({'params': params, 'attrs': attrs or {}}, f, default=str)
+        os.replace(tmp, path[:-3] + 'json')
+        with open(tmp, mode='wb') as f:
+            np.save(f, np.ascontiguousarray(data))
+        os.replace(tmp, path)
+        self.evict()
+
+    def get(self, content_hash: str, name: str, params: dict, compute):
+        """ cached (data, attrs) of an array, compute() -> (data, attrs) is called on a miss """
+        key = self.key(content_hash, name, params)
+        data, attrs = self.load(key)
+        if data is None:
+            data, attrs = compute()
+            self.store(key, data, params, attrs)
+            cached, cached_attrs = self.load(key)
+            if cached is not None:  # else evicted right away (larger than the cache)
+                data, attrs = cached, cached_attrs
+        return data, attrs
+
+    def entries(self):
+        """ (mtime, size, key) of all entries """
+        result = []
+        for file in os.listdir(self.directory):
+            if not file.endswith('.npy'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, file))
+            except OSError:  # removed by another process
+                continue
+            result.append((stat.st_mtime, stat.st_size, file[:-4]))
+        return result
+
+    def size(self) -> int:
+        """ total size of the cached arrays in bytes """
+        return sum(size for _, size, _ in self.entries())
+
+    def remove(self, key: str):
+        for path in [self.path(key), self.path(key)[:-3] + 'json']:
+            try:
+                os.remove(path)
+            except OSError:  # already removed, or still mapped (windows)
+                pass
+
+    def evict(self, max_size: int=None):
+        """ delete the least recently used entries until the cache is at most max_size bytes """
+        max_size = self.max_size if max_size is None else max_size
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= max_size:
+                break
+            self.remove(key)
+            total -= size
+
+    def clear(self):
+        for file in os.listdir(self.directory):
+            if file.endswith(('.npy', '.json', '.tmp')):
+                try:
+                    os.remove(os.path.join(self.directory, file))
+                except OSError:
+                    pass
+
+
+# configuration attributes of the detectors, the keys are built from these only (runtime state like hop counters,
+# buffers and the aubio / madmom objects is left out, a detector that processed a file has the same key as a new one)
+DETECTOR_CONFIG = ('method', 'hop_size', 'buf_size', 'frame_size', 'minioi_ms', 'threshold', 'compression', 'silence',
+                   'num_bands', 'fb', 'log', 'diff_max_bins', 'fps', 'pre_avg', 'pre_max', 'large_frame_size',
+                   'lowest_note', 'pitch_low_threshold', 'large_below', 'min_confidence', 'p_weights', 'smoother',
+                   'large_smoother', 'front_end')
+NESTED_CONFIG = ('hop_size', 'frame_size', 'history_length', 'weights', 'num_bins')  # of smoothers and front ends
+
+
+def _plain(value):
+    """ json compatible version of a configuration value, None if it can't be stored """
+    if isinstance(value, (bool, int, float, str, np.integer, np.floating)):
+        return value.item() if isinstance(value, np.generic) else value
+    if isinstance(value, np.ndarray) and value.size <= 256:
+        return value.tolist()
+    if isinstance(value, (list, tuple)) and len(value) <= 256:
+        return [_plain(v) for v in value]
+    if callable(value):  # e.g. the filterbank class or log function of the madmom detectors
+        return getattr(value, '__name__', None)
+    if hasattr(value, '__dict__'):  # smoother, front end
+        return detector_params(value, True)
+    return None
+
+
+def detector_params(detector, nested: bool=False, exclude=()) -> dict:
+    """ class name and configuration attributes (DETECTOR_CONFIG, NESTED_CONFIG of nested objects) of a detector,
+    except the ones in `exclude`
+    """
+    params = {'class': type(detector).__name__}
+    for name in NESTED_CONFIG if nested else DETECTOR_CONFIG:
+        value = _plain(getattr(detector, name, None))
+        if value is not None and name not in exclude:
+            params[name] = value
+    return params
+
+
+def cached_audio(cache: FeatureCache, path: str):
+    """ (decoded mono float32 samples, samplerate) of an audio file """
+    def decode():
+        src = create_source(path, hop_size=4096, verbose=False)
+        return src.read_all(), {'samplerate': src.samplerate}
+    data, attrs = cache.get(file_hash(path), 'audio', {}, decode)
+    return data, attrs['samplerate']
+
+
+def cached_source(cache: FeatureCache, path: str, hop_size: int) -> ArraySource:
+    """ drop-in replacement of create_source reading the decoded audio from the cache """
+    data, samplerate = cached_audio(cache, path)
+    return ArraySource(data, samplerate, hop_size)
+
+
+def cached_outputs(cache: FeatureCache, path: str, detector, hop_size: int):
+    """ process_next of a (onset or pitch) detector for all complete hops of a file, the detector is created
+    (create_detector) for the file in any case
+    """
+    src = cached_source(cache, path, hop_size)
+    detector.create_detector(src.samplerate)
+    params = {'detector': detector_params(detector), 'hop_size': hop_size, 'samplerate': src.samplerate}
+
+    def compute():
+        outputs = []
+        while True:
+            samples, read = src()
+            if read < src.hop_size:
+                break
+            outputs.append(detector.process_next(samples))
+        return np.array(outputs), {}
+    return cache.get(file_hash(path), 'outputs', params, compute)[0]
+
+
+def cached_raw_track(cache: FeatureCache, path: str, od, hop_size: int, pitch_method: str='yinfft',
+                     pitch_frame_sizes=(2048, 4096)) -> RawTrack:
+    """ mpd.sweep.compute_raw_track with all arrays from the cache """
+    samples, samplerate = cached_audio(cache, path)
+    content_hash = file_hash(path)
+    num_hops = len(samples) // hop_size
+    hops = samples[:num_hops * hop_size].reshape(num_hops, hop_size)
+    params = {'hop_size': hop_size, 'samplerate': samplerate}
+
+    level, _ = cache.get(content_hash, 'level', params, lambda: (yin.level_db(hops), {}))
+    odf, delay = None, 0
+    if od is not None:
+        od.create_detector(samplerate)
+        # the detection function doesn't depend on the peak picking, one entry for all thresholds of a sweep
+        onset_params = dict(params, detector=detector_params(od, exclude=('threshold', 'minioi_ms', 'silence')))
+
+        def compute_odf():
+            odf, delay = onset_function(hops, od, samplerate)
+            return odf, {'delay': delay}
+        odf, attrs = cache.get(content_hash, 'odf', onset_params, compute_odf)
+        delay = attrs['delay']
+
+    pitches = {}
+    for frame_size in pitch_frame_sizes:
+        pitch_params = dict(params, method=pitch_method, frame_size=frame_size)
+        midi, _ = cache.get(content_hash, 'pitch', pitch_params, lambda: (np.round(pitch_track(
+            samples, pitch_method, frame_size, hop_size, samplerate)[0]).astype(np.int64), {}))
+        pitches[frame_size] = midi
+    return RawTrack(samplerate, hop_size, level, odf, delay, pitches)
@@ -0,0 +1,163 @@
+"""
+evaluation of detected notes against the ground truth (csv: onset[ms], pitch[midi] per row)
+- load_truth: ground truth as arrays
+- match_onsets: onset matching with tolerance (same result as the sequential matching loop of the benchmark scripts)
+- Evaluation: counts, onset offsets and pitch errors of one file or (added up) a whole corpus
+- print_statistics: pitch error histograms and onset offset percentiles
+"""
+
+import statistics
+import numpy as np
+
+from .runner import read_csv
+from .utils import midi2char
+
+
+def load_truth(path: str):
+    """ (onsets[ms], pitches[midi]) of a ground truth csv file (or csv dataset of a HDF5 container) """
+    rows = np.array([(int(row[0]), int(row[1])) for row in read_csv(path)], dtype=np.int64).reshape(-1, 2)
+    return rows[:, 0], rows[:, 1]
+
+
+def notes_to_arrays(notes: dict):
+    """ (onsets, pitches) of a {onset[ms]: pitch[midi]} dict, in insertion order """
+    return np.fromiter(notes.keys(), dtype=np.int64, count=len(notes)), \
+        np.fromiter(notes.values(), dtype=np.int64, count=len(notes))
+
+
+def match_onsets(detected, truth, tolerance: float):
+    """ index of the detected onset matched with each ground truth onset (-1: not found)
+
+    Same as walking through the ground truth with a pointer into the detected onsets: detected onsets before
+    onset - tolerance are skipped (false positives), the next one is matched if it is <= onset + tolerance.
+    For sorted detected onsets the pointer after ground truth onset i is k[i] = max(k[i-1], lo[i]) + matched[i]
+    (lo: first detected onset >= onset - tolerance), this monotone recurrence is iterated for all onsets at once until
+    it doesn't change anymore, which only takes a few iterations as long as the ground truth onsets are not closer
+    than the tolerance.
+    """
+    detected = np.asarray(detected)
+    truth = np.asarray(truth)
+    if len(detected) > 1 and np.any(detected[1:] < detected[:-1]):
+        return _match_sequential(detected, truth, tolerance)
+
+    n = len(detected)
+    lo = np.searchsorted(detected, truth - tolerance, side='left')
+    hi = truth + tolerance
+    padded = np.append(detected, np.iinfo(np.int64).max)  # pointer == n: nothing left to match
+
+    def step(idx, previous):
+        p = np.maximum(previous, lo[idx])
+        return p, p + ((p < n) & (padded[np.minimum(p, n)] <= hi[idx]))
+
+    p, k = step(np.arange(len(truth)), np.concatenate(([0], lo[:-1])))  # lower bound: k[i-1] >= lo[i-1]
+    changed = np.nonzero(k[:-1] != lo[:-1])[0]
+    while len(changed):  # only the onsets after a changed pointer have to be updated
+        idx = changed + 1
+        p_new, k_new = step(idx, k[changed])
+        changed = idx[k_new != k[idx]]
+        p[idx], k[idx] = p_new, k_new
+        changed = changed[changed < len(truth) - 1]
+    return np.where(k > p, p, -1)
+
+
+def _match_sequential(detected, truth, tolerance: float):
+    """ the matching loop of the benchmark scripts (for unsorted detected onsets) """
+    result = np.full(len(truth), -1, dtype=np.int64)
+    key_idx = 0
+    for i, onset in enumerate(truth.tolist()):
+        while key_idx < len(detected) and detected[key_idx] < onset - tolerance:
+            key_idx += 1  # skip inexisting detected onsets
+        if key_idx < len(detected) and abs(detected[key_idx] - onset) <= tolerance:
+            result[i] = key_idx
+            key_idx += 1  # skip "used" onset
+    return result
+
+
+class Evaluation:
+    """ Evaluation counts of one or more files, evaluations of several files can be added up with += """
+
+    def __init__(self):
+        self.onsetTP, self.onsetFP, self.onsetFN = 0, 0, 0
+        self.pitchTP, self.pitchFN = 0, 0  # pitch of the matched onsets
+        self.pTP, self.pFN = 0, 0  # pitch at a fixed time after each ground truth onset (perfect onset detection)
+        self.onset_offsets = np.zeros(0, dtype=np.int64)  # detected - ground truth onset [ms] of the matched onsets
+        self.pitch_offsets = np.zeros(0, dtype=np.int64)  # detected - true pitch of wrong pitches (*1000 if too low)
+        self.missed_pitches = np.zeros(0, dtype=np.int64)  # true pitch of wrong pitches
+
+    @classmethod
+    def evaluate(cls, notes: dict, truth, tolerance_ms: float, lowest_note: int, all_pitches=None,
+                 samplerate: int=None, hop_size: int=None, pitch_time_limit_s: float=None):
+        """ evaluate the detected notes {onset[ms]: pitch[midi]} of a file against its ground truth (onsets, pitches)
+        all_pitches: pitch of each hop to check the pitch pitch_time_limit_s after each ground truth onset (pTP/pFN)
+        """
+        onsets, pitches = notes_to_arrays(notes)
+        true_onsets, true_pitches = truth
+        idx = match_onsets(onsets, true_onsets, tolerance_ms)
+        matched = idx >= 0
+
+        e = cls()
+        e.onsetTP = int(matched.sum())
+        e.onsetFN = len(true_onsets) - e.onsetTP
+        e.onsetFP = len(onsets) - e.onsetTP
+        e.onset_offsets = onsets[idx[matched]] - true_onsets[matched]
+
+        detected_pitches = pitches[idx[matched]]
+        wrong = detected_pitches != true_pitches[matched]
+        e.pitchTP = int((~wrong).sum())
+        e.pitchFN = int(wrong.sum())
+        e.pitch_offsets = detected_pitches[wrong] - true_pitches[matched][wrong]
+        e.pitch_offsets[detected_pitches[wrong] < lowest_note] *= 1000
+        e.missed_pitches = true_pitches[matched][wrong]
+
+        if all_pitches is not None:
+            tl_after_onset = true_onsets / 1000 * samplerate + samplerate * pitch_time_limit_s
+            hop_pitches = np.asarray(all_pitches)[np.round(tl_after_onset / hop_size).astype(np.int64)]
+            e.pTP = int((hop_pitches == true_pitches).sum())
+            e.pFN = len(true_pitches) - e.pTP
+        return e
+
+    def __iadd__(self, other):
+        for name in ['onsetTP', 'onsetFP', 'onsetFN', 'pitchTP', 'pitchFN', 'pTP', 'pFN']:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        for name in ['onset_offsets', 'pitch_offsets', 'missed_pitches']:
+            setattr(self, name, np.concatenate((getattr(self, name), getattr(other, name))))
+        return self
+
+    def counts(self):
+        return self.onsetTP, self.onsetFP, self.onsetFN, self.pitchTP, self.pitchFN, self.pTP, self.pFN
+
+    @property
+    def onset_f1(self) -> float:
+        tp, fp, fn = self.onsetTP, self.onsetFP, self.onsetFN
+        return 2*tp**2 / max(1, 2*tp**2 + tp*fp + tp*fn)
+
+    @property
+    def pitch_accuracy(self) -> float:
+        return self.pitchTP / max(1, self.pitchTP + self.pitchFN)
+
+    def pitch_error_histogram(self):
+        """ (pitch offsets, counts) """
+        return np.unique(self.pitch_offsets, return_counts=True)
+
+    def missed_pitch_histogram(self):
+        """ (true pitches, counts) """
+        return np.unique(self.missed_pitches, return_counts=True)
+
+    def onset_percentiles(self):
+        """ deciles p10..p90 of the onset offsets (like sorted(offsets)[int(len * i / 10)]) """
+        offsets = np.sort(self.onset_offsets)
+        return offsets[(len(offsets) * np.arange(1, 10) / 10).astype(np.int64)]
+
+
+def print_statistics(e: Evaluation):
+    """ pitch error histograms and onset offset statistics of the benchmark scripts """
+    for k, count in zip(*(a.tolist() for a in e.pitch_error_histogram())):
+        print(f"{k}\t{count}\t{round(count/e.pitchFN*100, 2)}%")
+    for k, count in zip(*(a.tolist() for a in e.missed_pitch_histogram())):
+        print(f"{k}\t{midi2char(k)}\t{count}\t{round(count/e.pitchFN*100, 2)}%")
+    _os = np.sort(e.onset_offsets).tolist()
+    print(f"min: {_os[0]}\t{_os[:10]}")
+    for i, p in enumerate(e.onset_percentiles().tolist(), 1):
+        print(f"p{i}0: {p}")
+    print(f"max: {_os[-1]} \t{_os[-10:]}")
+    print(f"mean: {statistics.mean(e.onset_offsets.tolist())}")
@@ -0,0 +1,59 @@
+"""
+silence gate in front of the detectors: quiet hops are passed to process_silence of the detectors instead of
+process_next, which lets them skip the expensive part (ffts) while keeping their state consistent
+- hop_level: level of a hop in dB (like aubio.db_spl / yin.level_db)
+- SilenceGate: opens as soon as a hop reaches open_db, closes after `hangover` hops below close_db
+"""
+
+import math
+
+import numpy as np
+
+
+def hop_level(samples) -> float:
+    samples = np.asarray(samples, dtype=np.float64)
+    energy = np.dot(samples, samples) / len(samples)
+    return 10. * math.log10(energy) if energy > 0 else -math.inf
+
+
+class SilenceGate:
+    """ Level gate with hysteresis and hangover. open_db has to be at most the silence threshold of the detectors
+    (-54 for AubioOnsetDetector, -50 for the pitch detectors): hops that are skipped would not give an onset or a
+    pitch anyway. The hangover keeps the detectors running until the frames of the last note are quiet.
+    """
+
+    def __init__(self, open_db: float=-54., close_db: float=-60., hangover: int=8):
+        self.open_db = open_db
+        self.close_db = close_db
+        self.hangover = hangover  # hops
+        self.reset()
+
+    def reset(self):
+        self.is_open = True
+        self.quiet = 0  # consecutive hops below close_db
+        self.level = -math.inf  # of the last hop
+        self.hops = 0
+        self.closed_hops = 0
+
+    def process_next(self, samples) -> bool:
+        """ True if the detectors have to process the hop """
+        self.level = level = hop_level(samples)
+        self.hops += 1
+        if self.is_open:
+            if level < self.close_db:
+                self.quiet += 1
+                if self.quiet >= self.hangover:
+                    self.is_open = False
+            else:
+                self.quiet = 0
+        elif level >= self.open_db:
+            self.is_open = True
+            self.quiet = 0
+        if not self.is_open:
+            self.closed_hops += 1
+        return self.is_open
+
+    @property
+    def closed_ratio(self) -> float:
+        """ part of the hops the detectors skipped """
+        return self.closed_hops / self.hops if self.hops else 0.
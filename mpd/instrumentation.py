@@ -0,0 +1,185 @@
+"""
+optional latency instrumentation of the hot path
+- LatencyHistogram: counts of durations in logarithmic bins
+- Instrumentation: named histograms (one per stage), mergeable across worker processes, exported as JSON
+- instrument_method / uninstrument_method: replace a method of an object by a timed version of it, objects that are
+  not instrumented run without any overhead (used by the instrument methods of sources, detectors and the pipeline)
+"""
+
+import json
+import math
+from time import perf_counter
+
+BINS_PER_DECADE = 20
+MIN_EXPONENT, MAX_EXPONENT = -7, 2  # 100ns .. 100s
+
+
+class LatencyHistogram:
+    """ durations [s] in BINS_PER_DECADE logarithmic bins per decade, plus under- and overflow bin """
+
+    def __init__(self):
+        self.counts = [0] * ((MAX_EXPONENT - MIN_EXPONENT) * BINS_PER_DECADE + 2)
+        self.count = 0
+        self.total = 0.
+        self.min = math.inf
+        self.max = 0.
+
+    def add(self, seconds: float):
+        if seconds > 0:
+            idx = int((math.log10(seconds) - MIN_EXPONENT) * BINS_PER_DECADE) + 1
+            idx = 0 if idx < 0 else min(idx, len(self.counts) - 1)
+        else:
+            idx = 0
+        self.counts[idx] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds < self.min:
+            self.min = seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def upper_edge(self, idx: int) -> float:
+        """ upper bound of bin idx [s] """
+        return 10 ** (MIN_EXPONENT + idx / BINS_PER_DECADE)
+
+    def percentile(self, p: float) -> float:
+        """ upper edge of the bin containing the p-th percentile (at most the maximum) [s] """
+        if not self.count:
+            return 0.
+        rank = p / 100 * self.count
+        seen = 0
+        for idx, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(self.upper_edge(idx), self.max)
+        return self.max
+
+    def merge(self, other):
+        for idx, count in enumerate(other.counts):
+            self.counts[idx] += count
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def to_dict(self) -> dict:
+        """ summary in ms, counts per bin (upper edge [ms]: count) """
+        ms = 1000.
+        return {
+            'count': self.count,
+            'mean_ms': self.total / self.count * ms if self.count else 0.,
+            'min_ms': self.min * ms if self.count else 0.,
+            'max_ms': self.max * ms,
+            'p50_ms': self.percentile(50) * ms,
+            'p90_ms': self.percentile(90) * ms,
+            'p99_ms': self.percentile(99) * ms,
+            'total_s': self.total,
+            'bins_ms': {f"{self.upper_edge(idx) * ms:.6g}": count for idx, count in enumerate(self.counts) if count},
+        }
+
+    @classmethod
+    def from_dict(cls, d: dict):
+        h = cls()
+        for edge, count in d['bins_ms'].items():
+            idx = round((math.log10(float(edge) / 1000.) - MIN_EXPONENT) * BINS_PER_DECADE)
+            h.counts[max(0, min(idx, len(h.counts) - 1))] += count
+        h.count = d['count']
+        h.total = d['total_s']
+        h.min = d['min_ms'] / 1000. if h.count else math.inf
+        h.max = d['max_ms'] / 1000.
+        return h
+
+
+class Instrumentation:
+    """ Histograms by stage name (e.g. read, filter, onset, pitch, voting, emit) """
+
+    def __init__(self):
+        self.histograms = {}
+
+    def histogram(self, name: str) -> LatencyHistogram:
+        if name not in self.histograms:
+            self.histograms[name] = LatencyHistogram()
+        return self.histograms[name]
+
+    def record(self, name: str, seconds: float):
+        self.histogram(name).add(seconds)
+
+    def merge(self, other):
+        """ add the histograms of another Instrumentation (or its to_dict()) """
+        if isinstance(other, dict):
+            other = Instrumentation.from_dict(other)
+        for name, h in other.histograms.items():
+            self.histogram(name).merge(h)
+        return self
+
+    def to_dict(self) -> dict:
+        return {name: h.to_dict() for name, h in self.histograms.items()}
+
+    @classmethod
+    def from_dict(cls, d: dict):
+        stats = cls()
+        stats.histograms = {name: LatencyHistogram.from_dict(h) for name, h in d.items()}
+        return stats
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), indent=2)
+
+    def save(self, path: str):
+        with open(path, mode='w') as f:
+            f.write(self.to_json())
+
+    def summary(self) -> str:
+        """ one line per stage """
+        lines = []
+        for name, h in self.histograms.items():
+            d = h.to_dict()
+            lines.append(f"{name}:\t n: {d['count']}, mean: {round(d['mean_ms'], 4)}ms, p50: {round(d['p50_ms'], 4)}ms, "
+                         f"p99: {round(d['p99_ms'], 4)}ms, max: {round(d['max_ms'], 4)}ms, total: {round(d['total_s'], 3)}s")
+        return "\n".join(lines)
+
+
+def timed(histogram: LatencyHistogram, func):
+    """ func, recording the duration of every call """
+    def wrapper(*args, **kwargs):
+        start = perf_counter()
+        result = func(*args, **kwargs)
+        histogram.add(perf_counter() - start)
+        return result
+    wrapper.__wrapped__ = func
+    return wrapper
+
+
+def instrument_method(obj, method: str, histogram: LatencyHistogram):
+    """ time obj.method (an instance attribute shadows the method of the class), replaces an older instrumentation """
+    uninstrument_method(obj, method)
+    setattr(obj, method, timed(histogram, getattr(obj, method)))
+
+
+def uninstrument_method(obj, method: str):
+    if hasattr(getattr(obj, method, None), '__wrapped__') and method in vars(obj):
+        delattr(obj, method)
+
+
+_timed_types = {}
+
+
+def instrument_call(obj, histogram: LatencyHistogram):
+    """ time obj() - python looks __call__ up on the type, so obj gets a subclass of its type with a timed __call__ """
+    cls = type(obj)
+    if getattr(cls, '_timed_call', False):
+        cls = cls.__bases__[0]
+    if cls not in _timed_types:
+        def __call__(self, *args, **kwargs):
+            start = perf_counter()
+            result = cls.__call__(self, *args, **kwargs)
+            self._call_histogram.add(perf_counter() - start)
+            return result
+        _timed_types[cls] = type(cls.__name__, (cls,), {'__call__': __call__, '_timed_call': True})
+    obj.__class__ = _timed_types[cls]
+    obj._call_histogram = histogram
+
+
+def uninstrument_call(obj):
+    if getattr(type(obj), '_timed_call', False):
+        obj.__class__ = type(obj).__bases__[0]
+        del obj._call_histogram
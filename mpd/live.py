@@ -0,0 +1,202 @@
+"""
+live input: the audio callback only copies the samples into a ring buffer, the detection runs in a worker thread
+- HopRingBuffer: preallocated single producer / single consumer queue of hops, read as views without copies
+- LiveInput: audio callback (pyaudio callback mode) + worker thread calling process_hop for every hop
+- FakeStream: stands in for a pyaudio input stream, calls the callback with the samples of an array
+- open_microphone: pyaudio input stream feeding a LiveInput
+"""
+
+import threading
+import time
+
+import numpy as np
+
+PA_CONTINUE = 0  # pyaudio.paContinue
+PA_INPUT_OVERFLOW = 2  # pyaudio.paInputOverflow status flag
+
+
+class HopRingBuffer:
+    """ Ring buffer of num_hops hops for one writer and one reader thread. Only the writer changes `written` and
+    only the reader changes `consumed` (both count samples and only grow), so no lock is needed.
+    Writes which don't fit are dropped (overrun), writes with fewer samples than the callback asked for leave the
+    buffer short (underrun). A reader waiting on a paused or silent stream is not an underrun.
+    """
+
+    def __init__(self, hop_size: int, num_hops: int=64, dtype='float32'):
+        self.hop_size = hop_size
+        self.size = hop_size * num_hops
+        self.data = np.zeros(self.size, dtype=dtype)
+        self.written = 0
+        self.consumed = 0
+        self.overruns = 0  # dropped writes
+        self.underruns = 0  # short writes
+        self.ready = threading.Event()
+
+    def reset(self):
+        self.written, self.consumed = 0, 0
+        self.overruns, self.underruns = 0, 0
+        self.ready.clear()
+
+    def available(self) -> int:
+        """ number of complete hops ready to be read """
+        return (self.written - self.consumed) // self.hop_size
+
+    def write(self, samples, expected: int=None) -> bool:
+        """ copy samples into the buffer (writer thread), False if they were dropped because the buffer is full.
+        expected: number of samples the callback was called for, less samples count as underrun
+        """
+        n = len(samples)
+        if expected is not None and n < expected:
+            self.underruns += 1
+        if self.written + n - self.consumed > self.size:
+            self.overruns += 1
+            return False
+        pos = self.written % self.size
+        first = min(n, self.size - pos)
+        self.data[pos:pos + first] = samples[:first]
+        if first < n:  # wraps around
+            self.data[:n - first] = samples[first:]
+        self.written += n
+        if self.available():
+            self.ready.set()
+        return True
+
+    def read(self, timeout: float=None):
+        """ view on the next hop (reader thread), valid until release() is called. None if no hop arrived within
+        timeout seconds
+        """
+        if not self.available():
+            self.ready.clear()
+            if not self.available():  # re-check: written in between
+                self.ready.wait(timeout)
+                if not self.available():  # timeout (or woken up by LiveInput.stop)
+                    return None
+        pos = self.consumed % self.size
+        return self.data[pos:pos + self.hop_size]
+
+    def release(self):
+        """ the hop returned by read() was processed, its space can be overwritten """
+        self.consumed += self.hop_size
+
+
+class LiveInput:
+    """ Calls process_hop(samples) in a worker thread for every hop of the input.
+    `callback` is meant to be the stream_callback of a pyaudio stream (float32, mono): it only copies the samples
+    into the ring buffer, so a slow hop doesn't stall the capture (as long as the buffer doesn't overflow).
+    """
+
+    def __init__(self, process_hop, hop_size: int, num_hops: int=64):
+        self.process_hop = process_hop
+        self.hop_size = hop_size
+        self.buffer = HopRingBuffer(hop_size, num_hops)
+        self.input_overflows = 0  # overflows reported by the audio driver
+        self.processed = 0
+        self.error = None  # exception raised by process_hop, stops the worker
+        self.running = False
+        self.thread = None
+
+    def callback(self, in_data, frame_count, time_info, status):
+        if status & PA_INPUT_OVERFLOW:
+            self.input_overflows += 1
+        self.buffer.write(np.frombuffer(in_data, dtype=np.float32), frame_count)
+        return None, PA_CONTINUE
+
+    def start(self):
+        self.buffer.reset()
+        self.input_overflows, self.processed, self.error = 0, 0, None
+        self.running = True
+        self.thread = threading.Thread(target=self._work, daemon=True)
+        self.thread.start()
+
+    def stop(self, drain: bool=True):
+        """ stop the worker thread, after processing the buffered hops if drain """
+        self.running = False
+        if self.thread is not None:
+            if drain:
+                self.buffer.ready.set()
+            self.thread.join()
+            self.thread = None
+        if drain and self.error is None:
+            while self.buffer.available():
+                self._process_next()
+
+    def _process_next(self, timeout: float=None):
+        samples = self.buffer.read(timeout)
+        if samples is not None:
+            self.process_hop(samples)
+            self.buffer.release()
+            self.processed += 1
+
+    def _work(self):
+        try:
+            while self.running:
+                self._process_next(timeout=0.1)
+        except Exception as e:  # reported by the thread that owns the LiveInput
+            self.error = e
+            self.running = False
+
+    @property
+    def overruns(self) -> int:
+        return self.buffer.overruns
+
+    @property
+    def underruns(self) -> int:
+        return self.buffer.underruns
+
+
+class FakeStream:
+    """ Replacement of a pyaudio input stream for testing without a sound card: a thread calls
+    callback(in_data, frame_count, time_info, status) with frames_per_buffer samples of `samples` at a time,
+    in real time (realtime=True) or as fast as possible
+    """
+
+    def __init__(self, samples, samplerate: int, frames_per_buffer: int, callback, realtime: bool=True):
+        self.samples = np.ascontiguousarray(samples, dtype=np.float32)
+        self.samplerate = samplerate
+        self.frames_per_buffer = frames_per_buffer
+        self.callback = callback
+        self.realtime = realtime
+        self.thread = None
+        self.active = False
+
+    def start_stream(self):
+        self.active = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        start = time.perf_counter()
+        for pos in range(0, len(self.samples) - self.frames_per_buffer + 1, self.frames_per_buffer):
+            if not self.active:
+                break
+            if self.realtime:
+                delay = start + pos / self.samplerate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            in_data = self.samples[pos:pos + self.frames_per_buffer].tobytes()
+            _, flag = self.callback(in_data, self.frames_per_buffer, None, 0)
+            if flag != PA_CONTINUE:
+                break
+        self.active = False
+
+    def is_active(self) -> bool:
+        return self.active
+
+    def stop_stream(self):
+        self.active = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def close(self):
+        self.stop_stream()
+
+
+def open_microphone(live: LiveInput, samplerate: int, device: int=None):
+    """ (pyaudio instance, started input stream) feeding live.callback """
+    import pyaudio
+    p = pyaudio.PyAudio()
+    stream = p.open(format=pyaudio.paFloat32, channels=1, rate=samplerate, input=True, input_device_index=device,
+                    frames_per_buffer=live.hop_size, stream_callback=live.callback)
+    stream.start_stream()
+    return p, stream
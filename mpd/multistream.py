@@ -0,0 +1,234 @@
+"""
+batched detection for many concurrent streams with the same samplerate and hop size: the current hops of all streams
+are stacked into a (streams x hop_size) matrix and processed in one vectorized step, the per stream state is kept in
+arrays (one row per stream)
+- MultiStreamDetector: frame windows and spectra of all streams (SpectralFrontEnd), runs the onset and pitch detectors
+  below on them
+- MultiOnsetDetector: aubio's specflux / hfc / energy onset detector (adaptive whitening for specflux, log
+  compression, peak picking)
+- MultiPitchDetector: aubio's yin / yinfft pitch, smoothed with the weighted vote of AubioPitchDetector
+The outputs of every stream are the same as the ones of AubioOnsetDetector and AubioPitchDetector (up to float
+precision), e.g. to be passed on to a NoteTranscriber per stream (NoteTranscriber.update).
+"""
+
+import numpy as np
+
+from .utils import RingBuffer, shared_resource, lazy_import
+from .pitch import vote_weights
+from .spectral import SpectralFrontEnd
+from .peakpicking import biquad, WIN_POST, WIN_PRE
+from . import yin
+
+fft = lazy_import('scipy.fft')
+
+
+class MultiOnsetDetector:
+    """ onset detection of aubio.onset (specflux with its default whitening: relax time 100s, floor 1) """
+
+    def __init__(self, hop_size: int, frame_size: int=2048, minioi_ms: int=50, threshold: float=0.95,
+                 compression: float=2.0, silence: float=-54, method: str='specflux'):
+        if method not in ('specflux', 'hfc', 'energy'):
+            raise ValueError(f"multi stream mode is not available for onset method '{method}'")
+        self.method = method
+        self.hop_size = hop_size
+        self.buf_size = frame_size
+        self.minioi_ms = minioi_ms
+        self.threshold = threshold
+        self.compression = compression
+        self.silence = silence
+        self.relax_time = 100
+        self.floor = 1.
+
+    def create_detector(self, samplerate: int, num_streams: int):
+        self.samplerate = samplerate
+        self.window = yin.hanningz(self.buf_size)
+        self.decay = np.float32(0.001 ** (1. / (self.relax_time * samplerate / self.hop_size)))
+        self.minioi = int(np.floor(self.minioi_ms / 1000. * samplerate + .5))  # like aubio_onset_set_minioi_ms
+        self.delay = int(4.3 * self.hop_size)  # aubio's default delay
+        num_bins = self.buf_size // 2 + 1
+        self.peak_values = np.empty((num_streams, num_bins), dtype=np.float32)
+        self.previous = np.empty((num_streams, num_bins), dtype=np.float32)  # last whitened and compressed spectrum
+        self.keep = np.empty((num_streams, WIN_POST + WIN_PRE + 1), dtype=np.float32)  # last values of the odf
+        self.peek = np.empty((num_streams, 3), dtype=np.float32)  # last thresholded values
+        self.total_frames = np.empty(num_streams, dtype=np.int64)
+        self.last_onset = np.empty(num_streams, dtype=np.int64)
+        self.rows = np.arange(num_streams)
+        self.bin_weights = np.arange(1, num_bins + 1, dtype=np.float32)  # hfc
+        self.reset_stream(slice(None))
+
+    def reset_stream(self, idx):
+        """ start a new stream in row(s) idx """
+        self.peak_values[idx] = self.floor
+        self.previous[idx] = 0
+        self.keep[idx] = 0
+        self.peek[idx] = 0
+        self.total_frames[idx] = 0
+        self.last_onset[idx] = 0
+
+    def onset_function(self, frames):
+        """ detection function of the frames (aubio.onset.get_descriptor) """
+        return self.descriptor(np.abs(fft.rfft(frames * self.window, axis=-1)).astype(np.float32))
+
+    def descriptor(self, mag):
+        """ detection function of the magnitude spectra of the hanningz windowed frames (not modified) """
+        if self.method == 'specflux':
+            self.peak_values = np.maximum(mag, np.maximum(self.decay * self.peak_values, np.float32(self.floor)))
+            mag = mag / self.peak_values
+        if self.compression > 0:
+            mag = np.log(np.float32(self.compression) * mag + 1, dtype=np.float32)
+        if self.method == 'energy':
+            return np.square(mag).sum(axis=-1, dtype=np.float32)
+        if self.method == 'hfc':
+            return (mag * self.bin_weights).sum(axis=-1, dtype=np.float32)
+        odf = np.maximum(mag - self.previous, 0).sum(axis=-1, dtype=np.float32)
+        self.previous = mag
+        return odf
+
+    def process_next(self, frames, level) -> np.ndarray:
+        """ onset [samples] or 0 for every stream (AubioOnsetDetector.process_next), level: dB of the current hops """
+        return self.process_magnitude(np.abs(fft.rfft(frames * self.window, axis=-1)).astype(np.float32), level)
+
+    def process_magnitude(self, mag, level) -> np.ndarray:
+        """ process_next with the magnitude spectra of the current frames (e.g. SpectralFrontEnd.magnitude) """
+        odf = self.descriptor(mag)
+
+        # peak picking (aubio_peakpicker_do)
+        self.keep[:, :-1] = self.keep[:, 1:]
+        self.keep[:, -1] = odf
+        proc = biquad(biquad(self.keep)[:, ::-1])[:, ::-1]  # filtfilt
+        thresholded = proc[:, WIN_POST] - np.median(proc, axis=1) - \
+            proc.mean(axis=1, dtype=np.float32) * np.float32(self.threshold)
+        self.peek[:, :2] = self.peek[:, 1:]
+        self.peek[:, 2] = thresholded
+        s0, s1, s2 = self.peek[:, 0], self.peek[:, 1], self.peek[:, 2]
+        is_peak = (s1 > s0) & (s1 > s2) & (s1 > 0)
+
+        # onset decision (aubio_onset_do)
+        loud = level >= self.silence
+        result = np.zeros(len(odf), dtype=np.int64)
+        if is_peak.any():
+            with np.errstate(divide='ignore', invalid='ignore'):
+                pos = np.float32(1) + np.float32(.5) * (s0 - s2) / (s0 - np.float32(2) * s1 + s2)
+            new_onset = self.total_frames + np.floor(pos * np.float32(self.hop_size) + .5).astype(np.int64)
+            onset = is_peak & loud & (self.last_onset + self.minioi < new_onset)
+            self.last_onset[onset] = new_onset[onset]
+            result[onset] = new_onset[onset] - self.delay
+        start = ~is_peak & (self.total_frames <= self.delay) & loud  # aubio reports an onset at the start of a file
+        if start.any():
+            start &= (self.total_frames == 0) | (self.last_onset + self.minioi < self.total_frames)
+            self.last_onset[start] = self.total_frames[start] + self.delay
+            if self.delay // self.hop_size != 0:
+                result[start] = self.total_frames[start]
+        self.total_frames += self.hop_size
+        return result
+
+
+class MultiPitchDetector:
+    """ aubio.pitch (unit midi, rounded) and the weighted vote over the last history_length pitches of
+    AubioPitchDetector, the votes are added up for all streams at once
+    """
+
+    def __init__(self, method: str, hop_size: int, frame_size: int=4096, history_length: int=8, silence: float=-50,
+                 num_bins: int=128):
+        if method not in ('yin', 'yinfft'):
+            raise ValueError(f"multi stream mode is not available for pitch method '{method}'")
+        self.method = method
+        self.hop_size = hop_size
+        self.frame_size = frame_size
+        self.history_length = history_length
+        self.silence = silence
+        self.num_bins = num_bins
+        self.p_weights = vote_weights(history_length, frame_size, hop_size)
+
+    def create_detector(self, samplerate: int, num_streams: int):
+        self.samplerate = samplerate
+        self.weights = None
+        if self.method == 'yinfft':
+            self.weights = shared_resource(('yinfft_weights', samplerate, self.frame_size),
+                                           lambda: yin.yinfft_weights(samplerate, self.frame_size))
+        self.history = RingBuffer(self.history_length, np.int64, num_streams)
+        self.filled = np.empty(num_streams, dtype=np.int64)  # number of valid history entries
+        self.scores = np.empty((num_streams, self.num_bins))
+        self.rows = np.arange(num_streams)
+        self.reset_stream(slice(None))
+
+    def reset_stream(self, idx):
+        self.filled[idx] = 0
+
+    def raw_pitch(self, frames, level, spectrum=None):
+        """ rounded midi pitch (0: no pitch) of every frame, yinfft uses the spectrum of the frames if given """
+        if self.method == 'yinfft':
+            if spectrum is not None:
+                period, _ = yin.yinfft_spectrum(spectrum, self.samplerate, self.weights)
+            else:
+                period, _ = yin.yinfft(frames, self.samplerate, self.weights)
+        else:
+            period, _ = yin.yin(frames, self.samplerate)
+        midi = np.round(yin.period2midi(period, self.samplerate)).astype(np.int64)
+        midi[level < self.silence] = 0  # aubio checks the silence on the hop
+        return np.minimum(midi, self.num_bins - 1)
+
+    def process_next(self, frames, level, spectrum=None) -> np.ndarray:
+        """ smoothed pitch of every stream (AubioPitchDetector.process_next) """
+        pitch = self.raw_pitch(frames, level, spectrum)
+        self.history.write(pitch[:, None])
+        self.filled = np.minimum(self.filled + 1, self.history_length)
+        history = self.history.window()  # oldest first
+
+        # entry c of a history with n valid entries has the weight p_weights[c - (length - n)] (smoother warm-up)
+        length = self.history_length
+        offset = length - self.filled
+        scores = self.scores
+        scores[:] = 0
+        for c in range(length):
+            valid = offset <= c
+            scores[self.rows, history[:, c]] += np.where(valid, self.p_weights[np.maximum(c - offset, 0)], 0.)
+        s_max = scores.max(axis=1)
+        current_wins = scores[self.rows, pitch] >= s_max  # take last if two are equal
+        if current_wins.all():
+            return pitch
+        is_max = (scores[self.rows[:, None], history] == s_max[:, None]) & (np.arange(length) >= offset[:, None])
+        first = history[self.rows, np.argmax(is_max, axis=1)]  # first pitch in the history with the highest score
+        return np.where(current_wins, pitch, first)
+
+
+class MultiStreamDetector:
+    """ onset and pitch detection of num_streams streams, one hop of every stream per call of process_next """
+
+    def __init__(self, hop_size: int, od: MultiOnsetDetector=None, pds=()):
+        self.hop_size = hop_size
+        self.od = od
+        self.pds = list(pds)
+        sizes = [d.frame_size for d in self.pds] + ([od.buf_size] if od is not None else [])
+        self.frame_size = max(sizes + [hop_size])
+
+    def create_detector(self, samplerate: int, num_streams: int):
+        self.samplerate = samplerate
+        self.num_streams = num_streams
+        self.front_end = SpectralFrontEnd(self.hop_size, self.frame_size)
+        self.front_end.create_detector(samplerate, num_streams)
+        if self.od is not None:
+            self.od.create_detector(samplerate, num_streams)
+        for pd in self.pds:
+            pd.create_detector(samplerate, num_streams)
+
+    def reset_stream(self, idx):
+        """ start a new stream in row(s) idx (e.g. a new client) """
+        self.front_end.reset_stream(idx)
+        if self.od is not None:
+            self.od.reset_stream(idx)
+        for pd in self.pds:
+            pd.reset_stream(idx)
+
+    def process_next(self, hops):
+        """ hops: num_streams x hop_size, returns (onsets or None, [pitches of every pitch detector])
+        the spectrum of each frame size is computed once and shared by the onset and the yinfft pitch detectors
+        """
+        front = self.front_end
+        front.process_next(hops)
+        onsets = None
+        if self.od is not None:
+            onsets = self.od.process_magnitude(front.magnitude(self.od.buf_size), front.level)
+        return onsets, [pd.process_next(front.frames(pd.frame_size), front.level,
+                                        front.spectrum(pd.frame_size) if pd.method == 'yinfft' else None)
+                        for pd in self.pds]
@@ -3,7 +3,26 @@ from collections import deque
 import numpy as np
 
 import aubio
-import madmom
+
+from .utils import RingBuffer, shared_resource, lazy_import
+from .instrumentation import instrument_method, uninstrument_method
+from .spectral import SpectralFrontEnd
+from .multistream import MultiOnsetDetector
+from .peakpicking import PeakPicker, WIN_POST, WIN_PRE
+from . import yin
+
+madmom = lazy_import('madmom')  # imported by the first madmom detector
+ndimage = lazy_import('scipy.ndimage')
+
+
+def onset_outputs(num_hops: int, hops, positions):
+    """ per hop outputs of process_next (0 or the onset position [samples]) with the onsets `positions` reported at
+    the hops `hops`, the first one if several fall on the same hop
+    """
+    outputs = np.zeros(num_hops, dtype=np.int64)
+    for hop, position in zip(reversed(np.minimum(hops, num_hops - 1).tolist()), reversed(positions.tolist())):
+        outputs[hop] = position
+    return outputs
 
 
 class AbstractOnsetDetector:
@@ -20,6 +39,26 @@ class AbstractOnsetDetector:
     def process_next(self, samples) -> int:
         raise NotImplementedError("Abstract method implementation missing")
 
+    def process_silence(self, samples) -> int:
+        """ process_next of a hop below the silence threshold of the detector (see SilenceGate). Detectors may skip
+        the work, but have to return the same and give the same results for the following hops as process_next.
+        """
+        return self.process_next(samples)
+
+    def process_array(self, samples):
+        raise NotImplementedError("Abstract method implementation missing")
+
+    def close(self):
+        """ release the detector objects, create_detector has to be called before using the detector again """
+        self.onset = None
+
+    def instrument(self, stats, name: str='onset'):
+        """ record the duration of every process_next call in the histogram `name` of stats (an Instrumentation) """
+        instrument_method(self, 'process_next', stats.histogram(name))
+
+    def uninstrument(self):
+        uninstrument_method(self, 'process_next')
+
 
 class AubioOnsetDetector(AbstractOnsetDetector):
     def __init__(self, method: str, hop_size: int, frame_size: int=1024, minioi_ms: int=50):
@@ -36,13 +75,79 @@ class AubioOnsetDetector(AbstractOnsetDetector):
         self.onset.set_compression(self.compression)
         self.onset.set_silence(self.silence)
         #self.onset.set_awhitening()
+        # silent hops (process_silence) are only fed to aubio before the next loud hop, as many as are needed to fill
+        # its frame and the peak picker window, aubio's onset positions don't include the skipped ones
+        self.silent_hops = deque(maxlen=ceil(self.buf_size / self.hop_size) + WIN_POST + WIN_PRE + 1)
+        self.skipped = 0  # samples
+        self.hops = 0
 
     def process_next(self, samples) -> int:
+        self.hops += 1
+        if self.silent_hops:
+            for hop in self.silent_hops:
+                self.onset(hop)  # no onsets in silent hops
+            self.skipped -= len(self.silent_hops) * self.hop_size
+            self.silent_hops.clear()
         o = self.onset(samples)
         if o[0] != 0:
-            return self.onset.get_last()  # round(self.onset.get_last() / self.onset.samplerate * 1000)
+            return self.onset.get_last() + self.skipped  # round(self.onset.get_last() / self.onset.samplerate * 1000)
+        return 0
+
+    def process_silence(self, samples) -> int:
+        """ skips aubio (its whitening doesn't decay during the skipped hops, onsets after long silences may differ
+        slightly), except at the start, where aubio may report an onset at the first loud hop
+        """
+        if self.hops * self.hop_size <= self.onset.get_delay() + self.hop_size:
+            return self.process_next(samples)
+        self.hops += 1
+        self.silent_hops.append(np.array(samples, dtype=np.float32))  # the caller may reuse its buffer
+        self.skipped += self.hop_size
         return 0
 
+    def process_array(self, samples):
+        """ batch mode: process_next for all complete hops of `samples` on a freshly created detector (aubio's onset
+        detection runs hop by hop anyway)
+        """
+        self.create_detector(int(self.onset.samplerate))
+        samples = np.asarray(samples, dtype=np.float32)
+        num_hops = len(samples) // self.hop_size
+        hops = samples[:num_hops * self.hop_size].reshape(num_hops, self.hop_size)
+        return np.array([self.process_next(hop) for hop in hops], dtype=np.int64)
+
+
+class SpectralOnsetDetector(AbstractOnsetDetector):
+    """ aubio's specflux / hfc / energy onset detection (same onsets as AubioOnsetDetector up to float precision) on
+    the spectrum of a SpectralFrontEnd, that is shared with other detectors (e.g. a SpectralPitchDetector of the same
+    frame size: one fft per hop for both)
+    """
+
+    def __init__(self, front_end: SpectralFrontEnd, method: str='specflux', frame_size: int=2048,
+                 minioi_ms: int=50):
+        super().__init__(front_end.hop_size, frame_size, minioi_ms)
+        self.front_end = front_end
+        self.method = method
+        self.threshold = {'hfc': 0.3, 'energy': 0.9, 'specflux': 0.95}[self.method]
+        self.compression = 2.0
+        self.silence = -54
+
+    def create_detector(self, samplerate):
+        if self.buf_size > self.front_end.frame_size:
+            raise ValueError(f"frame size {self.buf_size} is larger than the one of the front end")
+        self.front_end.create_detector(samplerate)
+        # detection function of a single stream, the peak picking of one value per hop is faster in plain python
+        self.onset = MultiOnsetDetector(self.hop_size, self.buf_size, self.minioi_ms, self.threshold, self.compression,
+                                        self.silence, self.method)
+        self.onset.create_detector(samplerate, 1)
+        self.peak_picker = PeakPicker(self.hop_size, self.threshold, self.onset.minioi, self.silence, self.onset.delay)
+        self.hops = 0
+
+    def process_next(self, samples) -> int:
+        front = self.front_end
+        front.process_next(samples, self.hops)
+        self.hops += 1
+        odf = float(self.onset.descriptor(front.magnitude(self.buf_size))[0])
+        return self.peak_picker.process_next(odf, float(front.level[0]))
+
 
 class MadmomOnsetDetector(AbstractOnsetDetector):
     def __init__(self, hop_size: int, frame_size: int=2048, minioi_ms: int=50, fps=100, pre_avg=0.15, pre_max=0.01):
@@ -79,25 +184,99 @@ class MadmomFeatureOnsetDetector(MadmomOnsetDetector):
         else:
             self.fb = None
             self.log = None
+        self.diff_max_bins = 3
         self.buffer = None
 
     def create_detector(self, sample_rate):
+        """ online superflux: per hop only the newest frame is transformed and compared with the (maximum filtered)
+        frame `diff_frames` hops ago, which is equivalent to madmom's SpectralOnsetProcessor('superflux')
+        """
         super().create_detector(sample_rate)
-        odf = madmom.features.SpectralOnsetProcessor('superflux', num_bands=self.num_bands, sample_rate=sample_rate,
-                                                     log=self.log, filterbank=self.fb, frame_size=self.buf_size,
-                                                     hop_size=self.hop_size)
+        self.buffer = RingBuffer(self.buf_size)
+        self.window = np.hanning(self.buf_size).astype(np.float32)  # madmom STFT default window
+        self.filterbank = None
+        if self.fb is not None:
+            self.filterbank = shared_resource((self.fb, self.buf_size, sample_rate, self.num_bands),
+                                              self.create_filterbank)
+        num_bins = self.buf_size >> 1 if self.filterbank is None else self.filterbank.shape[1]
+
+        diff_frames = self.diff_frames()
+        self.history = np.zeros((diff_frames, num_bins), dtype=np.float32)  # maximum filtered previous frames
+        self.history_idx = 0
+        self.history_fill = 0
+
         peak = madmom.features.onsets.OnsetPeakPickingProcessor(threshold=self.threshold, combine=self.minioi_ms / 1000,
                                                                 online=True, fps=sample_rate / self.hop_size)
-        offset = int(self.buf_size / self.hop_size * 1.25)  # 5, 10
-        index = int(offset / 2) + 1  # 3, 6
-        self.buffer = np.zeros(offset*self.hop_size)
-        self.onset = lambda samples: self.process_onset(samples, odf, peak, index)
+        odf = np.zeros(1)
+        self.onset = lambda samples: peak(self.process_onset(samples, odf), reset=False)
 
-    def process_onset(self, samples, odf, peak, odf_index):
-        # update buffer with new samples
-        self.buffer = np.roll(self.buffer, -len(samples), axis=0)
-        self.buffer[-len(samples):] = samples
-        return peak(odf(self.buffer)[odf_index:odf_index + 1], reset=False)
+    def process_array(self, samples, chunk_hops: int=256):
+        """ batch mode: process_next for all complete hops of `samples` on a freshly created detector. The
+        detection function of all frames is computed at once and peak picked in one call (without pre/post windows
+        madmom's offline peak picking finds the same onsets as the online one)
+        """
+        if not self.sample_rate:
+            raise ValueError("create_detector has to be called before process_array (sets the samplerate)")
+        self.create_detector(self.sample_rate)
+        odf = self.detection_function(samples, chunk_hops)
+        fps = self.sample_rate / self.hop_size
+        peak = madmom.features.onsets.OnsetPeakPickingProcessor(threshold=self.threshold, combine=self.minioi_ms / 1000,
+                                                                fps=fps)
+        onsets = np.asarray(peak(odf))
+        onsets = onsets[onsets > 0]
+        positions = np.array([int(onset * self.sample_rate) for onset in onsets.tolist()], dtype=np.int64)
+        return onset_outputs(len(odf), np.round(onsets * fps).astype(np.int64), positions)
+
+    def detection_function(self, samples, chunk_hops: int=256):
+        """ odf of process_onset for all complete hops of `samples`, `chunk_hops` frames at once """
+        frames = yin.frame_matrix(np.asarray(samples, dtype=np.float32), self.buf_size, self.hop_size)
+        diff_frames = len(self.history)
+        odf = np.zeros(len(frames))
+        prev = None  # maximum filtered spectra of the diff_frames frames before the chunk
+        for start in range(0, len(frames), chunk_hops):
+            spec = np.abs(np.fft.rfft(frames[start:start + chunk_hops] * self.window, axis=-1)[:, :self.buf_size >> 1])
+            if self.filterbank is not None:
+                spec = np.dot(spec, self.filterbank)
+            if self.log is not None:
+                spec = self.log(spec + 1)
+            filtered = ndimage.maximum_filter1d(spec, self.diff_max_bins, axis=-1, mode='reflect')
+            if prev is not None:
+                filtered = np.concatenate((prev, filtered))
+            first = max(diff_frames - start, 0)  # zero until the history is filled
+            if first < len(spec):
+                reference = filtered[first + len(filtered) - len(spec) - diff_frames:len(filtered) - diff_frames]
+                odf[start + first:start + len(spec)] = np.maximum(spec[first:] - reference, 0).sum(axis=-1)
+            prev = filtered[-diff_frames:]
+        return odf
+
+    def create_filterbank(self):
+        bin_frequencies = madmom.audio.stft.fft_frequencies(self.buf_size >> 1, self.sample_rate)
+        return np.asarray(self.fb(bin_frequencies, num_bands=self.num_bands), dtype=np.float32)
+
+    def diff_frames(self, diff_ratio=0.5) -> int:
+        """ number of frames between the two compared spectra (same as madmom.audio.spectrogram._diff_frames) """
+        sample = np.argmax(self.window > diff_ratio * max(self.window))
+        diff_samples = len(self.window) / 2 - sample
+        return max(1, int(round(diff_samples / self.hop_size)))
+
+    def process_onset(self, samples, odf):
+        self.buffer.write(samples)
+        spec = np.abs(np.fft.rfft(self.buffer.window() * self.window)[:self.buf_size >> 1])
+        if self.filterbank is not None:
+            spec = np.dot(spec, self.filterbank)
+        if self.log is not None:
+            spec = self.log(spec + 1)
+
+        # positive differences to the maximum filtered frame diff_frames ago (zero until the history is filled)
+        prev = self.history[self.history_idx]
+        if self.history_fill < len(self.history):
+            self.history_fill += 1
+            odf[0] = 0
+        else:
+            odf[0] = np.maximum(spec - prev, 0).sum()
+        ndimage.maximum_filter1d(spec, self.diff_max_bins, output=prev, mode='reflect')
+        self.history_idx = (self.history_idx + 1) % len(self.history)
+        return odf
 
 
 class MadmomRNNOnsetDetector(MadmomOnsetDetector):
@@ -108,11 +287,37 @@ class MadmomRNNOnsetDetector(MadmomOnsetDetector):
         self.fps = fps
         self.pre_avg = 0
         self.pre_max = 0
+        self.processor = None
+        self.batch_processors = {}  # bidirectional: RNNOnsetProcessor of process_array
 
     def create_detector(self, samplerate):
+        """ the RNN (its models are loaded from disk) is kept and reset at the start of the next stream """
         super().create_detector(samplerate)
-        f = madmom.features.RNNOnsetProcessor(online=True, origin='online')  # hop_size=self.hop_size
+        if self.processor is None:
+            self.processor = madmom.features.RNNOnsetProcessor(online=True, origin='online')  # hop_size=self.hop_size
+        f = self.processor
         peak = madmom.features.OnsetPeakPickingProcessor(threshold=self.threshold, combine=self.minioi_ms/1000)
                                                          # pre_avg=self.pre_avg, fps=self.fps, online=True,
                                                          # pre_max=self.pre_max, reset=False)
-        self.onset = lambda samples: peak(f(samples, reset=False))
+        self.onset = lambda samples: peak(f(samples, reset=self.processed_samples == len(samples)))
+
+    def process_array(self, samples, bidirectional: bool=True):
+        """ batch mode: onsets of the whole signal in one call of madmom's RNN, the bidirectional one (offline, uses
+        the future context) or the online one, peak picked in one call. Per complete hop of `samples` like
+        process_next, the onsets are reported at the hop they are in.
+        """
+        processor = self.batch_processors.get(bidirectional)
+        if processor is None:
+            processor = madmom.features.RNNOnsetProcessor(online=not bidirectional)  # loads the models
+            self.batch_processors[bidirectional] = processor
+        signal = madmom.audio.signal.Signal(np.asarray(samples, dtype=np.float32), sample_rate=self.sample_rate)
+        peak = madmom.features.OnsetPeakPickingProcessor(threshold=self.threshold, combine=self.minioi_ms / 1000,
+                                                         pre_avg=self.pre_avg, pre_max=self.pre_max, fps=self.fps)
+        onsets = np.asarray(peak(processor(signal)))
+        positions = np.array([int(onset * self.sample_rate) for onset in onsets[onsets > 0].tolist()], dtype=np.int64)
+        return onset_outputs(len(samples) // self.hop_size, positions // self.hop_size, positions)
+
+    def close(self):
+        super().close()
+        self.processor = None
+        self.batch_processors.clear()
@@ -0,0 +1,141 @@
+"""
+numpy re-implementation of aubio's onset peak picking (peakpicker.c + the decision logic of onset.c)
+the onset detection function (aubio.onset.get_descriptor) is independent of threshold, minioi and silence,
+so these parameters can be replayed on stored detection function values without running the onset detector again
+- threshold_components / pick_peaks / replay_onsets: all hops of a file at once
+- PeakPicker: online, one hop of a single stream per call
+"""
+
+import math
+
+import numpy as np
+
+# b0, b1, b2, a1, a2 of aubio's peak picker: it sets (.16, .32, .16, -.5949, .2348), but aubio_filter_set_biquad
+# writes a2 into the slot of a1 and leaves a2 at zero, these are the coefficients that are actually used
+BIQUAD = (0.1600, 0.3200, 0.1600, 0.2348, 0.)
+WIN_POST, WIN_PRE = 5, 1
+
+
+def biquad(x, coeffs=BIQUAD):
+    """ filter every row of x (zero initial state, direct form 1 like aubio_filter_do, single precision output) """
+    b0, b1, b2, a1, a2 = coeffs
+    y = np.empty(x.shape, dtype=np.float32)
+    x1 = x2 = y1 = y2 = np.zeros(x.shape[:-1])
+    for j in range(x.shape[-1]):
+        x0 = x[..., j]
+        y0 = b0 * x0 + b1 * x1 - a1 * y1 + b2 * x2 - a2 * y2
+        y[..., j] = y0
+        x1, x2, y1, y2 = x0, x1, y0, y1
+    return y
+
+
+def threshold_components(odf):
+    """ split aubio's thresholded detection function into odf_proc[win_post] - median and mean, so that
+    thresholded = a - b * threshold can be computed for any threshold
+    """
+    length = WIN_POST + WIN_PRE + 1
+    padded = np.concatenate((np.zeros(length - 1, dtype=np.float32), np.asarray(odf, dtype=np.float32)))
+    windows = np.lib.stride_tricks.sliding_window_view(padded, length)
+    proc = biquad(biquad(windows)[..., ::-1])[..., ::-1]  # filtfilt
+    return proc[:, WIN_POST] - np.median(proc, axis=1), proc.mean(axis=1, dtype=np.float32)
+
+
+def pick_peaks(a, b, threshold: float):
+    """ aubio_peakpicker_do for all hops: peak position (around 1.) or 0 for each hop (single precision like aubio) """
+    thresholded = a - b * np.float32(threshold)
+    peek = np.concatenate((np.zeros(2, dtype=np.float32), thresholded))
+    s0, s1, s2 = peek[:-2], peek[1:-1], peek[2:]
+    is_peak = (s1 > s0) & (s1 > s2) & (s1 > 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pos = np.float32(1) + np.float32(.5) * (s0 - s2) / (s0 - np.float32(2) * s1 + s2)
+    return np.where(is_peak, pos, np.float32(0))
+
+
+def _biquad(x, coeffs=BIQUAD) -> list:
+    """ biquad of a short list of python floats """
+    b0, b1, b2, a1, a2 = coeffs
+    y = []
+    x1 = x2 = y1 = y2 = 0.
+    for x0 in x:
+        y0 = b0 * x0 + b1 * x1 - a1 * y1 + b2 * x2 - a2 * y2
+        y.append(y0)
+        x1, x2, y1, y2 = x0, x1, y0, y1
+    return y
+
+
+class PeakPicker:
+    """ aubio_peakpicker_do and the onset decision of aubio_onset_do for a single stream, one detection function value
+    per call. Works on python floats (double precision, aubio uses single precision), for one value per hop the
+    overhead of numpy calls would be larger than the work.
+    minioi and delay in samples (aubio.onset.get_minioi / get_delay)
+    """
+
+    def __init__(self, hop_size: int, threshold: float, minioi: int, silence: float, delay: int):
+        self.hop_size = hop_size
+        self.threshold = threshold
+        self.minioi = minioi
+        self.silence = silence
+        self.delay = delay
+        self.reset()
+
+    def reset(self):
+        self.keep = [0.] * (WIN_POST + WIN_PRE + 1)  # last values of the detection function
+        self.peek = [0., 0., 0.]  # last thresholded values
+        self.total_frames = 0
+        self.last_onset = 0
+
+    def process_next(self, odf: float, level: float) -> int:
+        """ onset [samples] (AubioOnsetDetector.process_next) or 0, level: dB of the current hop """
+        keep = self.keep
+        del keep[0]
+        keep.append(odf)
+        proc = _biquad(_biquad(keep)[::-1])[::-1]  # filtfilt
+        median = sorted(proc)[len(proc) // 2]
+        peek = self.peek
+        del peek[0]
+        peek.append(proc[WIN_POST] - median - sum(proc) / len(proc) * self.threshold)
+        s0, s1, s2 = peek
+
+        result = 0
+        total_frames = self.total_frames
+        loud = level >= self.silence
+        if s1 > s0 and s1 > s2 and s1 > 0:
+            if loud:
+                pos = 1. + .5 * (s0 - s2) / (s0 - 2 * s1 + s2)  # quadratic interpolation
+                new_onset = total_frames + int(math.floor(pos * self.hop_size + .5))
+                if self.last_onset + self.minioi < new_onset:
+                    self.last_onset = new_onset
+                    result = new_onset - self.delay
+        elif total_frames <= self.delay and loud:  # aubio reports an onset at the start of a file
+            if total_frames == 0 or self.last_onset + self.minioi < total_frames:
+                self.last_onset = total_frames + self.delay
+                if self.delay // self.hop_size != 0:
+                    result = total_frames
+        self.total_frames += self.hop_size
+        return result
+
+
+def replay_onsets(a, b, level_db, hop_size: int, threshold: float, minioi: int, silence: float, delay: int):
+    """ replays aubio_onset_do, returns for every hop what AubioOnsetDetector.process_next would have returned
+    (the onset position in samples or 0), minioi and delay in samples (aubio.onset.get_minioi / get_delay)
+    """
+    peaks = pick_peaks(a, b, threshold)
+    loud = level_db >= silence
+    result = np.zeros(len(peaks), dtype=np.int64)
+    last_onset = 0
+    first_hops = min(len(peaks), delay // hop_size + 1)  # aubio reports a first onset at the start of the file
+    for hop in np.union1d(np.arange(first_hops), np.nonzero(peaks)[0]).tolist():
+        total_frames = hop * hop_size
+        if peaks[hop] > 0:
+            if not loud[hop]:
+                continue
+            new_onset = total_frames + int(np.floor(float(peaks[hop] * np.float32(hop_size)) + .5))
+            if last_onset + minioi < new_onset:
+                last_onset = new_onset
+                result[hop] = last_onset - delay
+        elif total_frames <= delay and loud[hop]:
+            if total_frames == 0 or last_onset + minioi < total_frames:
+                last_onset = total_frames + delay
+                if delay // hop_size != 0:
+                    result[hop] = last_onset - delay
+    return result
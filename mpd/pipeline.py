@@ -0,0 +1,240 @@
+"""
+streaming note transcription: source -> (prefilter) -> onset detector + pitch detector(s) -> note events
+- NoteEvent: a detected note
+- NoteTranscriber: the per hop state machine of the scripts, pushed hop by hop (process_hop, or update with
+  precomputed detector outputs) or pulled from a source (transcribe), optionally behind a SilenceGate and with the
+  pitch evaluated only before the note reports (pitch_window)
+- create_prefilter: the lowpass biquad used in the scripts
+- create_transcriber: NoteTranscriber with the configuration of scripts/benchmark.py
+"""
+
+import aubio
+
+from .onset import AbstractOnsetDetector, AubioOnsetDetector
+from .pitch import AbstractPitchDetector, AubioPitchDetector, MultiResolutionPitchDetector
+from .gate import SilenceGate
+from .instrumentation import Instrumentation, timed, instrument_method, uninstrument_method
+
+
+class NoteEvent:
+    """ Note detected at `onset` [samples], reported `time` [samples] after the start of the stream """
+    __slots__ = ['onset', 'pitch', 'time', 'samplerate', 'confidence']
+
+    def __init__(self, onset: int, pitch: int, time: int, samplerate: int, confidence: float=0.):
+        self.onset = onset
+        self.pitch = pitch
+        self.time = time
+        self.samplerate = samplerate
+        self.confidence = confidence  # of the pitch detector, for the hop the note was reported
+
+    @property
+    def onset_ms(self) -> int:
+        return round(self.onset / self.samplerate * 1000)
+
+    @property
+    def latency_ms(self) -> float:
+        """ time between the onset and its report """
+        return (self.time - self.onset) / self.samplerate * 1000
+
+    def __repr__(self):
+        return f"NoteEvent({self.onset_ms}ms, {self.pitch})"
+
+
+def create_prefilter(method: str, samplerate: int):
+    """ 'lowpass': biquad (q=0.85, f=4700) for 44.1 and 48kHz, None: no filter """
+    if method is None:
+        return None
+    af = aubio.digital_filter(order=3)  # 7 for A-Filter, 5 for C-Filter, 3 for biquad
+    if method == 'lowpass':
+        if samplerate == 44100:
+            af.set_biquad(.07909669122050075, .1581933824410015, .07909669122050075, -1.1486877651747005, .4650745300567037)  # q=0.85, f=4700
+        elif samplerate == 48000:
+            af.set_biquad(.06844301311767674, .13688602623535348, .06844301311767674, -1.2193255395824403, .4930975920531473)  # q=0.85, f=4700
+            # self.filter_obj.set_biquad(0.01801576198494065, 0.0360315239698813,  0.01801576198494065, -1.4631087710168378, 0.5351718189566004)  # q=0.5, f=2350
+    return af
+
+
+class NoteTranscriber:
+    """ Onset and pitch detection of a stream of hops. A note is reported with the pitch detected `sample_limit`
+    samples after its onset (or right away if the onset was detected later than that). With a second pitch detector
+    pd2 (usually with a larger frame), its pitch is used for low notes (lowest_note <= pitch2 < pitch_low_threshold)
+    and if pd doesn't detect a pitch.
+    With a gate, the detectors get the hops the gate is closed for through process_silence (they may skip the work).
+    With a pitch_window, the pitch detectors are only evaluated for the last pitch_window hops up to each note report
+    (the pitch of the other hops is never used), they get the other hops through process_silence. The reported notes
+    are the same as long as pitch_window is at least the history length of the pitch smoothers and the onset is
+    detected at least pitch_window hops before the report.
+
+    The state is a few integers, per hop nothing is allocated apart from what the detectors allocate themselves.
+    """
+
+    def __init__(self, od: AbstractOnsetDetector, pd: AbstractPitchDetector, sample_limit: int,
+                 pd2: AbstractPitchDetector=None, lowest_note: int=35, pitch_low_threshold: int=47,
+                 prefilter: str=None, gate: SilenceGate=None, pitch_window: int=None):
+        self.od = od
+        self.pd = pd
+        self.pd2 = pd2
+        self.hop_size = od.hop_size
+        self.sample_limit = sample_limit
+        self.lowest_note = lowest_note
+        self.pitch_low_threshold = pitch_low_threshold
+        self.prefilter_method = prefilter
+        self.gate = gate
+        self.pitch_window = pitch_window  # hops, None: the pitch is evaluated for every hop
+        self.messages = []  # warnings about the onset detection
+        self.stats = None  # Instrumentation, see instrument()
+        self.reset(0)
+
+    def reset(self, samplerate: int, create_detectors: bool=True):
+        """ start a new stream, create_detectors=False if the detectors are not run by process_hop (see update) or
+        are created for the samplerate already
+        """
+        self.samplerate = samplerate
+        if samplerate and create_detectors:
+            self.od.create_detector(samplerate)
+            self.pd.create_detector(samplerate)
+            if self.pd2 is not None:
+                self.pd2.create_detector(samplerate)
+        self.prefilter = create_prefilter(self.prefilter_method, samplerate) if samplerate else None
+        if self.prefilter is not None and self.stats is not None:
+            self.prefilter = timed(self.stats.histogram('filter'), self.prefilter)
+        if self.gate is not None:
+            self.gate.reset()
+        self.total_read = 0
+        self.last_onset = -self.sample_limit
+        self.onset_pending = False
+        self.pitch = 0  # pitch of the last hop
+        self.confidence = 0.
+        self.messages.clear()
+
+    def close(self):
+        """ release the detector objects (reset creates them again) """
+        self.od.close()
+        self.pd.close()
+        if self.pd2 is not None:
+            self.pd2.close()
+        self.prefilter = None
+
+    def instrument(self, stats: Instrumentation):
+        """ record the durations of the stages (hop: all of process_hop, filter, onset, pitch, pitch_voting, pitch2,
+        pitch2_voting, read: the source in transcribe) and the time from the detected onset to the report of each
+        note (emit) in stats, until uninstrument() is called
+        """
+        self.stats = stats
+        instrument_method(self, 'process_hop', stats.histogram('hop'))
+        self.od.instrument(stats, 'onset')
+        self.pd.instrument(stats, 'pitch')
+        if self.pd2 is not None:
+            self.pd2.instrument(stats, 'pitch2')
+        if self.prefilter is not None:
+            self.prefilter = timed(stats.histogram('filter'), getattr(self.prefilter, '__wrapped__', self.prefilter))
+
+    def uninstrument(self):
+        self.stats = None
+        uninstrument_method(self, 'process_hop')
+        self.od.uninstrument()
+        self.pd.uninstrument()
+        if self.pd2 is not None:
+            self.pd2.uninstrument()
+        self.prefilter = getattr(self.prefilter, '__wrapped__', self.prefilter)
+
+    def process_hop(self, samples):
+        """ process the next hop, returns a NoteEvent or None """
+        if self.gate is not None and not self.gate.process_next(samples):
+            return self.skip_pitch(samples, self.od.process_silence(samples))
+        onset = self.od.process_next(samples)
+        if not self.pitch_needed(onset):
+            return self.skip_pitch(samples, onset)
+        if self.prefilter is not None:
+            samples = self.prefilter(samples)
+        pitch = self.pd.process_next(samples)
+        if self.pd2 is None:
+            return self.update(onset, pitch, confidence=self.pd.get_confidence())
+        pitch2 = self.pd2.process_next(samples)
+        return self.update(onset, pitch, pitch2, self.pd.get_confidence(), self.pd2.get_confidence())
+
+    def pitch_needed(self, onset: int) -> bool:
+        """ False if the pitch of the next hop (with the output `onset` of od) is outside the pitch_window """
+        if self.pitch_window is None:
+            return True
+        if onset > self.last_onset:
+            return self.total_read + (self.pitch_window + 1) * self.hop_size > onset + self.sample_limit
+        return self.onset_pending and \
+            self.total_read + (self.pitch_window + 1) * self.hop_size > self.last_onset + self.sample_limit
+
+    def skip_pitch(self, samples, onset: int):
+        """ process_hop without evaluating the pitch detectors (silent hop or outside the pitch_window) """
+        if self.prefilter is not None:
+            samples = self.prefilter(samples)  # keeps the filter state
+        pitch = self.pd.process_silence(samples)
+        pitch2 = self.pd2.process_silence(samples) if self.pd2 is not None else 0
+        return self.update(onset, pitch, pitch2)
+
+    def update(self, onset: int, pitch: int, pitch2: int=0, confidence: float=0., confidence2: float=0.):
+        """ state machine step with the outputs of the detectors for the next hop, returns a NoteEvent or None """
+        self.total_read += self.hop_size
+
+        if onset > self.last_onset:
+            if self.onset_pending:
+                o1 = round(onset / self.samplerate * 1000)
+                o2 = round(self.last_onset / self.samplerate * 1000)
+                self.messages.append(f"WARN: new onset {o1} found before old {o2} was processed! ignoring old.")
+            self.last_onset = onset
+            self.onset_pending = True
+        elif onset > 0:
+            self.messages.append("WARN: onset timings are not increasing monotonically")
+        if self.pd2 is not None and (self.lowest_note <= pitch2 < self.pitch_low_threshold or pitch == 0):
+            pitch, confidence = pitch2, confidence2
+        self.pitch = pitch
+        self.confidence = confidence
+
+        samples_past_limit_after_onset = self.total_read - self.sample_limit - self.last_onset
+        onset_before_time_limit = samples_past_limit_after_onset <= 0
+        next_iteration_exceeds_time_limit = samples_past_limit_after_onset + self.hop_size > 0
+        if (onset_before_time_limit or self.onset_pending) and next_iteration_exceeds_time_limit:
+            self.onset_pending = False
+            if not onset_before_time_limit and self.last_onset > 0:
+                self.messages.append(f"INFO: onset detection took longer than time limit! "
+                                     f"{self.total_read} {self.sample_limit} {self.last_onset}")
+            if pitch > 0 and self.last_onset > 0:
+                if self.stats is not None:
+                    self.stats.record('emit', (self.total_read - self.last_onset) / self.samplerate)
+                return NoteEvent(self.last_onset, pitch, self.total_read, self.samplerate, confidence)
+        return None
+
+    def transcribe(self, src, pitch_track: list=None, create_detectors: bool=True):
+        """ yields the NoteEvents of all complete hops of src (the detectors are created for its samplerate)
+        pitch_track: list to append the pitch of every hop to
+        create_detectors: False if the detectors are created for src already (e.g. by a DetectorPool)
+        """
+        self.reset(src.samplerate, create_detectors)
+        if self.stats is not None:
+            src.instrument(self.stats)
+        while True:
+            samples, read = src()
+            if read < src.hop_size:
+                break
+            event = self.process_hop(samples)
+            if pitch_track is not None:
+                pitch_track.append(self.pitch)
+            if event is not None:
+                yield event
+
+
+def create_transcriber(hop_size: int=512, history_length: int=13, multi_resolution: bool=False,
+                       silence_gate: bool=False, pitch_window: int=None) -> NoteTranscriber:
+    """ specflux onsets, yinfft pitches of 2048 and 4096 sample frames (see scripts/benchmark.py)
+    multi_resolution: one MultiResolutionPitchDetector, the 4096 frame is only evaluated when it may be needed
+    silence_gate: skip the detectors on quiet hops (SilenceGate)
+    pitch_window: evaluate the pitch only for this many hops up to each note report (the pitch detectors have a
+    history of 1 hop, so 1 gives the same notes), None: every hop
+    """
+    od = AubioOnsetDetector('specflux', hop_size, 2048, 50)
+    od.threshold = 0.75
+    gate = SilenceGate() if silence_gate else None
+    if multi_resolution:
+        pd = MultiResolutionPitchDetector('yinfft', hop_size, 2048, 4096, 1, 1)
+        return NoteTranscriber(od, pd, (history_length + 1) * hop_size, gate=gate, pitch_window=pitch_window)
+    pd = AubioPitchDetector('yinfft', hop_size, 2048, 1)
+    pd2 = AubioPitchDetector('yinfft', hop_size, 4096, 1)
+    return NoteTranscriber(od, pd, (history_length + 1) * hop_size, pd2, gate=gate, pitch_window=pitch_window)
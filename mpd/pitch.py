@@ -1,10 +1,22 @@
+from math import ceil
 from collections import deque
-import operator
 
 import numpy as np
 
 import aubio
-from .utils import sigmoid
+from .utils import sigmoid, RingBuffer, shared_resource
+from .smoothing import AbstractSmoother, WeightedVoteSmoother
+from .instrumentation import instrument_method, uninstrument_method
+from .spectral import SpectralFrontEnd
+from . import yin
+
+
+def vote_weights(history_length: int, frame_size: int, hop_size: int):
+    """ weights of the pitch history (oldest first): the pitches of frames still overlapping the onset count less """
+    hops = min(history_length, int(frame_size / hop_size) - 1)
+    weights = np.ones(history_length)
+    weights[:hops] = [sigmoid(x) for x in (np.arange(-4, 4, 8 / hops) - 0.5)]  # .1,.2,.3,.4,.75,1,1.2,1.3
+    return weights
 
 
 class AbstractPitchDetector:
@@ -20,32 +32,281 @@ class AbstractPitchDetector:
     def process_next(self, samples):
         raise NotImplementedError("Abstract method implementation missing")
 
+    def process_silence(self, samples):
+        """ process_next of a hop below the silence threshold of the detector (see SilenceGate). Detectors may skip
+        the work, but have to return the same and give the same results for the following hops as process_next.
+        """
+        return self.process_next(samples)
+
+    def process_array(self, samples):
+        raise NotImplementedError("Abstract method implementation missing")
+
+    def get_confidence(self) -> float:
+        raise NotImplementedError("Abstract method implementation missing")
+
+    def close(self):
+        """ release the detector objects, create_detector has to be called before using the detector again """
+        self.pitch = None
+
+    def instrument(self, stats, name: str='pitch'):
+        """ record the duration of every process_next call in the histogram `name` of stats (an Instrumentation) """
+        instrument_method(self, 'process_next', stats.histogram(name))
+
+    def uninstrument(self):
+        uninstrument_method(self, 'process_next')
+
 
 class AubioPitchDetector(AbstractPitchDetector):
     """ Onset- and Pitch detection using the aubio library directly
     (aubio onset and aubio pitch)
     """
 
-    def __init__(self, method: str, hop_size: int, frame_size=4096, history_length: int=8):
+    def __init__(self, method: str, hop_size: int, frame_size=4096, history_length: int=8,
+                 smoother: AbstractSmoother=None):
         super().__init__(hop_size, frame_size)
         self.method = method  # yinfft, yin, mcomb
 
-        hops = min(history_length, int(frame_size / hop_size) - 1)
-        self.p_weights = np.ones(history_length)
-        self.p_weights[:hops] = [sigmoid(x) for x in (np.arange(-4, 4, 8 / hops) - 0.5)]  # .1,.2,.3,.4,.75,1,1.2,1.3
-        self.history = deque(maxlen=len(self.p_weights))
+        self.p_weights = vote_weights(history_length, frame_size, hop_size)
+        self.smoother = smoother if smoother is not None else WeightedVoteSmoother(self.p_weights)
 
     def create_detector(self, samplerate):
+        self.samplerate = samplerate
         self.pitch = aubio.pitch(self.method, self.frame_size, self.hop_size, samplerate)
         self.pitch.set_unit('midi')
         # self.pitch.set_tolerance() 0.15 yin 0.85 yinfft
+        self.smoother.reset()
+        # silent hops (process_silence) are fed to aubio before the next loud hop, as many as fit into its frame
+        self.silent_hops = deque(maxlen=ceil(self.frame_size / self.hop_size) - 1)
 
     def process_next(self, samples):
+        if self.silent_hops:
+            for hop in self.silent_hops:
+                self.pitch(hop)
+            self.silent_hops.clear()
         pitch = int(round(self.pitch(samples)[0]))
-        self.history.append(pitch)
+        return self.smoother.process_next(pitch)
+
+    def process_silence(self, samples):
+        """ aubio reports no pitch for silent hops, only the frame of the next loud hop needs them """
+        self.silent_hops.append(np.array(samples, dtype=np.float32))  # the caller may reuse its buffer
+        return self.smoother.process_next(0)
+
+    def instrument(self, stats, name: str='pitch'):
+        """ pitch: process_next including the smoothing, `name`_voting: the smoother alone """
+        super().instrument(stats, name)
+        instrument_method(self.smoother, 'process_next', stats.histogram(name + '_voting'))
+
+    def uninstrument(self):
+        super().uninstrument()
+        uninstrument_method(self.smoother, 'process_next')
+
+    def get_confidence(self) -> float:
+        """ confidence of the raw pitch of the last hop """
+        return self.pitch.get_confidence()
+
+    def process_array(self, samples, chunk_hops: int=64):
+        """ batch mode: pitches of all complete hops of `samples` (same as calling process_next for each hop on a
+        freshly created detector) and the confidence of each raw pitch. Saves the per hop interpreter overhead, the
+        ffts cost about as much as in aubio (yin: ~4x faster than process_next, yinfft: ~1.5x)
+        """
+        raw, confidence = pitch_track(samples, self.method, self.frame_size, self.hop_size, self.samplerate, chunk_hops)
+        return self.smoother.process_array(np.round(raw).astype(int)), confidence
+
+
+class SpectralPitchDetector(AbstractPitchDetector):
+    """ aubio's yinfft (same pitches as AubioPitchDetector('yinfft') up to float precision) on the spectrum of a
+    SpectralFrontEnd, that is shared with other detectors (e.g. a SpectralOnsetDetector of the same frame size)
+    """
+
+    def __init__(self, front_end: SpectralFrontEnd, frame_size: int=4096, history_length: int=8,
+                 smoother: AbstractSmoother=None, silence: float=-50.):
+        super().__init__(front_end.hop_size, frame_size)
+        self.front_end = front_end
+        self.method = 'yinfft'
+        self.silence = silence  # [dB] of a hop, like aubio.pitch
+
+        self.p_weights = vote_weights(history_length, frame_size, self.hop_size)
+        self.smoother = smoother if smoother is not None else WeightedVoteSmoother(self.p_weights)
+
+    def create_detector(self, samplerate):
+        if self.frame_size > self.front_end.frame_size:
+            raise ValueError(f"frame size {self.frame_size} is larger than the one of the front end")
+        self.samplerate = samplerate
+        self.front_end.create_detector(samplerate)
+        self.weights = shared_resource(('yinfft_weights', samplerate, self.frame_size),  # spectral weighting
+                                       lambda: yin.yinfft_weights(samplerate, self.frame_size))
+        self.smoother.reset()
+        self.confidence = 0.
+        self.hops = 0
+
+    def process_silence(self, samples):
+        """ the spectrum is not needed, silent hops have no pitch """
+        self.front_end.process_next(samples, self.hops)
+        self.hops += 1
+        self.confidence = 0.
+        return self.smoother.process_next(0)
+
+    def process_next(self, samples):
+        front = self.front_end
+        front.process_next(samples, self.hops)
+        self.hops += 1
+        difference = yin.cmnd(yin.yinfft_difference(front.spectrum(self.frame_size)[0], self.weights))
+        period, self.confidence = yin.yinfft_pick_frame(difference, self.samplerate)
+        if front.level[0] < self.silence:
+            return self.smoother.process_next(0)
+        return self.smoother.process_next(int(round(yin.period2midi_frame(period, self.samplerate))))
+
+    def get_confidence(self) -> float:
+        """ confidence of the raw pitch of the last hop """
+        return self.confidence
+
+    def close(self):
+        super().close()
+        self.weights = None
+
+    def process_array(self, samples, chunk_hops: int=64):
+        """ batch mode, see AubioPitchDetector.process_array """
+        raw, confidence = pitch_track(samples, self.method, self.frame_size, self.hop_size, self.samplerate, chunk_hops,
+                                      self.silence)
+        return self.smoother.process_array(np.round(raw).astype(int)), confidence
+
+
+class MultiResolutionPitchDetector(AbstractPitchDetector):
+    """ pd and pd2 of the NoteTranscriber in one detector: a small and a large frame on one shared input buffer.
+    The large frame (resolves low notes) is only evaluated if the small one reports a note below large_below (default:
+    an octave above pitch_low_threshold, the small frame tends to report low notes an octave too high), no pitch or a
+    confidence below min_confidence. Its pitch replaces the small one for low notes
+    (lowest_note <= pitch2 < pitch_low_threshold) and if the small frame has no pitch. Silent hops skip the large
+    frame, it would report no pitch as well.
+    The large smoother only sees the evaluated frames (same result as two detectors for large_history_length 1).
+    """
+
+    def __init__(self, method: str, hop_size: int, frame_size: int=2048, large_frame_size: int=4096,
+                 history_length: int=13, large_history_length: int=1, lowest_note: int=35,
+                 pitch_low_threshold: int=47, large_below: int=None, min_confidence: float=None,
+                 silence: float=-50.):
+        super().__init__(hop_size, frame_size)
+        self.method = method  # yinfft, yin
+        self.large_frame_size = large_frame_size
+        self.lowest_note = lowest_note
+        self.pitch_low_threshold = pitch_low_threshold
+        self.large_below = large_below if large_below is not None else pitch_low_threshold + 12
+        self.min_confidence = min_confidence  # None: not used (aubio's yinfft confidence is not normalized, it is
+        # often < 0 for clean notes)
+        self.silence = silence  # [dB] of a hop, like aubio.pitch
+
+        self.p_weights = vote_weights(history_length, frame_size, hop_size)
+        self.smoother = WeightedVoteSmoother(self.p_weights)
+        self.large_smoother = WeightedVoteSmoother(vote_weights(large_history_length, large_frame_size, hop_size))
+
+    def create_detector(self, samplerate):
+        self.samplerate = samplerate
+        # hop = frame: every call gets a whole frame of the shared buffer, silence is checked on the hop here
+        self.pitch = aubio.pitch(self.method, self.frame_size, self.frame_size, samplerate)
+        self.large_pitch = aubio.pitch(self.method, self.large_frame_size, self.large_frame_size, samplerate)
+        for p in (self.pitch, self.large_pitch):
+            p.set_unit('midi')
+            p.set_silence(-200.)
+        self.buffer = RingBuffer(max(self.frame_size, self.large_frame_size))
+        self.smoother.reset()
+        self.large_smoother.reset()
+        self.confidence = 0.
+        self.hops = 0
+        self.large_hops = 0  # hops the large frame was evaluated for
+
+    def close(self):
+        super().close()
+        self.large_pitch = None
+
+    def process_next(self, samples):
+        self.buffer.write(samples)
+        self.hops += 1
+        if aubio.silence_detection(samples, self.silence):
+            self.confidence = 0.
+            return self.smoother.process_next(0)
+        pitch = self.smoother.process_next(int(round(self.pitch(self.buffer.window(self.frame_size))[0])))
+        self.confidence = self.pitch.get_confidence()
+        if pitch < self.large_below or (self.min_confidence is not None and self.confidence < self.min_confidence):
+            pitch2 = self.process_large()
+            if self.lowest_note <= pitch2 < self.pitch_low_threshold or pitch == 0:
+                pitch = pitch2
+                self.confidence = self.large_pitch.get_confidence()
+        return pitch
+
+    def process_silence(self, samples):
+        """ only the buffer is updated, silent hops have no pitch """
+        self.buffer.write(samples)
+        self.hops += 1
+        self.confidence = 0.
+        return self.smoother.process_next(0)
+
+    def process_large(self):
+        """ smoothed pitch of the large frame of the current buffer """
+        self.large_hops += 1
+        pitch = self.large_pitch(self.buffer.window(self.large_frame_size))[0]
+        return self.large_smoother.process_next(int(round(pitch)))
+
+    def get_confidence(self) -> float:
+        """ confidence of the raw pitch (of the frame whose pitch was used) of the last hop """
+        return self.confidence
+
+    def instrument(self, stats, name: str='pitch'):
+        """ pitch: process_next, `name`_large: evaluations of the large frame """
+        super().instrument(stats, name)
+        instrument_method(self, 'process_large', stats.histogram(name + '_large'))
+
+    def uninstrument(self):
+        super().uninstrument()
+        uninstrument_method(self, 'process_large')
+
+    def process_array(self, samples, chunk_hops: int=64):
+        """ batch mode: pitches and confidences of all complete hops of `samples` (same as process_next on a freshly
+        created detector, up to float precision of the confidence), the large frame is computed for all hops
+        """
+        raw, confidence = pitch_track(samples, self.method, self.frame_size, self.hop_size, self.samplerate, chunk_hops,
+                                      self.silence)
+        raw2, confidence2 = pitch_track(samples, self.method, self.large_frame_size, self.hop_size, self.samplerate,
+                                        chunk_hops, self.silence)
+        silent = yin.level_db(np.asarray(samples, dtype=np.float32)[:len(raw) * self.hop_size]
+                              .reshape(len(raw), self.hop_size)) < self.silence
+        pitch = self.smoother.process_array(np.round(raw).astype(int))
+        confidence[silent] = 0.
+        large = ~silent & (pitch < self.large_below)
+        if self.min_confidence is not None:
+            large |= ~silent & (confidence < self.min_confidence)
+        pitch2 = np.zeros_like(pitch)
+        pitch2[large] = self.large_smoother.process_array(np.round(raw2[large]).astype(int))
+        use2 = large & (((self.lowest_note <= pitch2) & (pitch2 < self.pitch_low_threshold)) | (pitch == 0))
+        pitch[use2] = pitch2[use2]
+        confidence[use2] = confidence2[use2]
+        return pitch, confidence
+
+
+def pitch_track(samples, method: str, frame_size: int, hop_size: int, samplerate: int, chunk_hops: int=64,
+                silence: float=-50):
+    """ raw midi pitch (not rounded, 0 = no pitch) and confidence for every complete hop of `samples`, computed for
+    `chunk_hops` frames at once (in single precision, like aubio). Matches aubio.pitch(method, frame_size, hop_size,
+    samplerate) with unit 'midi' up to float precision. Note: aubio itself reports a confidence of 0 for most yinfft frames.
+    """
+    if method not in ('yin', 'yinfft'):
+        raise ValueError(f"batch mode is not available for pitch method '{method}'")
+    samples = np.asarray(samples, dtype=np.float32)
+    frames = yin.frame_matrix(samples, frame_size, hop_size)
+    num_hops = frames.shape[0]
+    hops = samples[:num_hops * hop_size].reshape(num_hops, hop_size)
+    weights = None
+    if method == 'yinfft':
+        weights = shared_resource(('yinfft_weights', samplerate, frame_size),
+                                  lambda: yin.yinfft_weights(samplerate, frame_size))
 
-        pitch_candidates = {}
-        for i in range(len(self.history)):
-            pitch_candidates[self.history[i]] = pitch_candidates.get(self.history[i], 0) + self.p_weights[i]
-        p_max = max(pitch_candidates.items(), key=operator.itemgetter(1))[0]
-        return pitch if pitch_candidates[pitch] >= pitch_candidates[p_max] else p_max  # take last if two are equal
+    midi, confidence = np.zeros(num_hops), np.zeros(num_hops)
+    for start in range(0, num_hops, chunk_hops):
+        chunk = frames[start:start + chunk_hops]
+        if method == 'yinfft':
+            period, conf = yin.yinfft(chunk, samplerate, weights)
+        else:
+            period, conf = yin.yin(chunk, samplerate)
+        midi[start:start + len(chunk)] = yin.period2midi(period, samplerate)
+        confidence[start:start + len(chunk)] = conf
+    midi[yin.level_db(hops) < silence] = 0  # aubio checks the silence on the hop, not the whole frame
+    return midi, confidence
@@ -0,0 +1,60 @@
+"""
+reuse of detectors across files and streams
+- DetectorPool: idle detectors keyed by their configuration (class, method, frame and hop size and the other
+  parameters, see mpd.cache.detector_params) and the samplerate, handed out reset (create_detector). A reused detector
+  keeps what it loaded (madmom's RNN models), the read only parts (filterbanks, spectral weights) are shared by all
+  detectors of the process anyway (mpd.utils.shared_resource).
+  The aubio objects have no reset, create_detector constructs them again (cheap compared to the models).
+"""
+
+import copy
+import json
+from collections import defaultdict
+
+from .cache import detector_params
+
+
+class DetectorPool:
+    """ acquire(detector, samplerate) with a detector that wasn't created yet (the configuration, e.g. the one passed
+    to a run_files worker) returns an idle detector of the same configuration or a copy of it, release() takes it back
+    after the file / stream. Not thread safe, use one pool per thread. Detectors sharing a SpectralFrontEnd would
+    get a copy of it each, they can't be pooled.
+    """
+
+    def __init__(self, max_idle: int=16):
+        self.max_idle = max_idle  # per configuration
+        self.idle = defaultdict(list)
+        self.keys = {}  # id of the handed out detectors: key
+        self.created = 0
+        self.reused = 0
+
+    @staticmethod
+    def key(detector, samplerate: int) -> str:
+        return json.dumps([detector_params(detector), samplerate], sort_keys=True)
+
+    def acquire(self, detector, samplerate: int):
+        key = self.key(detector, samplerate)
+        idle = self.idle.get(key)
+        if idle:
+            detector = idle.pop()
+            self.reused += 1
+        else:
+            detector = copy.deepcopy(detector)  # the configuration may be acquired again before the release
+            self.created += 1
+        detector.create_detector(samplerate)
+        self.keys[id(detector)] = key
+        return detector
+
+    def release(self, detector):
+        idle = self.idle[self.keys.pop(id(detector))]
+        if len(idle) < self.max_idle:
+            idle.append(detector)
+        else:
+            detector.close()
+
+    def clear(self):
+        """ close all idle detectors """
+        for idle in self.idle.values():
+            for detector in idle:
+                detector.close()
+        self.idle.clear()
@@ -0,0 +1,105 @@
+"""
+corpus runner: processes the files of a benchmark corpus in parallel
+- find_files: walks the benchmark folders (same order as a serial os.walk loop), also inside of HDF5 containers
+- read_csv: rows of a ground truth csv file (or csv dataset of a HDF5 container)
+- run_files: fans the files out to a process pool (longest files first) and yields the results in input order
+"""
+
+import os
+import csv
+from multiprocessing import Pool
+
+from .source import HDF5_EXTENSIONS, HDF5_SEPARATOR, open_hdf5, hdf5_datasets, split_hdf5_path
+
+
+def find_files(folders, extension: str='.wav', companion: str=None, only: str=None, containers: bool=True):
+    """ yields the paths of all files in `folders` ending with `extension`
+    companion: only yield files that have a file with this extension next to them (e.g. 'csv' ground truth)
+    only: only yield files with this file name
+    containers: also yield the matching datasets of HDF5 containers (in the folders or given directly instead of a
+    folder) as 'container.hdf5::dataset', a companion then has to be a dataset of the same container
+    """
+    for folder in folders:
+        if containers and os.path.isfile(folder) and folder.endswith(HDF5_EXTENSIONS):
+            yield from find_datasets(folder, extension, companion, only)
+            continue
+        for subdir, dirs, files in os.walk(folder):
+            for file in files:
+                path = os.path.join(subdir, file)
+                if containers and path.endswith(HDF5_EXTENSIONS):
+                    yield from find_datasets(path, extension, companion, only)
+                    continue
+                if only is not None and file != only:
+                    continue
+                if not path.endswith(extension):
+                    continue
+                if companion is not None and not os.path.exists(path[:-len(extension) + 1] + companion):
+                    continue
+                yield path
+
+
+def find_datasets(path: str, extension: str='.wav', companion: str=None, only: str=None):
+    """ find_files for the datasets of a HDF5 container """
+    names = hdf5_datasets(path)
+    available = set(names)
+    for name in names:
+        if only is not None and name.split('/')[-1] != only:
+            continue
+        if not name.endswith(extension):
+            continue
+        if companion is not None and name[:-len(extension) + 1] + companion not in available:
+            continue
+        yield path + HDF5_SEPARATOR + name
+
+
+def read_csv(path: str):
+    """ rows of a csv file, or of a (2D) dataset 'container.hdf5::name.csv' """
+    hdf5_path = split_hdf5_path(path)
+    if hdf5_path is not None:
+        container, name = hdf5_path
+        return open_hdf5(container)[name][()].tolist()
+    with open(path, mode='r') as f:
+        return list(csv.reader(f, delimiter=','))
+
+
+def file_size(path: str) -> int:
+    """ size of a file or dataset in bytes, 0 if it does not exist (yet, e.g. a file that is generated) """
+    hdf5_path = split_hdf5_path(path)
+    if hdf5_path is not None:
+        container, name = hdf5_path
+        return open_hdf5(container)[name].nbytes
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+class _IndexedTask:
+    def __init__(self, process_file):
+        self.process_file = process_file
+
+    def __call__(self, task):
+        idx, path = task
+        return idx, self.process_file(path)
+
+
+def run_files(process_file, paths, processes: int=None):
+    """ yields (path, process_file(path)) for all paths, in the order of `paths`
+
+    process_file has to be picklable (a module level function or a functools.partial of one), every worker process
+    gets its own copy of the arguments, so detectors should be created (create_detector) inside of process_file.
+    The files are scheduled by size, largest first, results are yielded as soon as all previous ones are available.
+    processes: number of worker processes (None: one per core, 1: run serially in this process)
+    """
+    paths = list(paths)
+    if processes == 1 or len(paths) <= 1:
+        for path in paths:
+            yield path, process_file(path)
+        return
+
+    order = sorted(range(len(paths)), key=lambda i: file_size(paths[i]), reverse=True)
+    results = {}
+    next_idx = 0
+    with Pool(processes) as pool:
+        for idx, result in pool.imap_unordered(_IndexedTask(process_file), [(i, paths[i]) for i in order]):
+            results[idx] = result
+            while next_idx in results:
+                yield paths[next_idx], results.pop(next_idx)
+                next_idx += 1
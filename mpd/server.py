@@ -0,0 +1,129 @@
+"""
+transcription service: clients stream float32 PCM over TCP and receive binary note events
+protocol (little endian):
+- client -> server: HELLO (magic, samplerate), then the mono float32 samples, end of stream: shutdown of the
+  sending side (EOF)
+- server -> client: HELLO (magic, hop_size), then one EVENT per note (onset [samples], time [samples] at which the
+  note was reported, midi pitch, confidence)
+- TranscriptionServer: asyncio server, the detectors of finished sessions are reused for new ones
+- read_events: client side parsing of the events
+"""
+
+import asyncio
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .pipeline import NoteTranscriber, create_transcriber
+
+MAGIC = b'MPD1'
+HELLO = struct.Struct('<4sI')
+EVENT = struct.Struct('<qqhf')
+
+
+def _process_block(transcriber: NoteTranscriber, block, out: bytearray):
+    """ process the hops (rows) of block, appends the packed events to out, runs in the executor """
+    for samples in block:
+        event = transcriber.process_hop(samples)
+        if event is not None:
+            out += EVENT.pack(event.onset, event.time, event.pitch, event.confidence)
+
+
+class TranscriptionServer:
+    """ One NoteTranscriber per connection. The DSP of all connections runs in the executor (all hops received so
+    far, up to batch_hops per call) so the event loop stays responsive. While a batch is processed nothing more is
+    read from that client (back-pressure through TCP). Transcribers of closed sessions are kept (up to max_idle)
+    and reset for the next session instead of creating new detector objects.
+    """
+
+    def __init__(self, hop_size: int=512, factory=create_transcriber, batch_hops: int=8, max_idle: int=64,
+                 executor: ThreadPoolExecutor=None):
+        self.hop_size = hop_size
+        self.factory = factory  # hop_size -> NoteTranscriber
+        self.batch_hops = batch_hops
+        self.max_idle = max_idle
+        self.executor = executor if executor is not None else ThreadPoolExecutor(1, thread_name_prefix='mpd')
+        self.idle = []  # transcribers of closed sessions
+        self.sessions = 0  # open sessions
+        self.created = 0  # transcribers created
+        self.server = None
+
+    def acquire(self) -> NoteTranscriber:
+        if self.idle:
+            return self.idle.pop()
+        self.created += 1
+        return self.factory(self.hop_size)
+
+    def release(self, transcriber: NoteTranscriber):
+        if len(self.idle) < self.max_idle:
+            self.idle.append(transcriber)
+        else:
+            transcriber.close()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            magic, samplerate = HELLO.unpack(await reader.readexactly(HELLO.size))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+            return
+        if magic != MAGIC or not samplerate:
+            writer.close()
+            return
+        writer.write(HELLO.pack(MAGIC, self.hop_size))
+
+        transcriber = self.acquire()
+        self.sessions += 1
+        running = None  # executor future of the last call using the transcriber
+        try:
+            running = self.executor.submit(transcriber.reset, samplerate)
+            await asyncio.wrap_future(running)
+            hop_bytes = self.hop_size * 4
+            pending = bytearray()
+            out = bytearray()
+            eof = False
+            while not eof:
+                data = await reader.read(hop_bytes * self.batch_hops)
+                eof = not data
+                pending += data
+                num_hops = len(pending) // hop_bytes
+                if num_hops:
+                    block = np.frombuffer(bytes(pending[:num_hops * hop_bytes]), dtype='<f4')
+                    del pending[:num_hops * hop_bytes]
+                    running = self.executor.submit(_process_block, transcriber, block.reshape(num_hops, self.hop_size),
+                                                   out)
+                    await asyncio.wrap_future(running)
+                    if out:
+                        writer.write(bytes(out))
+                        out.clear()
+                        await writer.drain()
+            writer.write_eof()
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.sessions -= 1
+            if running is None or running.done():
+                self.release(transcriber)
+            else:  # cancelled during a batch: the executor still uses the transcriber, it isn't reused
+                running.add_done_callback(lambda _: transcriber.close())
+            writer.close()
+
+    async def start(self, host: str='127.0.0.1', port: int=8765) -> asyncio.AbstractServer:
+        self.server = await asyncio.start_server(self.handle, host, port)
+        return self.server
+
+    async def serve_forever(self, host: str='127.0.0.1', port: int=8765):
+        server = await self.start(host, port)
+        async with server:
+            await server.serve_forever()
+
+
+async def read_events(reader: asyncio.StreamReader):
+    """ async generator of (onset, time, pitch, confidence) tuples until the server closes the stream """
+    while True:
+        try:
+            data = await reader.readexactly(EVENT.size)
+        except asyncio.IncompleteReadError:
+            return
+        yield EVENT.unpack(data)
@@ -0,0 +1,122 @@
+from collections import deque
+
+import numpy as np
+
+
+class AbstractSmoother:
+    """ Smooths a stream of (rounded) midi pitches over the last `history_length` hops """
+
+    def __init__(self, history_length: int):
+        self.history_length = history_length
+
+    def reset(self):
+        raise NotImplementedError("Abstract method implementation missing")
+
+    def process_next(self, pitch: int) -> int:
+        raise NotImplementedError("Abstract method implementation missing")
+
+    def process_array(self, pitches):
+        raise NotImplementedError("Abstract method implementation missing")
+
+
+class WeightedVoteSmoother(AbstractSmoother):
+    """ Weighted majority vote over the pitch history: every pitch in the history gets the weight of its position
+    (oldest first), the pitch with the highest sum wins. On a tie the current pitch wins, otherwise the pitch that
+    appears first in the history.
+
+    process_next keeps the history in a deque and the votes of all positions with weight 1 in a dict (pitch: count),
+    together with the number of pitches per count, so their best count is known without a scan. Per hop only the few
+    leading positions with other weights are added up, all in plain Python (numpy calls cost more than they save on a
+    dozen pitches). process_array scores whole chunks of hops in a (hops x num_bins) matrix, both clip pitches above
+    num_bins - 1 so they give the same results.
+    """
+
+    def __init__(self, weights, num_bins: int=128):
+        super().__init__(len(weights))
+        self.weights = weights
+        self.num_bins = num_bins
+        self.reset()
+
+    def reset(self):
+        weights = [float(w) for w in self.weights]
+        not_one = [i for i, w in enumerate(weights) if w != 1]
+        self.ramp = not_one[-1] + 1 if not_one else 0  # leading positions with weights != 1
+        self.ramp_weights = weights[:self.ramp]
+        self.history = deque(maxlen=self.history_length)  # oldest first
+        self.counts = {}  # pitch: votes of the positions >= ramp (weight 1)
+        self.num_counts = [0] * (self.history_length + 1)  # count: number of pitches with that many votes
+        self.max_count = 0
+
+    def push(self, pitch: int):
+        history = self.history
+        counts = self.counts
+        num_counts = self.num_counts
+        if len(history) == self.history_length:  # drop the oldest, all others move one position forward
+            if self.ramp < self.history_length:
+                left = history[self.ramp]  # leaves the weight 1 positions (the oldest one if there is no ramp)
+                count = counts[left]
+                num_counts[count] -= 1
+                if count == 1:
+                    del counts[left]
+                else:
+                    counts[left] = count - 1
+                    num_counts[count - 1] += 1
+                if count == self.max_count and not num_counts[count]:
+                    self.max_count = count - 1
+            history.popleft()
+        if len(history) >= self.ramp:
+            count = counts.get(pitch, 0)
+            num_counts[count] -= 1  # num_counts[0] is not used
+            counts[pitch] = count + 1
+            num_counts[count + 1] += 1
+            if count + 1 > self.max_count:
+                self.max_count = count + 1
+        history.append(pitch)
+
+    def process_next(self, pitch: int) -> int:
+        pitch = min(pitch, self.num_bins - 1)
+        self.push(pitch)
+
+        history = self.history
+        counts = self.counts
+        scores = {}  # pitches of the ramp positions, in history order like the summed vote
+        for p, weight in zip(history, self.ramp_weights):
+            scores[p] = scores.get(p, 0.) + weight
+        s_max = self.max_count  # a pitch of the ramp with the most votes has a higher score anyway
+        for p, score in scores.items():
+            score += counts.get(p, 0)
+            scores[p] = score
+            if score > s_max:
+                s_max = score
+        if (scores[pitch] if pitch in scores else counts[pitch]) >= s_max:
+            return pitch  # take last if two are equal
+        for p in history:  # first pitch in history with the highest score
+            if (scores[p] if p in scores else counts[p]) == s_max:
+                return p
+
+    def process_array(self, pitches, chunk_size: int=4096):
+        """ smooth a whole pitch track at once (same result as process_next for each pitch on a reset smoother) """
+        length = self.history_length
+        pitches = np.minimum(np.asarray(pitches, dtype=np.int64), self.num_bins - 1)
+        weights = np.asarray(self.weights, dtype=np.float64)
+        padded = np.concatenate((np.zeros(length - 1, dtype=np.int64), pitches))
+        windows = np.lib.stride_tricks.sliding_window_view(padded, length)  # row t: history at hop t, oldest first
+
+        result = np.empty(len(pitches), dtype=np.int64)
+        for start in range(0, len(pitches), chunk_size):
+            window = windows[start:start + chunk_size]
+            t = np.arange(start, start + len(window))
+            # while the history is not full, its entries use the first weights
+            pos = np.arange(length)[None, :] - np.maximum(0, length - 1 - t)[:, None]
+            valid = pos >= 0
+            w = np.where(valid, weights[np.maximum(pos, 0)], 0.)
+
+            rows = np.arange(len(window))[:, None]
+            scores = np.zeros((len(window), self.num_bins))
+            np.add.at(scores, (np.broadcast_to(rows, window.shape), window), w)
+            s_max = scores.max(axis=1)
+            current = window[:, -1]
+            first_max = np.argmax((scores[rows, window] == s_max[:, None]) & valid, axis=1)
+            result[start:start + len(window)] = np.where(scores[rows[:, 0], current] >= s_max, current,
+                                                         window[rows[:, 0], first_max])
+        return result
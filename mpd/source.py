@@ -1,48 +1,185 @@
-from aubio import source as aubio_source
-from wavio import read as wavio_read
+import os
+import struct
 from wave import Error as WaveError
-from scipy.io.wavfile import read as scipy_read
 import numpy as np
 
+from .instrumentation import instrument_call, uninstrument_call
+
+HDF5_SEPARATOR = '::'  # container.hdf5::dataset addresses a recording inside of a HDF5 container
+HDF5_EXTENSIONS = ('.hdf5', '.h5')
+HDF5_SAMPLERATE = 44100  # if a dataset has no samplerate attribute (like the onset datasets)
+HDF5_MAGIC = b'\x89HDF\r\n\x1a\n'
+
+
+def read_wav_header(f):
+    """ ((format tag, channels, samplerate, byte rate, block align, bits per sample), data offset, data size) of an
+    opened wav file
+    """
+    riff, _, wave = struct.unpack('<4sI4s', f.read(12))
+    if riff != b'RIFF' or wave != b'WAVE':
+        raise ValueError("Not a RIFF/WAVE file")
+    fmt = None
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            raise ValueError("No data chunk found")
+        chunk_id, size = struct.unpack('<4sI', header)
+        if chunk_id == b'fmt ':
+            chunk = f.read(size)
+            if len(chunk) < 16:
+                raise ValueError("Invalid fmt chunk")
+            fmt = list(struct.unpack('<HHIIHH', chunk[:16]))
+            if fmt[0] == 0xFFFE and size >= 26:  # extensible: format tag is the start of the sub format
+                fmt[0] = struct.unpack('<H', chunk[24:26])[0]
+        elif chunk_id == b'data':
+            if fmt is None:
+                raise ValueError("Data chunk before fmt chunk")
+            return fmt, f.tell(), size
+        else:
+            f.seek(size, 1)
+        if size % 2:
+            f.seek(1, 1)  # chunks are word aligned
+
+
+class SourceInfo:
+    """ Container format of a file, sniffed from its first bytes (see sniff). The wav header is only parsed when a
+    backend asks for it (aubio parses it itself), then once for all backends.
+    """
+
+    def __init__(self, path: str, container: str='other', wav_header=None, dataset: str=None):
+        self.path = path  # the container for HDF5 datasets
+        self.container = container  # wav, hdf5 or other
+        self.dataset = dataset  # HDF5 dataset name
+        self._wav_header = wav_header
+        self._header_read = wav_header is not None or container != 'wav'
+
+    @property
+    def wav_header(self):
+        """ read_wav_header of a wav file, None for other files and broken headers """
+        if not self._header_read:
+            self._header_read = True
+            try:
+                with open(self.path, 'rb') as f:
+                    self._wav_header = read_wav_header(f)
+            except (ValueError, struct.error, OSError):  # broken header, maybe aubio can read it
+                pass
+        return self._wav_header
+
+    @property
+    def format_tag(self):
+        return self.wav_header[0][0] if self.wav_header else None
+
+    @property
+    def bits(self):
+        return self.wav_header[0][5] if self.wav_header else None
+
+
+def sniff(path: str) -> SourceInfo:
+    """ container of a file from its first 12 bytes: RIFF/WAVE, HDF5 magic or anything else """
+    hdf5_path = split_hdf5_path(path)
+    if hdf5_path is not None:
+        return SourceInfo(hdf5_path[0], 'hdf5', dataset=hdf5_path[1])
+    with open(path, 'rb') as f:
+        magic = f.read(12)
+    if magic[:8] == HDF5_MAGIC:
+        return SourceInfo(path, 'hdf5')
+    if magic[:4] == b'RIFF' and magic[8:12] == b'WAVE':
+        return SourceInfo(path, 'wav')
+    return SourceInfo(path)
+
 
 class AbstractSource:
+    # capabilities of the backend
+    seekable = False  # seek() is supported
+    zero_copy = False  # the returned hops are views of the stored samples (no per hop conversion or copy)
+    streaming = False  # memory usage doesn't depend on the file length
+
     def __init__(self, hop_size: int):
         self.hop_size = hop_size
         self.hop = 0
+        self.tail = None  # buffer for the last (partial) hop
 
     def __call__(self):
         raise NotImplementedError("Abstract method implementation missing")
 
+    @classmethod
+    def accepts(cls, info) -> bool:
+        """ whether this backend can read a file with the sniffed SourceInfo """
+        return False
+
+    @classmethod
+    def open(cls, path: str, hop_size: int, info):
+        return cls(path, hop_size)
+
+    def seek(self, hop: int):
+        """ continue reading at hop `hop` """
+        if not self.seekable:
+            raise NotImplementedError(f"{type(self).__name__} is not seekable")
+        self.hop = hop
+
+    def read_all(self):
+        """ all remaining samples as one float32 array """
+        chunks = []
+        while True:
+            samples, read = self()
+            chunks.append(np.array(samples[:read], dtype='float32'))
+            if read < self.hop_size:
+                return np.concatenate(chunks)
+
+    def instrument(self, stats, name: str='read'):
+        """ record the duration of every read (call) in the histogram `name` of stats (an Instrumentation) """
+        instrument_call(self, stats.histogram(name))
+
+    def uninstrument(self):
+        uninstrument_call(self)
+
     def get_next_from_data(self, data):
         start = self.hop * self.hop_size
         self.hop += 1
         end = self.hop * self.hop_size
         if end > data.shape[0]:
-            end = data.shape[0]
-            result = np.zeros(self.hop_size, dtype='float32')
-            read = end - start
-            result[0:read] = data[start:end]
-            return result, read
+            if self.tail is None:
+                self.tail = np.zeros(self.hop_size, dtype='float32')
+            read = max(0, data.shape[0] - start)
+            self.tail[:read] = data[start:start + read]
+            self.tail[read:] = 0
+            return self.tail, read
         return data[start:start + self.hop_size], self.hop_size
 
 
 class AubioSource(AbstractSource):
+    seekable = True
+    streaming = True
+
     def __init__(self, path: str, hop_size: int):
         super().__init__(hop_size)
-        self.src = aubio_source(path, hop_size=self.hop_size)
+        import aubio  # the backends are imported when they are used for the first time
+        self.src = aubio.source(path, hop_size=self.hop_size)
         self.samplerate = self.src.samplerate
         self.duration_s = self.src.duration / self.samplerate
 
     def __call__(self):
         return self.src()
 
+    @classmethod
+    def accepts(cls, info) -> bool:
+        return info.container != 'hdf5'  # all formats of the (libav/sndfile) build
+
+    def seek(self, hop: int):
+        self.src.seek(hop * self.hop_size)
+        self.hop = hop
+
 
 class WavioSource(AbstractSource):
+    seekable = True
+
     def __init__(self, path: str, hop_size: int):
         super().__init__(hop_size)
-        src = wavio_read(path)
+        import wavio
+        src = wavio.read(path)
         self.samplerate = src.rate
-        self.data = (src.data / (2 ** (8 * src.sampwidth - 1) - 1)).astype('float32')
+        self.data = src.data.astype('float32')
+        self.data /= 2 ** (8 * src.sampwidth - 1) - 1  # in place, no float64 temporary
 
         if len(self.data.shape) > 1:  # merge multiple channels
             self.data = self.data.mean(axis=1)
@@ -52,32 +189,255 @@ class WavioSource(AbstractSource):
     def __call__(self):
         return self.get_next_from_data(self.data)
 
+    @classmethod
+    def accepts(cls, info) -> bool:
+        return info.container == 'wav' and info.format_tag == 1
+
+
+class MmapWavSource(AbstractSource):
+    """ Memory-mapped wav file: only the hop that is read gets converted to float32 (and downmixed to mono), into a
+    buffer that is reused for every hop. The returned samples are only valid until the next call.
+    Supports 8/16/24/32 bit PCM and 32/64 bit float (also WAVE_FORMAT_EXTENSIBLE).
+    """
+    seekable = True
+    streaming = True
+
+    def __init__(self, path: str, hop_size: int, header=None):
+        super().__init__(hop_size)
+        fmt, offset, size = header if header is not None else self.read_header(path)
+        tag, self.channels, self.samplerate, _, block_align, bits = fmt
+        width = bits // 8
+        self.num_frames = min(size, os.path.getsize(path) - offset) // block_align
+
+        if tag == 1 and width in (1, 2, 4):  # PCM (8 bit is unsigned)
+            dtype, self.scale, self.offset = {1: 'u1', 2: '<i2', 4: '<i4'}[width], 2. ** (1 - bits), float(width == 1)
+        elif tag == 1 and width == 3:  # 24 bit PCM, expanded to the upper 3 bytes of an int32 per hop
+            dtype, self.scale, self.offset = 'u1', 2. ** -31, 0.
+            self.int24 = np.zeros((hop_size, self.channels, 4), dtype='u1')
+        elif tag == 3 and width in (4, 8):  # IEEE float
+            dtype, self.scale, self.offset = {4: '<f4', 8: '<f8'}[width], 1., 0.
+        else:
+            raise ValueError(f"Unsupported wav format {tag} with {bits} bits")
+        if block_align != width * self.channels:
+            raise ValueError(f"Unsupported wav block align {block_align}")
+
+        shape = (self.num_frames, self.channels, 3) if width == 3 else (self.num_frames, self.channels)
+        if width != 3 and self.channels == 1:
+            shape = shape[:1]
+        # a plain ndarray view of the map: slicing a np.memmap creates a memmap subclass per hop
+        self.data = np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape).view(np.ndarray) \
+            if self.num_frames else np.zeros(shape, dtype=dtype)
+        self.duration_s = self.num_frames / self.samplerate
+
+        self.buffer = np.zeros(hop_size, dtype='float32')
+        # scaled frames of all channels, summed up per hop (mono: the buffer itself)
+        self.frames = self.buffer.reshape(hop_size, 1) if self.channels == 1 else \
+            np.zeros((hop_size, self.channels), dtype='float32')
+        self.scale /= self.channels
+
+    @staticmethod
+    def read_header(path: str):
+        with open(path, 'rb') as f:
+            return read_wav_header(f)
+
+    @classmethod
+    def accepts(cls, info) -> bool:
+        if info.container != 'wav' or info.wav_header is None:
+            return False
+        tag, channels, _, _, block_align, bits = info.wav_header[0]
+        width = bits // 8
+        return (tag == 1 and width in (1, 2, 3, 4) or tag == 3 and width in (4, 8)) and \
+            block_align == width * channels and bits % 8 == 0
+
+    @classmethod
+    def open(cls, path: str, hop_size: int, info):
+        return cls(path, hop_size, info.wav_header)
+
+    def __call__(self):
+        hop_size = self.hop_size
+        start = min(self.hop * hop_size, self.num_frames)
+        read = min(hop_size, self.num_frames - start)
+        self.hop += 1
+
+        buffer = self.buffer
+        frames = self.data[start:start + read]
+        if frames.ndim == 3:  # 24 bit
+            self.int24[:read, :, 1:] = frames
+            frames = self.int24[:read].view('<i4')[..., 0]
+        if frames.ndim == 1:  # mono
+            np.multiply(frames, self.scale, out=buffer[:read], dtype='float32', casting='unsafe')
+        else:
+            scaled = self.frames[:read]
+            np.multiply(frames, self.scale, out=scaled, dtype='float32', casting='unsafe')
+            if self.channels > 1:  # add up the channels (faster than np.sum over the short last axis)
+                np.add(scaled[:, 0], scaled[:, 1], out=buffer[:read])
+                for channel in range(2, self.channels):
+                    buffer[:read] += scaled[:, channel]
+        if self.offset:
+            buffer[:read] -= self.offset
+        if read < hop_size:
+            buffer[read:] = 0
+        return buffer, read
+
+
+class ArraySource(AbstractSource):
+    """ already decoded (mono, float32) samples, e.g. from the feature cache """
+    seekable = True
+    zero_copy = True
+
+    def __init__(self, data, samplerate: int, hop_size: int):
+        super().__init__(hop_size)
+        self.samplerate = samplerate
+        self.data = data
+        self.duration_s = self.data.shape[0] / self.samplerate
+
+    def __call__(self):
+        return self.get_next_from_data(self.data)
+
+
+class HDF5Source(AbstractSource):
+    """ Dataset of a HDF5 container with the samples of one recording (1D, or 2D: samples x channels).
+    The dataset is read in blocks of about block_hops hops (aligned with its chunks) into a reused buffer, integer
+    samples are scaled to [-1, 1). The returned samples are only valid until the next call.
+    """
+    seekable = True
+    streaming = True
+
+    def __init__(self, dataset, hop_size: int, samplerate: int=None, block_hops: int=256):
+        super().__init__(hop_size)
+        self.dataset = dataset
+        if samplerate is None:
+            attrs = dataset.attrs
+            samplerate = next((attrs[k] for k in ('samplerate', 'sampling_rate', 'sample_rate', 'rate') if k in attrs),
+                              HDF5_SAMPLERATE)
+        self.samplerate = int(samplerate)
+        self.num_frames = dataset.shape[0]
+        self.channels = dataset.shape[1] if len(dataset.shape) > 1 else 1
+        self.duration_s = self.num_frames / self.samplerate
+
+        step = int(np.lcm(hop_size, dataset.chunks[0])) if dataset.chunks else hop_size
+        self.block_size = max(1, -(-block_hops * hop_size // step)) * step  # hops never cross a block boundary
+        self.raw = np.empty((self.block_size,) + dataset.shape[1:], dtype=dataset.dtype)
+        self.scale = 2. ** (1 - 8 * dataset.dtype.itemsize) if dataset.dtype.kind in 'iu' else 1.
+        self.offset = 1. if dataset.dtype.kind == 'u' else 0.
+        self.block = np.zeros(self.block_size, dtype='float32')
+        self.frames = self.block.reshape(-1, 1) if self.channels == 1 else \
+            np.zeros((self.block_size, self.channels), dtype='float32')
+        self.block_start = -1
+
+    def read_block(self, start: int):
+        end = min(start + self.block_size, self.num_frames)
+        read = end - start
+        if read > 0:
+            self.dataset.read_direct(self.raw, np.s_[start:end], np.s_[0:read])
+            raw = self.raw[:read] if self.channels > 1 else self.raw[:read].reshape(-1, 1)
+            np.multiply(raw, self.scale / self.channels, out=self.frames[:read], dtype='float32', casting='unsafe')
+            if self.channels > 1:
+                np.sum(self.frames[:read], axis=1, out=self.block[:read])
+            if self.offset:
+                self.block[:read] -= self.offset
+        self.block[max(0, read):] = 0
+        self.block_start = start
+
+    def __call__(self):
+        start = self.hop * self.hop_size
+        self.hop += 1
+        read = max(0, min(self.hop_size, self.num_frames - start))
+        block_start = start - start % self.block_size
+        if block_start != self.block_start:
+            self.read_block(block_start)
+        offset = start - block_start
+        return self.block[offset:offset + self.hop_size], read
+
+    @classmethod
+    def accepts(cls, info) -> bool:
+        return info.container == 'hdf5' and info.dataset is not None
+
+    @classmethod
+    def open(cls, path: str, hop_size: int, info):
+        return cls(open_hdf5(info.path)[info.dataset], hop_size)
+
 
 class ScipySource(AbstractSource):
+    seekable = True
+
     def __init__(self, path: str, hop_size: int):
         super().__init__(hop_size)
-        self.samplerate, self.data = scipy_read(path)
+        from scipy.io import wavfile  # slow to import
+        self.samplerate, self.data = wavfile.read(path)
         self.duration_s = self.data.shape[0] / self.samplerate
         # todo: convert to float32 (?)
 
     def __call__(self):
         return self.get_next_from_data(self.data)
 
+    @classmethod
+    def accepts(cls, info) -> bool:
+        return info.container == 'wav' and info.wav_header is not None
+
+
+_hdf5_files = {}  # (pid, path): open container, forked worker processes open their own handles
+
+
+def open_hdf5(path: str):
+    """ HDF5 container opened (read only) once per process """
+    import h5py  # optional dependency, only needed for HDF5 corpora
+    key = (os.getpid(), path)
+    if key not in _hdf5_files:
+        _hdf5_files[key] = h5py.File(path, 'r')
+    return _hdf5_files[key]
+
+
+def hdf5_datasets(path: str):
+    """ names of all datasets in a HDF5 container (also in groups) """
+    import h5py
+    names = []
+    open_hdf5(path).visititems(lambda name, obj: names.append(name) if isinstance(obj, h5py.Dataset) else None)
+    return names
+
+
+def hdf5_sources(path: str, hop_size: int, extension: str='.wav'):
+    """ yields (name, HDF5Source) for all datasets of a container ending with `extension` """
+    container = open_hdf5(path)
+    for name in hdf5_datasets(path):
+        if name.endswith(extension):
+            yield name, HDF5Source(container[name], hop_size)
+
+
+def split_hdf5_path(path: str):
+    """ (container, dataset) of a 'container.hdf5::dataset' path, None for regular files """
+    if HDF5_SEPARATOR not in path:
+        return None
+    container, name = path.split(HDF5_SEPARATOR, 1)
+    return container, name
+
+
+# backends in order of preference, create_source uses the first one that accepts a file (and the next ones only if
+# that fails). aubio reads PCM wavs faster per hop than MmapWavSource, which takes the wavs aubio can't read (float
+# with aubio's own wav reader) and serves as fallback without a copy of the file in memory (unlike wavio / scipy)
+SOURCES = [HDF5Source, AubioSource, MmapWavSource, WavioSource, ScipySource]
+
+
+def register_source(source_class, index: int=None):
+    """ add a backend (AbstractSource subclass implementing accepts), by default with the lowest preference """
+    SOURCES.insert(len(SOURCES) if index is None else index, source_class)
+
 
 def create_source(path: str, hop_size: int, verbose: bool = True):
+    """ opens path with the first backend in SOURCES that can read its format (header is read once) """
+    info = sniff(path)
+    if info.container == 'hdf5' and info.dataset is None:
+        raise ValueError(f"{path} is a HDF5 container, open one of its recordings as {path}{HDF5_SEPARATOR}dataset")
+    errors = []
+    for source_class in SOURCES:
+        if not source_class.accepts(info):
+            continue
+        if errors and verbose:
+            print(f"{errors[-1][0]} can't read this file, switch to {source_class.__name__}")
         try:
-            return AubioSource(path, hop_size)
-        except RuntimeError as e1:
-            if verbose:
-                print("Aubio can't read this file, switch to wavio")
-            try:
-                return WavioSource(path, hop_size)
-            except WaveError as e2:
-                if verbose:
-                    print("Wavio can't read this file, switch to scipy.io")
-                try:
-                    return ScipySource(path, hop_size)
-                except ValueError as e3:
-                    if verbose:
-                        print("Scipy.io can't read this file either -- abort")
-                    raise ValueError("File is unreadable:\n" + e1 + "\n" + e2 + "\n" + e3)
+            return source_class.open(path, hop_size, info)
+        except (RuntimeError, ValueError, OSError, WaveError) as e:
+            errors.append((source_class.__name__, e))
+    if verbose:
+        print(f"{errors[-1][0] if errors else 'No backend'} can't read this file either -- abort")
+    raise ValueError(f"File is unreadable: {path}" + "".join(f"\n{name}: {e}" for name, e in errors))
@@ -0,0 +1,85 @@
+"""
+shared spectral front end: the input buffer and the spectrum of each frame size are computed once per hop and shared
+by all detectors using the front end (onset.SpectralOnsetDetector, pitch.SpectralPitchDetector, the multi stream
+detectors)
+- SpectralFrontEnd: ring buffer of the input, hanningz windowed rfft (and its magnitude) of the latest frame of every
+  frame size that is asked for in a hop, computed on first use. Works on num_streams rows like mpd.multistream.
+aubio's phase vocoder (onset) and yinfft (pitch) window with the same hanningz window, so their magnitudes are equal.
+"""
+
+import math
+
+import numpy as np
+
+from .utils import RingBuffer, lazy_import
+from . import yin
+
+fft = lazy_import('scipy.fft')
+
+
+class SpectralFrontEnd:
+    """ Several detectors can share one front end, the first one to process a hop adds it (process_next with the
+    number of hops the detector has processed), the others get the same frames and spectra. Each detector that
+    shares it calls create_detector, which starts a new stream.
+    """
+
+    def __init__(self, hop_size: int, frame_size: int=4096):
+        self.hop_size = hop_size
+        self.frame_size = frame_size  # largest frame size
+
+    def create_detector(self, samplerate: int, num_streams: int=1):
+        self.samplerate = samplerate
+        self.num_streams = num_streams
+        self.buffer = RingBuffer(max(self.frame_size, self.hop_size), np.float32, num_streams)
+        self.windows = {}
+        self.spectra = {}
+        self.magnitudes = {}
+        self.level = np.full(num_streams, -np.inf)  # dB of the current hops
+        self.hops = 0
+
+    def reset_stream(self, idx):
+        """ start a new stream in row(s) idx """
+        self.buffer.data[idx] = 0
+
+    def process_next(self, hops, position: int=None):
+        """ hops: num_streams x hop_size (or hop_size samples of a single stream)
+        position: number of hops the calling detector processed before, if the front end is one hop ahead, another
+        detector has added this hop already
+        """
+        if position is not None and position != self.hops:
+            if position == self.hops - 1:
+                return
+            raise ValueError(f"detectors sharing a SpectralFrontEnd are out of step ({position} vs. {self.hops} hops)")
+        hops = np.asarray(hops, dtype=np.float32).reshape(self.num_streams, self.hop_size)
+        self.buffer.write(hops)
+        if self.num_streams == 1:  # level_db without the overhead of the reductions over rows
+            samples = hops[0].astype(np.float64)
+            energy = np.dot(samples, samples) / self.hop_size
+            self.level = np.array([10. * math.log10(energy) if energy > 0 else -np.inf])
+        else:
+            self.level = yin.level_db(hops)
+        self.spectra.clear()
+        self.magnitudes.clear()
+        self.hops += 1
+
+    def frames(self, frame_size: int):
+        """ latest frame of every stream (view, num_streams x frame_size) """
+        return self.buffer.window(frame_size)
+
+    def spectrum(self, frame_size: int):
+        """ rfft of the hanningz windowed latest frames (complex64, num_streams x frame_size // 2 + 1) """
+        spectrum = self.spectra.get(frame_size)
+        if spectrum is None:
+            if frame_size not in self.windows:
+                self.windows[frame_size] = yin.hanningz(frame_size)
+            spectrum = fft.rfft(self.buffer.window(frame_size) * self.windows[frame_size], axis=-1)
+            self.spectra[frame_size] = spectrum
+        return spectrum
+
+    def magnitude(self, frame_size: int):
+        """ abs of spectrum(frame_size) in single precision, read only for the detectors """
+        magnitude = self.magnitudes.get(frame_size)
+        if magnitude is None:
+            magnitude = np.abs(self.spectrum(frame_size)).astype(np.float32)
+            self.magnitudes[frame_size] = magnitude
+        return magnitude
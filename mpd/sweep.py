@@ -0,0 +1,156 @@
+"""
+parameter sweeps on cached raw detector outputs
+- RawTrack: raw per hop outputs of one file (onset detection function, hop level, raw pitches per frame size)
+- replay_*: the decision logic of the benchmark scripts, replayed on a RawTrack for one parameter set
+- parameter_grid: all combinations of a dict of parameter lists
+a grid point only costs the (vectorized) replay, the DSP runs once per file
+"""
+
+import itertools
+
+import numpy as np
+
+from .peakpicking import threshold_components, replay_onsets
+from .pitch import pitch_track, vote_weights
+from .smoothing import WeightedVoteSmoother
+from . import yin
+
+
+class RawTrack:
+    """ Raw per hop outputs of one file that don't depend on any post-processing parameter """
+
+    def __init__(self, samplerate: int, hop_size: int, level_db, odf=None, delay: int=0, pitches=None):
+        self.samplerate = samplerate
+        self.hop_size = hop_size
+        self.level_db = level_db  # per hop
+        self.odf = odf  # onset detection function (aubio.onset.get_descriptor) per hop
+        self.delay = delay  # aubio onset delay [samples]
+        self.pitches = pitches or {}  # frame_size: raw (rounded) midi pitch per hop
+        self.components = threshold_components(odf) if odf is not None else None
+
+    def __len__(self):
+        return len(self.level_db)
+
+
+def compute_raw_track(src, od=None, pitch_method: str='yinfft', pitch_frame_sizes=(2048, 4096)) -> RawTrack:
+    """ runs the onset detector od (an AubioOnsetDetector, its threshold, minioi and silence don't matter) and the
+    batch pitch detection once over all complete hops of src
+    """
+    samples = src.read_all()
+    hop_size = src.hop_size
+    num_hops = len(samples) // hop_size
+    hops = samples[:num_hops * hop_size].reshape(num_hops, hop_size)
+
+    odf, delay = onset_function(hops, od, src.samplerate) if od is not None else (None, 0)
+
+    pitches = {}
+    for frame_size in pitch_frame_sizes:
+        midi, _ = pitch_track(samples, pitch_method, frame_size, hop_size, src.samplerate)
+        pitches[frame_size] = np.round(midi).astype(np.int64)
+    return RawTrack(src.samplerate, hop_size, yin.level_db(hops), odf, delay, pitches)
+
+
+def onset_function(hops, od, samplerate: int):
+    """ (onset detection function per hop, delay [samples]) of an AubioOnsetDetector on a hop matrix """
+    od.create_detector(samplerate)
+    odf = np.zeros(len(hops), dtype=np.float32)
+    for i in range(len(hops)):
+        od.onset(hops[i])
+        odf[i] = od.onset.get_descriptor()
+    return odf, od.onset.get_delay()
+
+
+def replay_onset_track(raw: RawTrack, threshold: float, minioi_ms: float, silence: float):
+    """ per hop onset positions [samples] as AubioOnsetDetector.process_next would return them """
+    a, b = raw.components
+    minioi = int(np.floor(minioi_ms / 1000. * raw.samplerate + .5))  # like aubio_onset_set_minioi_ms
+    return replay_onsets(a, b, raw.level_db, raw.hop_size, threshold, minioi, silence, raw.delay)
+
+
+def replay_pitches(raw: RawTrack, frame_size: int, history_length: int=1):
+    """ smoothed pitch per hop as AubioPitchDetector(..., frame_size, history_length).process_next would return """
+    return WeightedVoteSmoother(vote_weights(history_length, frame_size, raw.hop_size)).process_array(raw.pitches[frame_size])
+
+
+def replay_notes(raw: RawTrack, threshold: float=0.75, minioi_ms: float=50, silence: float=-54,
+                 frame_size: int=2048, frame_size2: int=None, pitch_history: int=1, history_length: int=13,
+                 lowest_note: int=35, pitch_low_threshold: int=47):
+    """ replays the note decision of benchmark.py: the pitch (history_length + 1) hops after each onset
+    returns ({onset[ms]: pitch[midi]}, pitch per hop)
+    """
+    hop_size = raw.hop_size
+    sample_limit = (history_length + 1) * hop_size
+    onsets = replay_onset_track(raw, threshold, minioi_ms, silence)
+
+    pitch = replay_pitches(raw, frame_size, pitch_history)
+    if frame_size2 is not None:
+        pitch2 = replay_pitches(raw, frame_size2, pitch_history)
+        use2 = ((lowest_note <= pitch2) & (pitch2 < pitch_low_threshold)) | (pitch == 0)
+        pitch = np.where(use2, pitch2, pitch)
+
+    # accepted onsets: larger than all previous ones (last_onset starts at -sample_limit)
+    previous = np.maximum.accumulate(np.concatenate(([-sample_limit], onsets)))[:-1]
+    hops = np.nonzero(onsets > previous)[0]
+    values = onsets[hops]
+    # emitted at the first hop after the time limit (or immediately when detected too late),
+    # unless the next onset is detected before
+    emit = np.maximum(hops, (sample_limit + values) // hop_size - 1)
+    next_hop = np.concatenate((hops[1:], [len(onsets)]))
+    valid = (emit < next_hop) & (emit < len(onsets)) & (values > 0)
+    emit_pitch = pitch[np.minimum(emit, len(pitch) - 1)]
+    valid &= emit_pitch > 0
+    keys = np.round(values[valid] / raw.samplerate * 1000).astype(np.int64)
+    return dict(zip(keys.tolist(), emit_pitch[valid].tolist())), pitch
+
+
+def replay_stable_notes(raw: RawTrack, frame_size: int=2048, frame_size2: int=4096, history_length: int=20,
+                        seq_len: int=12, ioi_frames: int=0):
+    """ replays the note decision of multi-pitch-silence.py: a note starts when a pitch was found in
+    history_length of the last hops of both detectors and at least seq_len times in a row
+    returns {onset[ms]: pitch[midi]}
+    """
+    p1, p2 = raw.pitches[frame_size], raw.pitches[frame_size2]
+    n = len(p1)
+
+    def previous_windows(p):
+        padded = np.concatenate((np.full(history_length, -1), p))
+        return np.lib.stride_tricks.sliding_window_view(padded, history_length)[:n]  # history before hop t
+
+    def runs(p):
+        starts = np.concatenate(([True], p[1:] != p[:-1]))
+        start_idx = np.maximum.accumulate(np.where(starts, np.arange(n), 0))
+        return np.minimum(np.arange(n) - start_idx + 1, history_length)
+
+    h1, h2 = previous_windows(p1), previous_windows(p2)
+    count1 = (h1 == p1[:, None]).sum(axis=1) + (h2 == p1[:, None]).sum(axis=1)
+    count2 = (h1 == p2[:, None]).sum(axis=1) + (h2 == p2[:, None]).sum(axis=1)
+    use2 = count2 >= count1
+    count = np.where(use2, count2, count1)
+    pitch = np.where(use2, p2, p1)
+    seq = np.where(use2, runs(p2), runs(p1))
+    stable = (count >= history_length) & (seq >= seq_len)
+
+    notes = {}
+    stable_pitch, stable_count = 0, 0
+    silence = pitch == 0
+    check = np.nonzero(stable | silence | np.concatenate(([False], stable[:-1])))[0]
+    for t in check.tolist():
+        if silence[t]:
+            stable_pitch = 0  # reset stable pitch as soon (and only when) silence is detected
+        if stable[t]:
+            if stable_pitch != pitch[t] and stable_count >= ioi_frames:
+                stable_pitch = int(pitch[t])
+                total_read = (t + 1) * raw.hop_size
+                onset = round((total_read - (int(seq[t]) + 4) * raw.hop_size) / raw.samplerate * 1000)
+                notes[onset] = stable_pitch
+            stable_count += 1
+        else:
+            stable_count = 0
+    return notes
+
+
+def parameter_grid(grid: dict):
+    """ all combinations of the parameter lists in grid, e.g. {'threshold': [.5, .75], 'history_length': [8, 13]} """
+    names = list(grid)
+    for values in itertools.product(*(grid[name] for name in names)):
+        yield dict(zip(names, values))
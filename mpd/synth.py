@@ -0,0 +1,130 @@
+"""
+synthetic monophonic piano recordings with ground truth
+- PianoSynth: piano-like notes (inharmonic partials, two-stage exponential decay, hammer noise, damper release),
+  random melodies with varying velocity and inter-onset gaps, background noise and reverberation.
+  Every piece is determined by (seed, index), so pieces can be generated in any order and in parallel.
+- write_wav / write_ground_truth: 16 bit wav file and csv (onset[ms], pitch[midi]) like scripts/write_csv.py
+"""
+
+import csv
+
+import numpy as np
+from scipy.io import wavfile
+from scipy.signal import fftconvolve
+
+
+class PianoSynth:
+    def __init__(self, samplerate: int=44100, duration_s: float=60., seed: int=0, lowest_note: int=35,
+                 highest_note: int=96):
+        self.samplerate = samplerate
+        self.duration_s = duration_s
+        self.seed = seed
+        self.lowest_note = lowest_note
+        self.highest_note = highest_note
+
+        self.ioi_s = (0.15, 1.2)  # range of the inter-onset intervals
+        self.pause_probability = 0.1  # probability of an additional pause after a note
+        self.pause_s = (0.5, 2.)
+        self.max_step = 7  # largest interval [semitones] between two notes, else a random jump
+        self.velocity = (0.2, 1.)
+        self.release_s = 0.03  # damper time constant when the next note starts
+        self.noise_db = (-90., -60.)  # range of the white background noise level [dBFS]
+        self.reverb_rt60_s = (0., 1.2)  # range of the reverberation time (0: dry)
+        self.reverb_wet = (0.05, 0.3)
+
+    def rng(self, index: int):
+        return np.random.default_rng([self.seed, index])
+
+    def note(self, midi: int, velocity: float, length: int, rng):
+        """ samples of a note sounding for `length` samples (without release) """
+        sr = self.samplerate
+        t = np.arange(length) / sr
+        f0 = 440. * 2 ** ((midi - 69) / 12)
+        inharmonicity = 10 ** (-4 + 1.5 * (midi - 21) / 87)  # B of f_k = k f0 sqrt(1 + B k^2)
+        tau = 3. * 2 ** (-(midi - 48) / 24)  # decay time constant of the fundamental [s]
+        brightness = 2.2 - velocity  # harder strikes have stronger upper partials
+
+        note = np.zeros(length)
+        k = 1
+        while True:
+            fk = k * f0 * np.sqrt(1 + inharmonicity * k * k)
+            if fk >= min(0.45 * sr, 10000.) or k > 40:
+                break
+            tau_k = tau / (1 + 0.3 * (k - 1))
+            aftersound = np.exp(-t / tau_k)
+            envelope = aftersound * aftersound * aftersound
+            envelope *= envelope  # prompt sound, decays 6 times faster
+            envelope *= 0.7
+            envelope += 0.3 * aftersound
+            envelope *= np.sin(2 * np.pi * fk * t + rng.uniform(0, 2 * np.pi))
+            note += k ** -brightness * envelope
+            k += 1
+        attack = min(length, int(0.002 * sr))
+        note[:attack] *= np.linspace(0, 1, attack, endpoint=False)
+        hammer = min(length, int(0.02 * sr))
+        burst = rng.normal(0, 1, hammer) * np.exp(-np.arange(hammer) / (0.004 * sr))
+        note[:hammer] += 0.05 * velocity * np.convolve(burst, np.ones(8) / 8, mode='same')  # low passed noise
+        return velocity ** 1.5 * note / max(1e-9, np.abs(note).max())
+
+    def melody(self, rng):
+        """ [(onset [samples], midi, velocity)] of a piece """
+        sr = self.samplerate
+        notes = []
+        onset = int(rng.uniform(0.1, 0.5) * sr)
+        midi = int(rng.integers(self.lowest_note, self.highest_note + 1))
+        while onset < (self.duration_s - self.ioi_s[1]) * sr:  # the last note sounds at least ioi_s[1]
+            notes.append((onset, midi, rng.uniform(*self.velocity)))
+            onset += int(rng.uniform(*self.ioi_s) * sr)
+            if rng.random() < self.pause_probability:
+                onset += int(rng.uniform(*self.pause_s) * sr)
+            if rng.random() < 0.2:
+                midi = int(rng.integers(self.lowest_note, self.highest_note + 1))
+            else:
+                midi = int(np.clip(midi + rng.integers(-self.max_step, self.max_step + 1), self.lowest_note,
+                                   self.highest_note))
+        return notes
+
+    def reverb(self, samples, rng):
+        rt60 = rng.uniform(*self.reverb_rt60_s)
+        if rt60 <= 0.01:
+            return samples
+        length = int(rt60 * self.samplerate)
+        ir = rng.normal(0, 1, length) * np.exp(-6.9 * np.arange(length) / length)  # -60dB after rt60
+        ir /= np.sqrt(np.sum(ir ** 2))
+        wet = rng.uniform(*self.reverb_wet)
+        return (1 - wet) * samples + wet * fftconvolve(samples, ir)[:len(samples)]
+
+    def piece(self, index: int):
+        """ (float32 samples, ground truth [(onset[ms], midi)]) of piece `index` """
+        rng = self.rng(index)
+        sr = self.samplerate
+        num_samples = int(self.duration_s * sr)
+        samples = np.zeros(num_samples)
+        notes = self.melody(rng)
+        tail = int(6 * self.release_s * sr)
+        truth = []
+        for i, (onset, midi, velocity) in enumerate(notes):
+            end = notes[i + 1][0] if i + 1 < len(notes) else num_samples
+            length = min(end - onset, num_samples - onset)
+            note = self.note(midi, velocity, min(length + tail, num_samples - onset), rng)
+            note[length:] *= np.exp(-np.arange(len(note) - length) / (self.release_s * sr))  # damper
+            samples[onset:onset + len(note)] += note
+            truth.append((round(onset / sr * 1000), midi))
+        samples = self.reverb(samples, rng)
+        samples += rng.normal(0, 10 ** (rng.uniform(*self.noise_db) / 20), num_samples)
+        peak = np.abs(samples).max()
+        if peak > 0.99:
+            samples *= 0.99 / peak
+        return samples.astype(np.float32), truth
+
+
+def write_wav(path: str, samples, samplerate: int):
+    """ 16 bit mono wav file """
+    wavfile.write(path, samplerate, np.round(np.clip(samples, -1, 1) * 32767).astype(np.int16))
+
+
+def write_ground_truth(path: str, truth):
+    with open(path, mode='w', newline="\n") as f:
+        writer = csv.writer(f, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+        for onset, midi in truth:
+            writer.writerow([onset, midi])
@@ -1,9 +1,17 @@
 """
 utility functions:
 - midi2char: transforms a midi-pitch into its character representation (e.g. C0 = 12, C3 = 48)
+- RingBuffer: fixed-size sample buffer whose latest window is always available as a contiguous view
+- shared_resource: process wide cache of read only objects that are expensive to construct (filterbanks, weights)
+- lazy_import: module that is only loaded on first use (backends that take long to import)
 """
 
 import math
+import sys
+import types
+import importlib.util
+
+import numpy as np
 
 notes = ['C', 'C#/Db', 'D', 'D#/Eb', 'E', 'F', 'F#/Gb', 'G', 'G#/Ab', 'A', 'A#/Bb', 'B']
 
@@ -17,3 +25,76 @@ def char2midi(key: str) -> int:
 
 
 def sigmoid(x): return 1 / (1 + math.exp(-x))
+
+
+_resources = {}
+
+
+def shared_resource(key, factory):
+    """ the object of `key` (hashable, e.g. a tuple of the name and the parameters), created by factory() on first
+    use and shared by all detectors of the process afterwards, so it must not be modified
+    """
+    resource = _resources.get(key)
+    if resource is None:
+        resource = _resources[key] = factory()
+    return resource
+
+
+def lazy_import(name: str):
+    """ module `name`, executed on the first access to one of its attributes (importlib.util.LazyLoader), so e.g.
+    madmom and scipy.fft are only imported by the processes that use a detector needing them. The packages of a
+    submodule are imported right away. If the module isn't installed, the first access raises ModuleNotFoundError.
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        def missing(attribute):
+            raise ModuleNotFoundError(f"No module named '{name}'", name=name)
+        module = types.ModuleType(name)
+        module.__getattr__ = missing
+        return module
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+class RingBuffer:
+    """ Keeps the last `size` samples of a stream without rolling the buffer on every write.
+    All samples are written twice (storage is mirrored), so the latest window is always a contiguous view.
+    With `channels`, one buffer per channel (row) is kept and written at once (samples: channels x n).
+    """
+
+    def __init__(self, size: int, dtype='float32', channels: int=None):
+        self.size = size
+        self.data = np.zeros(2 * size if channels is None else (channels, 2 * size), dtype=dtype)
+        self.pos = 0  # index of the oldest sample == next write position
+
+    def reset(self):
+        self.data[:] = 0
+        self.pos = 0
+
+    def write(self, samples):
+        n = samples.shape[-1]
+        if n > self.size:
+            samples = samples[..., -self.size:]
+            n = self.size
+        end = self.pos + n
+        if end <= self.size:
+            self.data[..., self.pos:end] = samples
+            self.data[..., self.pos + self.size:end + self.size] = samples
+        else:  # wraps around
+            first = self.size - self.pos
+            self.data[..., self.pos:self.size] = samples[..., :first]
+            self.data[..., self.pos + self.size:] = samples[..., :first]
+            self.data[..., :n - first] = samples[..., first:]
+            self.data[..., self.size:self.size + n - first] = samples[..., first:]
+        self.pos = end % self.size
+
+    def window(self, length: int = None):
+        """ view on the latest `length` samples (default: the whole buffer), oldest first """
+        end = self.pos + self.size
+        return self.data[..., end - (length or self.size):end]
@@ -0,0 +1,175 @@
+"""
+vectorized YIN and YinFFT (numpy re-implementation of aubio's pitchyin.c and pitchyinfft.c)
+all functions work on a matrix of frames (one frame per row) and return the period in samples (0 = no pitch)
+"""
+
+import math
+
+import numpy as np
+
+from .utils import lazy_import
+
+fft = lazy_import('scipy.fft')
+
+# A-weighting like curve used by aubio's yinfft (frequency [Hz] -> weight [dB])
+_freqs = [0., 20., 25., 31.5, 40., 50., 63., 80., 100., 125., 160., 200., 250., 315., 400., 500., 630., 800., 1000.,
+          1250., 1600., 2000., 2500., 3150., 4000., 5000., 6300., 8000., 9000., 10000., 12500., 15000., 20000., 25100.]
+_weight = [-75.8, -70.1, -60.8, -52.1, -44.2, -37.5, -31.3, -25.6, -20.9, -16.5, -12.6, -9.60, -7.00, -4.70, -3.00,
+           -1.80, -0.80, -0.20, -0.00, 0.50, 1.60, 3.20, 5.40, 7.80, 8.10, 5.30, -2.40, -11.1, -12.8, -12.2, -7.40,
+           -17.8, -17.8, -17.8]
+
+TOLERANCE = {'yin': 0.15, 'yinfft': 0.85}  # aubio defaults
+
+
+def hanningz(frame_size: int):
+    """ periodic hann window, as used by aubio ("hanningz") """
+    return (0.5 - 0.5 * np.cos(2 * np.pi * np.arange(frame_size) / frame_size)).astype(np.float32)
+
+
+def yinfft_weights(samplerate: int, frame_size: int):
+    """ spectral weighting of yinfft, linear interpolation of the table above (in dB) """
+    weights = np.zeros(frame_size // 2 + 1)
+    j = 1
+    for i in range(len(weights)):
+        freq = i / frame_size * samplerate
+        while freq > _freqs[j] and j < len(_freqs) - 1:
+            j += 1
+        a0, f0, a1, f1 = _weight[j - 1], _freqs[j - 1], _weight[j], _freqs[j]
+        if f0 == f1:
+            weights[i] = a0
+        elif f0 == 0:
+            weights[i] = (a1 - a0) / f1 * freq + a0
+        else:
+            weights[i] = (a1 - a0) / (f1 - f0) * freq + (a0 - (a1 - a0) / (f1 / f0 - 1.))
+    return (10 ** (weights / 20)).astype(np.float32)
+
+
+def cmnd(diff):
+    """ cumulative mean normalized difference, diff[..., 0] is ignored and set to 1 """
+    tail = diff[..., 1:]
+    cumsum = np.cumsum(tail, axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        tail *= np.arange(1, diff.shape[-1], dtype=diff.dtype) / cumsum  # yin[tau] *= tau / sum, like aubio
+    tail[cumsum == 0] = 1.
+    diff[..., 0] = 1.
+    return diff
+
+
+def quadratic_peak_pos(x, pos):
+    """ 3-point quadratic interpolation of `x[i, pos[i]]` for every row i """
+    rows = np.arange(x.shape[0])
+    inner = (pos > 0) & (pos < x.shape[1] - 1)
+    p = np.clip(pos, 1, x.shape[1] - 2)
+    s0, s1, s2 = x[rows, p - 1], x[rows, p], x[rows, p + 1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        shift = np.where(inner, .5 * (s0 - s2) / (s0 - 2 * s1 + s2), 0.)
+    return pos + np.nan_to_num(shift)
+
+
+def yinfft_difference(spectrum, weights):
+    """ yinfft difference function from the rfft of the windowed frames """
+    sqrmag = (spectrum.real ** 2 + spectrum.imag ** 2) * weights
+    frame_size = 2 * (spectrum.shape[-1] - 1)
+    total = 2 * sqrmag.sum(axis=-1, keepdims=True)
+    return total - fft.irfft(sqrmag, frame_size, axis=-1)[..., :spectrum.shape[-1]] * frame_size
+
+
+def yinfft(frames, samplerate: int, weights=None, tolerance: float = TOLERANCE['yinfft']):
+    """ returns (period, confidence) for each frame (row) """
+    frame_size = frames.shape[-1]
+    if weights is None:
+        weights = yinfft_weights(samplerate, frame_size)
+    return yinfft_spectrum(fft.rfft(frames * hanningz(frame_size), axis=-1), samplerate, weights, tolerance)
+
+
+def yinfft_spectrum(spectrum, samplerate: int, weights, tolerance: float = TOLERANCE['yinfft']):
+    """ yinfft from the rfft of the hanningz windowed frames (e.g. of a shared spectral front end) """
+    return yinfft_pick(cmnd(yinfft_difference(spectrum, weights)), samplerate, tolerance)
+
+
+def yinfft_pick(yin, samplerate: int, tolerance: float = TOLERANCE['yinfft']):
+    tau = np.argmin(yin, axis=-1)
+    rows = np.arange(yin.shape[0])
+    confidence = 1. - yin[rows, tau]
+
+    # additional check for octave doubling in higher frequencies
+    short_period = int(round(samplerate / 1300.))
+    half = tau // 2
+    use_half = (tau <= short_period) & (yin[rows, half] < tolerance)
+    period = quadratic_peak_pos(yin, np.where(use_half, half, tau))
+    return np.where(yin[rows, tau] < tolerance, period, 0.), confidence
+
+
+def yinfft_pick_frame(yin, samplerate: int, tolerance: float = TOLERANCE['yinfft']):
+    """ yinfft_pick of a single frame (1D), returns (period, confidence) as python floats """
+    tau = int(np.argmin(yin))
+    value = float(yin[tau])
+    if value >= tolerance:
+        return 0., 1. - value
+    if tau <= int(round(samplerate / 1300.)) and yin[tau // 2] < tolerance:  # octave doubling in higher frequencies
+        tau //= 2
+    if 0 < tau < len(yin) - 1:
+        s0, s1, s2 = float(yin[tau - 1]), float(yin[tau]), float(yin[tau + 1])
+        if s0 - 2 * s1 + s2 != 0:
+            return tau + .5 * (s0 - s2) / (s0 - 2 * s1 + s2), 1. - value
+    return float(tau), 1. - value
+
+
+def yin_difference(frames):
+    """ yin difference function d(tau) = sum_j (x_j - x_j+tau)^2 for j, tau < frame_size / 2 (via fft) """
+    frame_size = frames.shape[-1]
+    length = frame_size // 2
+    fft_size = 2 * frame_size
+    head = frames[..., :length]
+    corr = fft.irfft(fft.rfft(frames, fft_size, axis=-1) * np.conj(fft.rfft(head, fft_size, axis=-1)),
+                 fft_size, axis=-1)[..., :length]
+    sq = np.cumsum(np.square(frames, dtype=np.float64), axis=-1)
+    energy_head = sq[..., length - 1:length]
+    # energy of frames[tau:tau+length] for each tau
+    energy_shift = sq[..., length - 1:2 * length - 1] - np.concatenate(
+        (np.zeros(frames.shape[:-1] + (1,)), sq[..., :length - 1]), axis=-1)
+    return energy_head + energy_shift - 2 * corr
+
+
+def yin(frames, samplerate: int = 0, tolerance: float = TOLERANCE['yin']):
+    """ returns (period, confidence) for each frame (row) """
+    yin = cmnd(np.maximum(yin_difference(frames), 0))
+    rows = np.arange(yin.shape[0])
+
+    # first local minimum below tolerance (2 <= period < length - 3), else the global minimum
+    length = yin.shape[-1]
+    below = (yin[:, 2:length - 3] < tolerance) & (yin[:, 2:length - 3] < yin[:, 3:length - 2])
+    first = np.argmax(below, axis=-1) + 2
+    pos = np.where(below.any(axis=-1), first, np.argmin(yin, axis=-1))
+    return quadratic_peak_pos(yin, pos), 1. - yin[rows, pos]
+
+
+def period2midi(period, samplerate: int):
+    """ convert periods [samples] to (fractional) midi pitches, 0 for no pitch (like aubio_freqtomidi) """
+    with np.errstate(divide='ignore'):
+        freq = np.where(period > 0, samplerate / period, 0.)
+    valid = (freq >= 2.) & (freq <= 100000.)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        midi = 12. * np.log2(freq / 6.875) - 3.
+    return np.where(valid, midi, 0.)
+
+
+def period2midi_frame(period: float, samplerate: int) -> float:
+    """ period2midi of a single period """
+    freq = samplerate / period if period > 0 else 0.
+    return 12. * math.log2(freq / 6.875) - 3. if 2. <= freq <= 100000. else 0.
+
+
+def frame_matrix(samples, frame_size: int, hop_size: int):
+    """ strided (read-only) view with one frame per hop, each frame ending with that hop (zero padded at start)
+    like aubio's sliding input buffer
+    """
+    num_hops = len(samples) // hop_size
+    padded = np.concatenate((np.zeros(frame_size - hop_size, dtype=samples.dtype), samples[:num_hops * hop_size]))
+    return np.lib.stride_tricks.sliding_window_view(padded, frame_size)[::hop_size]
+
+
+def level_db(hops):
+    """ sound pressure level of each hop (row) in dB, like aubio_db_spl """
+    with np.errstate(divide='ignore'):
+        return 10. * np.log10(np.mean(np.square(hops, dtype=np.float64), axis=-1))
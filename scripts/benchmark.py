@@ -1,8 +1,7 @@
 import os
 import sys
-import csv
-import statistics
 
+from functools import partial
 from timeit import default_timer as timer
 
 module_dir = os.path.realpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir))
@@ -10,9 +9,15 @@ if module_dir not in sys.path:
     sys.path.append(module_dir)
 
 from mpd.source import create_source
+from mpd.runner import find_files, run_files
+from mpd.cache import FeatureCache, cached_source, cached_outputs
 from mpd.onset import AubioOnsetDetector, MadmomFeatureOnsetDetector, MadmomRNNOnsetDetector
-from mpd.pitch import AubioPitchDetector
-from mpd.utils import midi2char
+from mpd.pitch import AubioPitchDetector, MultiResolutionPitchDetector
+from mpd.pipeline import NoteTranscriber
+from mpd.gate import SilenceGate
+from mpd.pool import DetectorPool
+from mpd.evaluation import Evaluation, load_truth, print_statistics, notes_to_arrays, match_onsets
+from mpd.instrumentation import Instrumentation
 
 # config / arguments
 benchmark_folders = [
@@ -31,6 +36,73 @@ benchmark_folders = [r'C:\Users\Silvan\Desktop']
 onset_benchmark_tolerance_ms = 25  # onset tolerance difference
 pitch_time_limit_s = 0.13
 silent = False  # suppress outputs
+processes = None  # worker processes (None: one per core, 1: serial)
+cache_dir = None  # feature cache for decoded audio and detector outputs (None: no cache)
+cache_size_mb = 2048
+instrumentation_file = None  # json file for the latency histograms of each stage (None: no instrumentation)
+detector_pool = DetectorPool()  # of the process, reuses the detectors of the previous files
+
+
+def process_file(path, od, pd, pd2, hop_size, sample_limit, lowest_note, pitch_low_threshold, filter_method=None,
+                 cache_dir=None, instrument=False, gate=None, pitch_window=None, batch=False):
+    """ onset+pitch detection and evaluation of a single file, runs in a worker process
+    returns (pitches {onset[ms]: pitch[midi]}, evaluation, messages to print, latency histograms or None)
+    """
+    cached = cache_dir is not None and filter_method is None
+    batch = batch and not cached and filter_method is None
+    if cached:
+        cache = FeatureCache(cache_dir, cache_size_mb)
+        src = cached_source(cache, path, hop_size)
+    else:
+        src = create_source(path, hop_size=hop_size, verbose=False)
+        od, pd, pd2 = (detector_pool.acquire(d, src.samplerate) if d is not None else None for d in (od, pd, pd2))
+    transcriber = NoteTranscriber(od, pd, sample_limit, pd2, lowest_note, pitch_low_threshold, filter_method, gate,
+                                  pitch_window)
+    stats = None
+    if instrument:
+        stats = Instrumentation()
+        transcriber.instrument(stats)
+
+    # get onset+pitches of the wav file
+    all_pitches = []
+    if cached:
+        outputs = zip(*(cached_outputs(cache, path, d, hop_size).tolist() for d in (od, pd, pd2) if d is not None))
+    elif batch:
+        samples = src.read_all()
+        outputs = zip(od.process_array(samples).tolist(),
+                      *(d.process_array(samples)[0].tolist() for d in (pd, pd2) if d is not None))
+    if cached or batch:
+        transcriber.reset(src.samplerate, create_detectors=False)
+        events = []
+        for detected in outputs:  # onset, pitch(, pitch2)
+            event = transcriber.update(*detected)
+            all_pitches.append(transcriber.pitch)
+            if event is not None:
+                events.append(event)
+    else:
+        events = list(transcriber.transcribe(src, all_pitches, create_detectors=False))
+        if pitch_window is not None:
+            all_pitches = None  # only the hops before the note reports have a pitch, no pTP/pFN
+    pitches = {event.onset_ms: event.pitch for event in events}  # onset[ms]:pitch[midi]
+
+    truth = load_truth(path[:-3] + "csv")
+    evaluation = Evaluation.evaluate(pitches, truth, onset_benchmark_tolerance_ms, lowest_note, all_pitches,
+                                     src.samplerate, hop_size, pitch_time_limit_s)
+    if stats is not None:
+        transcriber.uninstrument()
+        # detection latency: ground truth onset -> report of the matched note
+        reported = {event.onset_ms: event.time / src.samplerate for event in events}
+        onsets, _ = notes_to_arrays(pitches)
+        for true_onset, idx in zip(truth[0].tolist(), match_onsets(onsets, truth[0], onset_benchmark_tolerance_ms)):
+            if idx >= 0:
+                stats.record('true_onset_to_emit', reported[int(onsets[idx])] - true_onset / 1000)
+        stats = stats.to_dict()
+    if not cached:
+        for d in (od, pd, pd2):
+            if d is not None:
+                detector_pool.release(d)
+    return pitches, evaluation, transcriber.messages, stats
+
 
 if __name__ == '__main__':
     hop_size = 512
@@ -43,6 +115,10 @@ if __name__ == '__main__':
     history_length = 13
     lowest_note = 35  # B1
     pitch_low_threshold = 47  # 43=G2: 5.67Hz (>5.38)  48=C3: ~7.56 Hz, 53=F3: ~10Hz, 54=F#3: 10.7Hz (10.76Hz |2048 wnd)
+    multi_resolution = False  # pd and pd2 in one detector, the large frame is only evaluated when it may be needed
+    silence_gate = False  # skip the detectors on quiet hops (not applied to cached detector outputs)
+    pitch_window = None  # evaluate the pitch only for this many hops up to each note report (>= pitch history length)
+    batch_mode = False  # whole file detection (process_array of the detectors, e.g. madmom's bidirectional RNN)
 
     filter_method = None  # 'lowpass'
 
@@ -52,6 +128,10 @@ if __name__ == '__main__':
     # od = MadmomRNNOnsetDetector(hop_size, 4096, onset_minioi_ms, fps=100)
     pd = AubioPitchDetector(pitch_method, hop_size, pitch_frame_size, 1)
     pd2 = AubioPitchDetector(pitch_method, hop_size, pitch_frame_size*2, 1)
+    if multi_resolution:
+        pd = MultiResolutionPitchDetector(pitch_method, hop_size, pitch_frame_size, pitch_frame_size*2, 1, 1,
+                                          lowest_note, pitch_low_threshold)
+        pd2 = None
     # pd.p_weights[:15] = 0  # skip first windows... -> skip 4 or skip all but last (even a bit better!)
 
     od.threshold = 0.75  # 0.95
@@ -61,174 +141,48 @@ if __name__ == '__main__':
         # print(f"t: {-60 + t*2}")
         # od.threshold = t/20  # 10-21 = 0.5-1.0 in 0.05 steps
 
-        _onsetTP, _onsetFP, _onsetFN = 0, 0, 0
-        _pitchTP, _pitchFN, _pTP, _pFN = 0, 0, 0, 0
-        _pitch_error_stats, _pitch_error_stats2 = {}, {}
-        _onset_stats = []
+        _evaluation = Evaluation()
         start = timer()
-        for folder in benchmark_folders:
-            for subdir, dirs, files in os.walk(folder):
-                for file in files:
-                    if len(sys.argv) > 2 and file != sys.argv[2]:
-                        continue
-                    path = os.path.join(subdir, file)
-                    path_csv = path[:-3] + "csv"
-                    if not os.path.exists(path_csv) or not path.endswith(".wav"):
-                        continue
-
-                    # get onset+pitches of the wav file
-                    src = create_source(path, hop_size=hop_size, verbose=False)
-
-                    od.create_detector(src.samplerate)
-                    pd.create_detector(src.samplerate)
-                    pd2.create_detector(src.samplerate)
-
-                    # af = aubio.digital_filter(order=3)  # 7 for A-Filter, 5 for C-Filter, 3 for biquad
-                    # if filter_method == 'lowpass':
-                    #     if src.samplerate == 44100:
-                    #         af.set_biquad(.07909669122050075, .1581933824410015, .07909669122050075, -1.1486877651747005, .4650745300567037)  # q=0.85, f=4700
-                    #     elif src.samplerate == 48000:
-                    #         af.set_biquad(.06844301311767674, .13688602623535348, .06844301311767674, -1.2193255395824403, .4930975920531473)  # q=0.85, f=4700
-                    #         # self.filter_obj.set_biquad(0.01801576198494065, 0.0360315239698813,  0.01801576198494065, -1.4631087710168378, 0.5351718189566004)  # q=0.5, f=2350
-
-                    pitches = {}  # onset[ms]:pitch[midi]
-                    all_pitches = []
-                    total_read = 0
-                    last_onset = -sample_limit
-                    onset_pending = False
-                    while True:
-                        samples, read = src()
-                        if read < src.hop_size:
-                            break
-
-                        total_read += read
-
-                        onset = od.process_next(samples)
-                        if onset > last_onset:
-                            if onset_pending and not silent:
-                                o1 = round(onset / src.samplerate * 1000)
-                                o2 = round(last_onset / src.samplerate * 1000)
-                                print(f"WARN: new onset {o1} found before old {o2} was processed! ignoring old.")
-                            last_onset = onset
-                            onset_pending = True
-                        elif onset > 0 and not silent:
-                            print("WARN: onset timings are not increasing monotonically")
-                        # pitch = pd.process_next(af(samples))
-                        pitch = pd.process_next(samples)
-                        pitch2 = pd2.process_next(samples)
-                        if lowest_note <= pitch2 < pitch_low_threshold or pitch == 0:
-                            pitch = pitch2
-                        all_pitches.append(pitch)
-
-                        samples_past_limit_after_onset = total_read - sample_limit - last_onset
-                        onset_before_time_limit = samples_past_limit_after_onset <= 0
-                        next_iteration_exceeds_time_limit = samples_past_limit_after_onset + hop_size > 0
-                        if (onset_before_time_limit or onset_pending) and next_iteration_exceeds_time_limit:
-                            if pitch > 0 and last_onset > 0:
-                                pitches[round(last_onset / src.samplerate * 1000)] = pitch
-                            if not onset_before_time_limit and last_onset > 0 and not silent:
-                                print("INFO: onset detection took longer than time limit!", total_read, sample_limit, last_onset)
-                            onset_pending = False
-
-                    with open(path_csv, mode='r') as f:
-                        reader = csv.reader(f, delimiter=',')
-                        keys = list(pitches.keys())
-                        key_idx = 0
-                        onsetTP, onsetFP, onsetFN = 0, 0, 0
-                        pitchTP, pitchFN = 0, 0
-                        pitch_error_stats, pitch_error_stats2 = {}, {}
-                        onset_stats = []
-                        for row in reader:
-                            onset, pitch = int(row[0]), int(row[1])
-
-                            # check all pitches (assuming perfect onset detection)
-                            tl_after_onset = onset / 1000 * src.samplerate + src.samplerate * pitch_time_limit_s
-                            if pitch == all_pitches[int(round(tl_after_onset / hop_size))]:
-                                _pTP += 1
-                            else:
-                                _pFN += 1
-                                # print(f"estimated {pitch}/{all_pitches[int(round(tl_after_onset / hop_size))]}")
-
-                            # check detected pitches
-                            while key_idx < len(keys) and keys[key_idx] < onset - onset_benchmark_tolerance_ms:
-                                key_idx += 1  # skip inexisting detected onsets
-                                onsetFP += 1
-                            if key_idx < len(keys) and abs(keys[key_idx] - onset) <= onset_benchmark_tolerance_ms:
-                                onsetTP += 1
-                                onset_stats.append(keys[key_idx] - onset)
-                                # if keys[key_idx] - onset > 5:
-                                #     print(f"onset at {onset} recognized too late ({keys[key_idx] - onset})")
-                                # if keys[key_idx] - onset < -20:
-                                #     print(f"onset at {onset} recognized too early ({keys[key_idx] - onset})")
-                                if pitch == pitches[keys[key_idx]]:
-                                    pitchTP += 1
-                                else:
-                                    pitchFN += 1
-                                    pOff = pitches[keys[key_idx]] - pitch
-                                    if pitches[keys[key_idx]] < lowest_note:
-                                        pOff *= 1000
-                                    if pOff not in pitch_error_stats:
-                                        pitch_error_stats[pOff] = 1
-                                    else:
-                                        pitch_error_stats[pOff] += 1
-                                    if pitch not in pitch_error_stats2:
-                                        pitch_error_stats2[pitch] = 1
-                                    else:
-                                        pitch_error_stats2[pitch] += 1
-                                key_idx += 1  # skip "used" onset
-                            else:
-                                onsetFN += 1
-                        while key_idx < len(keys):
-                            key_idx += 1
-                            onsetFP += 1
-
-                        if not silent:
-                            print(path.split('\\')[-1],
-                                  f"\t Onset: TP:{onsetTP}, FP:{onsetFP}, FN:{onsetFN} -> f1: "
-                                  f"{round(100*2*onsetTP**2/(2*onsetTP**2+onsetTP*onsetFP+onsetTP*onsetFN),2)}% "
-                                  f"(old: {round(100*onsetTP/(onsetTP+onsetFP+onsetFN),2)}%) \t"
-                                  f"Pitch: TP:{pitchTP}, FN:{pitchFN} -> {round(100*pitchTP/max(1,pitchTP+pitchFN), 1)}%")
-                            # print(pitches)
-
-                        _onsetTP += onsetTP
-                        _onsetFP += onsetFP
-                        _onsetFN += onsetFN
-                        _pitchTP += pitchTP
-                        _pitchFN += pitchFN
-
-                        for off in pitch_error_stats:
-                            if off not in _pitch_error_stats:
-                                _pitch_error_stats[off] = pitch_error_stats[off]
-                            else:
-                                _pitch_error_stats[off] += pitch_error_stats[off]
-                        for p in pitch_error_stats2:
-                            if p not in _pitch_error_stats2:
-                                _pitch_error_stats2[p] = pitch_error_stats2[p]
-                            else:
-                                _pitch_error_stats2[p] += pitch_error_stats2[p]
-
-                        _onset_stats += onset_stats
+        paths = find_files(benchmark_folders, '.wav', companion='csv', only=sys.argv[2] if len(sys.argv) > 2 else None)
+        benchmark_file = partial(process_file, od=od, pd=pd, pd2=pd2, hop_size=hop_size, sample_limit=sample_limit,
+                                 lowest_note=lowest_note, pitch_low_threshold=pitch_low_threshold,
+                                 filter_method=filter_method, cache_dir=cache_dir,
+                                 instrument=instrumentation_file is not None,
+                                 gate=SilenceGate() if silence_gate else None, pitch_window=pitch_window,
+                                 batch=batch_mode)
+        stats = Instrumentation()
+        for path, (pitches, evaluation, messages, file_stats) in run_files(benchmark_file, paths, processes):
+            if not silent:
+                for msg in messages:
+                    print(msg)
+            onsetTP, onsetFP, onsetFN, pitchTP, pitchFN, pTP, pFN = evaluation.counts()
+            if not silent:
+                print(path.split('\\')[-1],
+                      f"\t Onset: TP:{onsetTP}, FP:{onsetFP}, FN:{onsetFN} -> f1: "
+                      f"{round(100*2*onsetTP**2/(2*onsetTP**2+onsetTP*onsetFP+onsetTP*onsetFN),2)}% "
+                      f"(old: {round(100*onsetTP/(onsetTP+onsetFP+onsetFN),2)}%) \t"
+                      f"Pitch: TP:{pitchTP}, FN:{pitchFN} -> {round(100*pitchTP/max(1,pitchTP+pitchFN), 1)}%")
+                # print(pitches)
+
+            _evaluation += evaluation
+            if file_stats is not None:
+                stats.merge(file_stats)
 
         end = timer()
         if len(sys.argv) <= 2:
             if not silent:
                 print("--- All Files ---")
-                for k in sorted(_pitch_error_stats):
-                    print(f"{k}\t{_pitch_error_stats[k]}\t{round(_pitch_error_stats[k]/_pitchFN*100, 2)}%")
-                for k in sorted(_pitch_error_stats2):
-                    print(f"{k}\t{midi2char(k)}\t{_pitch_error_stats2[k]}\t{round(_pitch_error_stats2[k]/_pitchFN*100, 2)}%")
-                _os = sorted(_onset_stats)
-                print(f"min: {_os[0]}\t{_os[:10]}")
-                for i in range(1, 10):
-                    print(f"p{i}0: {_os[int(len(_os)*i/10)]}")
-                print(f"max: {_os[-1]} \t{_os[-10:]}")
-                print(f"mean: {statistics.mean(_onset_stats)}")
+                print_statistics(_evaluation)
+            _onsetTP, _onsetFP, _onsetFN, _pitchTP, _pitchFN, _pTP, _pFN = _evaluation.counts()
             print(f"Onset{onset_buf_size}: TP:{_onsetTP}, FP:{_onsetFP}, FN:{_onsetFN} -> f1: "
                   f"{round(100*2*_onsetTP**2/(2*_onsetTP**2+_onsetTP*_onsetFP+_onsetTP*_onsetFN),2)}% "
                   # f"(old: {round(100*_onsetTP/(_onsetTP+_onsetFP+_onsetFN),2)}%) \t"
                   f"Pitch{pitch_frame_size}_{history_length}: "
                   f"TP:{_pitchTP}, FN:{_pitchFN} -> {round(100*_pitchTP/(_pitchTP+_pitchFN), 2)}% \t"
-                  f"Pitch2: TP:{_pTP}, FN:{_pFN} -> {round(100*_pTP/(_pTP+_pFN), 2)}%")
+                  f"Pitch2: TP:{_pTP}, FN:{_pFN} -> {round(100*_pTP/max(1,_pTP+_pFN), 2)}%")
         else:
             print(pitches)
         print(f"elapsed time: {round(end - start, 3)}s")
+        if instrumentation_file is not None:
+            print(stats.summary())
+            stats.save(instrumentation_file)
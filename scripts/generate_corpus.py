@@ -0,0 +1,70 @@
+import os
+import sys
+
+from functools import partial
+from timeit import default_timer as timer
+
+import numpy as np
+import h5py
+
+module_dir = os.path.realpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir))
+if module_dir not in sys.path:
+    sys.path.append(module_dir)
+
+from mpd.runner import run_files
+from mpd.synth import PianoSynth, write_wav, write_ground_truth
+
+# config / arguments: generate_corpus.py [dest] [num_files]
+dest = r'C:\Projects\MusicTranscription\MAB-TonyGame\recordings\synthetic'
+dest = sys.argv[1] if len(sys.argv) > 1 else dest  # folder, or a .hdf5 container holding all files
+num_files = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+duration_s = 60.  # per file
+seed = 0  # the same seed always gives the same corpus, file i does not depend on the number of files
+samplerate = 44100
+files_per_folder = 1000  # files are spread over numbered subfolders
+processes = None  # worker processes (None: one per core, 1: serial)
+
+
+def file_name(index: int) -> str:
+    return f"{index // files_per_folder:04d}/piece_{index:06d}.wav"
+
+
+def process_file(name, synth, folder):
+    """ synthesizes a piece, writes the wav and csv file to folder. returns (samples, ground truth) if folder is None
+    (HDF5 container, written by the main process) or else the duration [s]
+    """
+    samples, truth = synth.piece(int(name[-10:-4]))
+    if folder is None:
+        return np.round(samples * 32767).astype(np.int16), truth
+    path = os.path.join(folder, *name.split('/'))
+    os.makedirs(os.path.dirname(path), exist_ok=True)  # several workers may create it at once
+    write_wav(path, samples, synth.samplerate)
+    write_ground_truth(path[:-3] + "csv", truth)
+    return len(samples) / synth.samplerate
+
+
+if __name__ == '__main__':
+    synth = PianoSynth(samplerate, duration_s, seed)
+    names = [file_name(i) for i in range(num_files)]
+    container = dest.endswith(('.hdf5', '.h5'))
+    generate = partial(process_file, synth=synth, folder=None if container else dest)
+
+    start = timer()
+    total_s = 0.
+    f = h5py.File(dest, 'w') if container else None
+    try:
+        for i, (name, result) in enumerate(run_files(generate, names, processes)):
+            if container:
+                samples, truth = result
+                f.create_dataset(name, data=samples, chunks=(min(len(samples), 65536),))
+                f[name].attrs['samplerate'] = samplerate
+                f.create_dataset(name[:-3] + "csv", data=np.array(truth, dtype=np.int64).reshape(-1, 2))
+                total_s += len(samples) / samplerate
+            else:
+                total_s += result
+            if (i + 1) % 100 == 0:
+                print(f"{i + 1}/{num_files} files, {round(total_s / 3600, 2)}h audio, {round(timer() - start, 1)}s")
+    finally:
+        if f is not None:
+            f.close()
+    print(f"{num_files} files, {round(total_s / 3600, 2)}h audio written to {dest} in {round(timer() - start, 1)}s")
@@ -0,0 +1,48 @@
+import os
+import sys
+import subprocess
+
+import numpy as np
+
+module_dir = os.path.realpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir))
+
+# config / arguments: import_benchmark.py [budget_ms]
+budget_ms = float(sys.argv[1]) if len(sys.argv) > 1 else 100.  # import time of mpd on top of numpy and aubio
+repeats = 5  # fresh interpreters, the median counts
+statement = "import mpd.pipeline, mpd.source"  # the aubio only path (NoteTranscriber, create_transcriber, sources)
+heavy = ['madmom', 'scipy.fft', 'scipy.ndimage', 'scipy.io', 'scipy.signal', 'wavio', 'h5py', 'pyaudio']  # lazy
+
+# runs in a fresh interpreter with -X importtime (lists the modules that were actually executed on stderr)
+child = f"""
+from timeit import default_timer as timer
+start = timer()
+import numpy, aubio
+backends = timer()
+{statement}
+print(backends - start, timer() - backends)
+"""
+
+
+def cold_start():
+    """ (seconds for numpy+aubio, seconds for the statement, names of the imported modules) of a fresh interpreter """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [module_dir, os.environ.get('PYTHONPATH')])))
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', child], env=env, capture_output=True, text=True,
+                          check=True)
+    backends_s, mpd_s = map(float, proc.stdout.split())
+    modules = {line.rsplit('|', 1)[-1].strip() for line in proc.stderr.splitlines() if line.startswith('import time:')}
+    return backends_s, mpd_s, modules
+
+
+if __name__ == '__main__':
+    runs = [cold_start() for _ in range(repeats)]
+    backends_ms = np.median([r[0] for r in runs]) * 1000
+    mpd_ms = np.median([r[1] for r in runs]) * 1000
+    loaded = sorted({m for r in runs for m in r[2] if any(m == h or m.startswith(h + '.') for h in heavy)})
+    print(f"numpy + aubio: {backends_ms:8.1f} ms")
+    print(f"{statement}: {mpd_ms:8.1f} ms (budget {budget_ms} ms)")
+    if loaded:
+        print("imported although only needed by other detectors / sources: " + ", ".join(loaded))
+    if mpd_ms > budget_ms or loaded:
+        print("FAILED")
+        sys.exit(1)
+    print("OK")
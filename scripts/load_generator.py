@@ -0,0 +1,117 @@
+import os
+import sys
+import asyncio
+import random
+
+from time import perf_counter, process_time
+
+import numpy as np
+
+module_dir = os.path.realpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir))
+if module_dir not in sys.path:
+    sys.path.append(module_dir)
+
+from mpd.source import create_source
+from mpd.runner import find_files
+from mpd.server import TranscriptionServer, MAGIC, HELLO, read_events
+
+# config / arguments
+benchmark_folders = [r'C:\Users\Silvan\Desktop']
+server_address = None  # (host, port) of a running transcription_server.py, None: start a server in this process
+port = 8765
+hop_size = 512  # of the server started in this process
+num_clients = 16  # simulated clients streaming at the same time
+sessions_per_client = 2  # wav files each client streams one after the other (new session each)
+realtime = True  # stream the audio in real time (latency), False: as fast as possible (throughput)
+start_spread_s = 1.  # clients start at random times within this interval
+
+
+async def stream_file(host, port, samples, samplerate, latencies, lags):
+    """ streams one file like a live input, the latency of an event is measured from the moment the hop it was
+    reported with was sent
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(HELLO.pack(MAGIC, samplerate))
+    magic, hop = HELLO.unpack(await reader.readexactly(HELLO.size))
+    num_hops = len(samples) // hop
+    sent = np.zeros(num_hops + 1)  # time at which the first i hops were sent
+
+    async def send():
+        start = perf_counter()
+        for i in range(num_hops):
+            if realtime:  # a hop is available when its last sample was recorded
+                delay = start + (i + 1) * hop / samplerate - perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                else:
+                    lags.append(-delay)
+            writer.write(samples[i * hop:(i + 1) * hop].tobytes())
+            sent[i + 1] = perf_counter()
+            await writer.drain()
+        writer.write_eof()
+
+    sender = asyncio.create_task(send())
+    events = 0
+    async for onset, time, pitch, confidence in read_events(reader):
+        latencies.append(perf_counter() - sent[time // hop])
+        events += 1
+    await sender
+    writer.close()
+    return num_hops * hop / samplerate, events
+
+
+async def client(host, port, files, latencies, lags):
+    await asyncio.sleep(random.uniform(0, start_spread_s))
+    audio, events = 0., 0
+    for samples, samplerate in files:
+        a, e = await stream_file(host, port, samples, samplerate, latencies, lags)
+        audio += a
+        events += e
+    return audio, events
+
+
+async def main(recordings):
+    server = None
+    host, port_ = server_address if server_address is not None else ('127.0.0.1', port)
+    if server_address is None:
+        server = TranscriptionServer(hop_size)
+        await server.start(host, port_)
+
+    latencies, lags = [], []
+    jobs = []
+    for c in range(num_clients):
+        files = [recordings[(c * sessions_per_client + s) % len(recordings)] for s in range(sessions_per_client)]
+        jobs.append(client(host, port_, files, latencies, lags))
+
+    start, cpu_start = perf_counter(), process_time()
+    results = await asyncio.gather(*jobs)
+    wall, cpu = perf_counter() - start, process_time() - cpu_start
+    if server is not None:
+        server.server.close()
+        await server.server.wait_closed()
+        print(f"detectors created: {server.created} for {num_clients * sessions_per_client} sessions")
+    return results, latencies, lags, wall, cpu
+
+
+if __name__ == '__main__':
+    paths = find_files(benchmark_folders, '.wav', only=sys.argv[1] if len(sys.argv) > 1 else None)
+    recordings = []
+    for path in paths:
+        src = create_source(path, hop_size=hop_size, verbose=False)
+        recordings.append((src.read_all(), src.samplerate))
+
+    results, latencies, lags, wall, cpu = asyncio.run(main(recordings))
+
+    audio = sum(a for a, _ in results)
+    events = sum(e for _, e in results)
+    print(f"{num_clients} clients, {'real time' if realtime else 'as fast as possible'}: "
+          f"{round(audio, 1)}s audio, {events} events in {round(wall, 3)}s")
+    if latencies:
+        p50, p90, p99 = np.percentile(np.array(latencies) * 1000, [50, 90, 99])
+        print(f"event latency [ms]: p50: {round(p50, 2)}, p90: {round(p90, 2)}, p99: {round(p99, 2)}, "
+              f"max: {round(max(latencies) * 1000, 2)}")
+    if realtime:
+        print(f"hops sent late: {len(lags)}, max lag: {round(max(lags, default=0) * 1000, 2)}ms")
+    # cpu time of this process, includes the clients if the server runs in this process
+    print(f"cpu: {round(cpu, 3)}s -> {round(audio / max(cpu, 1e-9), 1)} real time streams per core"
+          f"{' (lower bound, clients included)' if server_address is None else ' (clients only)'}")
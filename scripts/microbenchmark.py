@@ -0,0 +1,203 @@
+import os
+import sys
+import json
+import platform
+import subprocess
+import tempfile
+
+from datetime import datetime
+from timeit import default_timer as timer
+
+import numpy as np
+from scipy.io import wavfile
+import h5py
+import aubio
+
+module_dir = os.path.realpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir))
+if module_dir not in sys.path:
+    sys.path.append(module_dir)
+
+from mpd.source import SOURCES, sniff, HDF5_SEPARATOR
+from mpd.onset import AubioOnsetDetector, MadmomFeatureOnsetDetector, MadmomRNNOnsetDetector, SpectralOnsetDetector
+from mpd.pitch import AubioPitchDetector, SpectralPitchDetector, vote_weights
+from mpd.spectral import SpectralFrontEnd
+from mpd.smoothing import WeightedVoteSmoother
+
+# config / arguments: microbenchmark.py [results.json] [earlier_results.json]
+results_file = sys.argv[1] if len(sys.argv) > 1 else None  # json file for the results (None: print only)
+compare_file = sys.argv[2] if len(sys.argv) > 2 else None  # results of an earlier run to compare with
+duration_s = 10.  # length of the synthetic test signal
+samplerate = 44100
+hop_size = 512
+repeats = 3  # every case is run this many times, the fastest run counts
+only = None  # substring of the case names to run (None: all)
+
+
+def synthetic_notes(duration_s: float, samplerate: int, note_s: float=0.5, seed: int=0):
+    """ piano-like test signal: a random note (midi 40-80, 6 decaying harmonics) every note_s seconds plus noise """
+    rng = np.random.default_rng(seed)
+    samples = np.zeros(int(duration_s * samplerate))
+    note_len = int(note_s * samplerate)
+    t = np.arange(note_len) / samplerate
+    for start in range(0, len(samples) - note_len + 1, note_len):
+        f0 = 440. * 2 ** ((rng.integers(40, 81) - 69) / 12)
+        note = sum(np.sin(2 * np.pi * f0 * k * t) * np.exp(-t * (2 + k)) / k for k in range(1, 7) if f0 * k < samplerate / 2)
+        samples[start:start + note_len] = 0.3 * note
+    samples += rng.normal(0, 1e-3, len(samples))
+    return samples.astype(np.float32)
+
+
+def time_calls(setup, calls):
+    """ (fastest total time of `repeats` runs, number of calls per run): setup() -> function doing all calls """
+    best = np.inf
+    for _ in range(repeats):
+        run = setup()
+        start = timer()
+        run()
+        best = min(best, timer() - start)
+    return best, calls
+
+
+def detector_case(create, hops):
+    def setup():
+        detector = create()
+        detector.create_detector(samplerate)
+        process = detector.process_next
+
+        def run():
+            for samples in hops:
+                process(samples)
+        return run
+    return lambda: time_calls(setup, len(hops))
+
+
+def pair_case(create, hops):
+    """ create() -> (onset detector, pitch detector), both run on every hop like in NoteTranscriber.process_hop """
+    def setup():
+        od, pd = create()
+        od.create_detector(samplerate)
+        pd.create_detector(samplerate)
+        process_onset, process_pitch = od.process_next, pd.process_next
+
+        def run():
+            for samples in hops:
+                process_onset(samples)
+                process_pitch(samples)
+        return run
+    return lambda: time_calls(setup, len(hops))
+
+
+def spectral_pair(frame_size: int=2048):
+    front_end = SpectralFrontEnd(hop_size, frame_size)
+    return SpectralOnsetDetector(front_end, 'specflux', frame_size, 50), SpectralPitchDetector(front_end, frame_size, 8)
+
+
+def source_case(cls, path):
+    def setup():
+        def run():
+            src = cls.open(path, hop_size, sniff(path))
+            while True:
+                _, read = src()
+                if read < hop_size:
+                    break
+        return run
+    return lambda: time_calls(setup, int(duration_s * samplerate) // hop_size + 1)
+
+
+def smoother_case(pitches, batch: bool=False):
+    def setup():
+        smoother = WeightedVoteSmoother(vote_weights(13, 2048, hop_size))
+        if batch:
+            return lambda: smoother.process_array(pitches)
+        process = smoother.process_next
+
+        def run():
+            for pitch in pitches:
+                process(pitch)
+        return run
+    return lambda: time_calls(setup, len(pitches))
+
+
+def cases(samples, wav_path, hdf5_path):
+    hops = [np.ascontiguousarray(h) for h in samples[:len(samples) // hop_size * hop_size].reshape(-1, hop_size)]
+    result = {}
+    for method in ['yin', 'yinfft', 'mcomb']:
+        for frame_size in [2048, 4096]:
+            result[f"pitch/{method}/{frame_size}"] = detector_case(
+                lambda m=method, f=frame_size: AubioPitchDetector(m, hop_size, f, 8), hops)
+    for method in ['energy', 'hfc', 'specflux']:
+        result[f"onset/aubio/{method}"] = detector_case(
+            lambda m=method: AubioOnsetDetector(m, hop_size, 2048, 50), hops)
+    result["onset/spectral/specflux"] = detector_case(
+        lambda: SpectralOnsetDetector(SpectralFrontEnd(hop_size, 2048), 'specflux', 2048, 50), hops)
+    result["pitch/spectral/2048"] = detector_case(lambda: SpectralPitchDetector(SpectralFrontEnd(hop_size, 2048),
+                                                                                2048, 8), hops)
+    result["onset+pitch/aubio/2048"] = pair_case(lambda: (AubioOnsetDetector('specflux', hop_size, 2048, 50),
+                                                          AubioPitchDetector('yinfft', hop_size, 2048, 8)), hops)
+    result["onset+pitch/spectral/2048"] = pair_case(spectral_pair, hops)
+    result["onset/madmom/superflux"] = detector_case(
+        lambda: MadmomFeatureOnsetDetector('superflux', hop_size, 2048, 50, num_bands=24), hops)
+    result["onset/madmom/rnn"] = detector_case(lambda: MadmomRNNOnsetDetector(hop_size, 2048, 50), hops)
+    for cls in SOURCES:
+        for path in [wav_path, hdf5_path]:
+            if cls.accepts(sniff(path)):
+                kind = 'hdf5' if HDF5_SEPARATOR in path else 'wav16'
+                result[f"source/{cls.__name__}/{kind}"] = source_case(cls, path)
+    pitches = np.clip(np.cumsum(np.random.default_rng(1).integers(-1, 2, len(hops))) + 60, 0, 127).tolist()
+    result["smoother/vote/process_next"] = smoother_case(pitches)
+    result["smoother/vote/process_array"] = smoother_case(np.array(pitches), batch=True)
+    return result
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=module_dir, capture_output=True, text=True,
+                                timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    try:
+        import madmom
+        madmom_version = madmom.__version__
+    except (ImportError, AttributeError):
+        madmom_version = None
+    return {'date': datetime.now().isoformat(timespec='seconds'), 'commit': commit, 'platform': platform.platform(),
+            'processor': platform.processor(), 'python': platform.python_version(), 'numpy': np.__version__,
+            'aubio': aubio.version, 'madmom': madmom_version, 'duration_s': duration_s, 'samplerate': samplerate,
+            'hop_size': hop_size, 'repeats': repeats}
+
+
+if __name__ == '__main__':
+    samples = synthetic_notes(duration_s, samplerate)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        wav_path = os.path.join(tmp, 'notes.wav')
+        wavfile.write(wav_path, samplerate, np.round(samples * 32767).astype(np.int16))
+        with h5py.File(os.path.join(tmp, 'notes.hdf5'), 'w') as f:
+            f.create_dataset('notes.wav', data=np.round(samples * 32767).astype(np.int16), chunks=(4096,))
+            f['notes.wav'].attrs['samplerate'] = samplerate
+        hdf5_path = os.path.join(tmp, 'notes.hdf5') + HDF5_SEPARATOR + 'notes.wav'
+
+        for name, case in cases(samples, wav_path, hdf5_path).items():
+            if only is not None and only not in name:
+                continue
+            try:
+                total, calls = case()
+            except Exception as e:  # e.g. a library that is not installed
+                results[name] = {'error': f"{type(e).__name__}: {e}"}
+                print(f"{name:32s} failed: {results[name]['error']}")
+                continue
+            results[name] = {'calls': calls, 'total_s': total, 'per_call_us': total / calls * 1e6,
+                             'real_time_factor': total / duration_s}  # < 1: faster than real time
+            print(f"{name:32s} {results[name]['per_call_us']:10.2f} us/call \t"
+                  f"{duration_s / total:8.1f}x real time")
+
+    if compare_file is not None:
+        with open(compare_file, mode='r') as f:
+            earlier = json.load(f)['results']
+        print(f"--- compared with {compare_file} (new / old time) ---")
+        for name, r in results.items():
+            if 'per_call_us' in r and 'per_call_us' in earlier.get(name, {}):
+                print(f"{name:32s} {r['per_call_us'] / earlier[name]['per_call_us']:6.2f}")
+    if results_file is not None:
+        with open(results_file, mode='w') as f:
+            json.dump({'environment': environment(), 'results': results}, f, indent=2)
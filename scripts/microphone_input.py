@@ -1,23 +1,22 @@
 import os
 import sys
-
-import numpy as np
-import pyaudio
+import threading
 
 module_dir = os.path.realpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir))
 if module_dir not in sys.path:
     sys.path.append(module_dir)
 
 from mpd.pitch import AubioPitchDetector
+from mpd.live import LiveInput, FakeStream, open_microphone
+from mpd.source import create_source
 from mpd.utils import midi2char
 
 # config / arguments
+input_file = None  # wav file played in real time instead of the microphone input (no sound card needed)
+buffer_hops = 64  # capacity of the ring buffer between audio callback and detection
 
-if __name__ == '__main__':
-    FORMAT = pyaudio.paFloat32
-    CHANNELS = 1
-    RECORD_SECONDS = 5
 
+if __name__ == '__main__':
     hop_size = 512
     pitch_method = 'yinfft'
     pitch_frame_size = 2048
@@ -28,23 +27,37 @@ if __name__ == '__main__':
 
     # init mic
     sr = 44100
+    if input_file is not None:
+        src = create_source(input_file, hop_size, verbose=False)
+        sr = src.samplerate
 
     # get onset+pitches of mic input
     pd.create_detector(sr)
+    done = threading.Event()
 
-    p = pyaudio.PyAudio()
-    stream = p.open(format=FORMAT, channels=CHANNELS, rate=sr, input=True, frames_per_buffer=hop_size)
-
-    while True:
-        buffer = stream.read(hop_size)  # get next hop_size of samples
-        samples = np.fromstring(buffer, dtype=np.float32)
+    def process_hop(samples):
         pitch = pd.process_next(samples)
-
         print("\t\t\t", pitch, "\t", midi2char(pitch), "\t\t", end="\r")  # confidence = pitch_obj.get_confidence()
-
         if pitch == 44:
-            break
+            done.set()
+
+    live = LiveInput(process_hop, hop_size, buffer_hops)
+    live.start()
+    if input_file is not None:
+        p, stream = None, FakeStream(src.read_all(), sr, hop_size, live.callback)
+        stream.start_stream()
+    else:
+        p, stream = open_microphone(live, sr)
+
+    while not done.wait(0.1) and stream.is_active() and live.error is None:
+        pass
 
     stream.stop_stream()
     stream.close()
-    p.terminate()
+    if p is not None:
+        p.terminate()
+    live.stop(drain=False)
+    if live.error is not None:
+        raise live.error
+    print(f"\nhops: {live.processed}, overruns: {live.overruns}, underruns: {live.underruns}, "
+          f"input overflows: {live.input_overflows}")
@@ -1,7 +1,5 @@
 import os
 import sys
-import csv
-import statistics
 import aubio
 
 from collections import deque
@@ -12,7 +10,7 @@ if module_dir not in sys.path:
     sys.path.append(module_dir)
 
 from mpd.source import create_source
-from mpd.utils import midi2char
+from mpd.evaluation import Evaluation, load_truth, print_statistics
 
 os.system("")  # enables colors
 
@@ -45,10 +43,7 @@ if __name__ == '__main__':
         # print(f"t: {-60 + t*2}")
         # od.threshold = t/20  # 10-21 = 0.5-1.0 in 0.05 steps
 
-        _onsetTP, _onsetFP, _onsetFN = 0, 0, 0
-        _pitchTP, _pitchFN, _pTP, _pFN = 0, 0, 0, 0
-        _pitch_error_stats, _pitch_error_stats2 = {}, {}
-        _onset_stats = []
+        _evaluation = Evaluation()
         start = timer()
         for folder in benchmark_folders:
             for subdir, dirs, files in os.walk(folder):
@@ -135,92 +130,26 @@ if __name__ == '__main__':
                                 else:
                                     print(f"\033[35m({pitch1},{pitch2})\033[0m", end=" ")
 
-                    with open(path_csv, mode='r') as f:
-                        reader = csv.reader(f, delimiter=',')
-                        keys = list(pitches.keys())
-                        key_idx = 0
-                        onsetTP, onsetFP, onsetFN = 0, 0, 0
-                        pitchTP, pitchFN = 0, 0
-                        pitch_error_stats, pitch_error_stats2 = {}, {}
-                        onset_stats = []
-                        for row in reader:
-                            onset, pitch = int(row[0]), int(row[1])
-
-                            # check detected pitches
-                            while key_idx < len(keys) and keys[key_idx] < onset - onset_benchmark_tolerance_ms:
-                                key_idx += 1  # skip inexisting detected onsets
-                                onsetFP += 1
-                            if key_idx < len(keys) and abs(keys[key_idx] - onset) <= onset_benchmark_tolerance_ms:
-                                onsetTP += 1
-                                onset_stats.append(keys[key_idx] - onset)
-                                # if keys[key_idx] - onset > 5:
-                                #     print(f"onset at {onset} recognized too late ({keys[key_idx] - onset})")
-                                # if keys[key_idx] - onset < -20:
-                                #     print(f"onset at {onset} recognized too early ({keys[key_idx] - onset})")
-                                if pitch == pitches[keys[key_idx]]:
-                                    pitchTP += 1
-                                else:
-                                    pitchFN += 1
-                                    pOff = pitches[keys[key_idx]] - pitch
-                                    if pitches[keys[key_idx]] < lowest_note:
-                                        pOff *= 1000
-                                    if pOff not in pitch_error_stats:
-                                        pitch_error_stats[pOff] = 1
-                                    else:
-                                        pitch_error_stats[pOff] += 1
-                                    if pitch not in pitch_error_stats2:
-                                        pitch_error_stats2[pitch] = 1
-                                    else:
-                                        pitch_error_stats2[pitch] += 1
-                                key_idx += 1  # skip "used" onset
-                            else:
-                                onsetFN += 1
-                        while key_idx < len(keys):
-                            key_idx += 1
-                            onsetFP += 1
-
-                        if not silent:
-                            if verbose:
-                                print()
-                            print(path.split('\\')[-1],
-                                  f"\t Onset: TP:{onsetTP}, FP:{onsetFP}, FN:{onsetFN} -> f1: \033[32m"
-                                  f"{round(100*2*onsetTP**2/max(1,(2*onsetTP**2+onsetTP*onsetFP+onsetTP*onsetFN)),2)}% "
-                                  f"\033[0mPitch: TP:{pitchTP}, FN:{pitchFN} -> \033[32m"
-                                  f"{round(100*pitchTP/max(1,pitchTP+pitchFN),1)}%\033[0m")
-
-                        _onsetTP += onsetTP
-                        _onsetFP += onsetFP
-                        _onsetFN += onsetFN
-                        _pitchTP += pitchTP
-                        _pitchFN += pitchFN
-
-                        for off in pitch_error_stats:
-                            if off not in _pitch_error_stats:
-                                _pitch_error_stats[off] = pitch_error_stats[off]
-                            else:
-                                _pitch_error_stats[off] += pitch_error_stats[off]
-                        for p in pitch_error_stats2:
-                            if p not in _pitch_error_stats2:
-                                _pitch_error_stats2[p] = pitch_error_stats2[p]
-                            else:
-                                _pitch_error_stats2[p] += pitch_error_stats2[p]
-
-                        _onset_stats += onset_stats
+                    evaluation = Evaluation.evaluate(pitches, load_truth(path_csv), onset_benchmark_tolerance_ms,
+                                                     lowest_note)
+                    onsetTP, onsetFP, onsetFN, pitchTP, pitchFN, _, _ = evaluation.counts()
+                    if not silent:
+                        if verbose:
+                            print()
+                        print(path.split('\\')[-1],
+                              f"\t Onset: TP:{onsetTP}, FP:{onsetFP}, FN:{onsetFN} -> f1: \033[32m"
+                              f"{round(100*2*onsetTP**2/max(1,(2*onsetTP**2+onsetTP*onsetFP+onsetTP*onsetFN)),2)}% "
+                              f"\033[0mPitch: TP:{pitchTP}, FN:{pitchFN} -> \033[32m"
+                              f"{round(100*pitchTP/max(1,pitchTP+pitchFN),1)}%\033[0m")
+
+                    _evaluation += evaluation
 
         end = timer()
         if len(sys.argv) <= 1:
             if not silent:
                 print("--- All Files ---")
-                for k in sorted(_pitch_error_stats):
-                    print(f"{k}\t{_pitch_error_stats[k]}\t{round(_pitch_error_stats[k]/_pitchFN*100, 2)}%")
-                for k in sorted(_pitch_error_stats2):
-                    print(f"{k}\t{midi2char(k)}\t{_pitch_error_stats2[k]}\t{round(_pitch_error_stats2[k]/_pitchFN*100, 2)}%")
-                _os = sorted(_onset_stats)
-                print(f"min: {_os[0]}\t{_os[:10]}")
-                for i in range(1, 10):
-                    print(f"p{i}0: {_os[int(len(_os)*i/10)]}")
-                print(f"max: {_os[-1]} \t{_os[-10:]}")
-                print(f"mean: {statistics.mean(_onset_stats)}")
+                print_statistics(_evaluation)
+            _onsetTP, _onsetFP, _onsetFN, _pitchTP, _pitchFN, _, _ = _evaluation.counts()
             print(f"{history_length} Onset: TP:{_onsetTP}, FP:{_onsetFP}, FN:{_onsetFN} -> f1: \033[32m"
                   f"{round(100*2*_onsetTP**2/max(1,(2*_onsetTP**2+_onsetTP*_onsetFP+_onsetTP*_onsetFN)),2)}% "
                   f"\033[0mPitch: TP:{_pitchTP}, FN:{_pitchFN} -> \033[32m"
@@ -0,0 +1,82 @@
+import os
+import sys
+
+from functools import partial
+from timeit import default_timer as timer
+
+module_dir = os.path.realpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir))
+if module_dir not in sys.path:
+    sys.path.append(module_dir)
+
+from mpd.source import create_source
+from mpd.runner import find_files, run_files
+from mpd.evaluation import Evaluation, load_truth
+from mpd.onset import AubioOnsetDetector
+from mpd.sweep import compute_raw_track, replay_notes, parameter_grid
+from mpd.cache import FeatureCache, cached_raw_track
+
+# config / arguments
+benchmark_folders = [r'C:\Users\Silvan\Desktop']
+
+onset_benchmark_tolerance_ms = 25  # onset tolerance difference
+pitch_time_limit_s = 0.13
+processes = None  # worker processes (None: one per core, 1: serial)
+cache_dir = None  # feature cache for decoded audio and raw detector outputs (None: no cache)
+cache_size_mb = 2048
+
+# post-processing parameters to sweep (see mpd.sweep.replay_notes), every combination is evaluated
+grid = {
+    'threshold': [0.5, 0.6, 0.75, 0.85, 0.95],
+    'silence': [-60, -54, -48],
+    'history_length': [8, 10, 13, 16],
+    'pitch_low_threshold': [43, 47, 53],
+}
+
+
+def load_file(path, od, hop_size, pitch_frame_sizes):
+    """ raw detector outputs and ground truth (onsets[ms], pitches[midi]) of a single file, runs in a worker process """
+    if cache_dir is not None:
+        raw = cached_raw_track(FeatureCache(cache_dir, cache_size_mb), path, od, hop_size,
+                               pitch_frame_sizes=pitch_frame_sizes)
+    else:
+        src = create_source(path, hop_size=hop_size, verbose=False)
+        raw = compute_raw_track(src, od, pitch_frame_sizes=pitch_frame_sizes)
+    truth = load_truth(path[:-3] + "csv")
+    return raw, truth
+
+
+if __name__ == '__main__':
+    hop_size = 512
+    onset_method = 'specflux'
+    onset_buf_size = 2048
+    onset_minioi_ms = 50
+    pitch_frame_size = 2048
+    lowest_note = 35  # B1
+
+    od = AubioOnsetDetector(onset_method, hop_size, onset_buf_size, onset_minioi_ms)
+
+    # DSP: once per file
+    start = timer()
+    paths = find_files(benchmark_folders, '.wav', companion='csv', only=sys.argv[1] if len(sys.argv) > 1 else None)
+    load = partial(load_file, od=od, hop_size=hop_size, pitch_frame_sizes=(pitch_frame_size, pitch_frame_size*2))
+    tracks = [result for path, result in run_files(load, paths, processes)]
+    print(f"{len(tracks)} files analyzed in {round(timer() - start, 3)}s")
+
+    # replay: once per grid point and file
+    start = timer()
+    results = []
+    for params in parameter_grid(grid):
+        evaluation = Evaluation()
+        for raw, truth in tracks:
+            pitches, all_pitches = replay_notes(raw, minioi_ms=onset_minioi_ms, frame_size=pitch_frame_size,
+                                                frame_size2=pitch_frame_size*2, lowest_note=lowest_note, **params)
+            evaluation += Evaluation.evaluate(pitches, truth, onset_benchmark_tolerance_ms, lowest_note, all_pitches,
+                                              raw.samplerate, hop_size, pitch_time_limit_s)
+        results.append((evaluation.onset_f1, evaluation.pitch_accuracy, params, evaluation.counts()))
+    end = timer()
+
+    for f1, pitch_acc, params, total in sorted(results, key=lambda r: (r[0], r[1])):
+        print(f"{params}\t Onset: TP:{total[0]}, FP:{total[1]}, FN:{total[2]} -> f1: {round(100*f1, 2)}% \t"
+              f"Pitch: TP:{total[3]}, FN:{total[4]} -> {round(100*pitch_acc, 2)}% \t"
+              f"Pitch2: TP:{total[5]}, FN:{total[6]}")
+    print(f"{len(results)} parameter sets evaluated in {round(end - start, 3)}s")
@@ -0,0 +1,121 @@
+import os
+import sys
+
+import numpy as np
+import aubio
+
+module_dir = os.path.realpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir))
+if module_dir not in sys.path:
+    sys.path.append(module_dir)
+
+from mpd.multistream import MultiStreamDetector, MultiOnsetDetector, MultiPitchDetector
+from mpd.onset import AubioOnsetDetector, SpectralOnsetDetector
+from mpd.pitch import AubioPitchDetector, SpectralPitchDetector, pitch_track
+from mpd.spectral import SpectralFrontEnd
+from mpd.synth import PianoSynth
+
+# config / arguments: parity_check.py [num_streams] [duration_s]
+# compares the numpy re-implementations of aubio's detectors with aubio itself, hop by hop on PianoSynth pieces
+num_streams = int(sys.argv[1]) if len(sys.argv) > 1 else 4  # pieces, also the streams of the MultiStreamDetector
+duration_s = float(sys.argv[2]) if len(sys.argv) > 2 else 15.
+samplerate = 44100
+hop_size = 512
+seed = 0
+onset_frame_size = 2048
+pitch_cases = [('yinfft', 2048), ('yinfft', 4096), ('yin', 2048), ('yin', 4096)]  # (method, frame size)
+history_length = 8
+# mismatch budget: differing onsets per onset reported by aubio (a detection function value right at the threshold
+# may flip an onset, ~1 in 70), differing pitches per hop (float rounding near x.5 midi and yin's float32 ties, a few
+# per thousand hops at most)
+onset_budget = 0.05
+pitch_budget = 0.005
+
+
+def aubio_onsets(hops):
+    od = AubioOnsetDetector('specflux', hop_size, onset_frame_size, 50)
+    od.create_detector(samplerate)
+    return np.array([od.process_next(hop) for hop in hops])
+
+
+def aubio_pitches(hops, method: str, frame_size: int):
+    """ (smoothed pitches of AubioPitchDetector, rounded raw pitches of aubio.pitch) """
+    pd = AubioPitchDetector(method, hop_size, frame_size, history_length)
+    pd.create_detector(samplerate)
+    smoothed = np.array([pd.process_next(hop) for hop in hops])
+    pitch = aubio.pitch(method, frame_size, hop_size, samplerate)
+    pitch.set_unit('midi')
+    raw = np.array([int(round(pitch(hop)[0])) for hop in hops])
+    return smoothed, raw
+
+
+def multistream(streams):
+    """ (onsets, {(method, frame size): pitches}), streams x hops each """
+    detector = MultiStreamDetector(hop_size, MultiOnsetDetector(hop_size, onset_frame_size),
+                                   [MultiPitchDetector(m, hop_size, f, history_length) for m, f in pitch_cases])
+    detector.create_detector(samplerate, len(streams))
+    onsets, pitches = [], []
+    for hops in np.stack(streams, axis=1):  # hops of all streams, one hop after the other
+        o, p = detector.process_next(hops)
+        onsets.append(o)
+        pitches.append(p)
+    return np.array(onsets).T, {case: np.array([p[i] for p in pitches]).T for i, case in enumerate(pitch_cases)}
+
+
+def spectral(hops, frame_size: int):
+    """ (onsets, yinfft pitches) of a SpectralOnsetDetector and a SpectralPitchDetector sharing their front end """
+    front_end = SpectralFrontEnd(hop_size, max(frame_size, onset_frame_size))
+    od = SpectralOnsetDetector(front_end, 'specflux', onset_frame_size)
+    pd = SpectralPitchDetector(front_end, frame_size, history_length)
+    od.create_detector(samplerate)
+    pd.create_detector(samplerate)
+    onsets, pitches = [], []
+    for hop in hops:
+        onsets.append(od.process_next(hop))
+        pitches.append(pd.process_next(hop))
+    return np.array(onsets), np.array(pitches)
+
+
+def count(results, name: str, value, reference, onsets: bool=False):
+    """ add the number of differing hops to results[name]: [differences, compared, unit]. Onsets are compared per
+    onset reported by aubio (reference), pitches per hop
+    """
+    entry = results.setdefault(name, [0, 0, 'onsets' if onsets else 'hops'])
+    entry[0] += int(np.count_nonzero(value != reference))
+    entry[1] += int(np.count_nonzero(reference)) if onsets else len(reference)
+
+
+if __name__ == '__main__':
+    synth = PianoSynth(samplerate, duration_s, seed)
+    signals = [synth.piece(i)[0] for i in range(num_streams)]
+    num_hops = min(len(s) for s in signals) // hop_size
+    streams = [s[:num_hops * hop_size].reshape(num_hops, hop_size) for s in signals]
+    print(f"{num_streams} streams x {num_hops} hops")
+
+    results = {}  # name: [differences, compared, unit]
+    multi_onsets, multi_pitches = multistream(streams)
+    spectral_results = {frame_size: [spectral(hops, frame_size) for hops in streams]
+                        for frame_size in sorted({f for m, f in pitch_cases if m == 'yinfft'})}
+    for i, (signal, hops) in enumerate(zip(signals, streams)):
+        onsets = aubio_onsets(hops)
+        count(results, 'multistream/specflux', multi_onsets[i], onsets, onsets=True)
+        for frame_size, runs in spectral_results.items():
+            count(results, f'spectral/specflux (front end {frame_size})', runs[i][0], onsets, onsets=True)
+        for method, frame_size in pitch_cases:
+            smoothed, raw = aubio_pitches(hops, method, frame_size)
+            count(results, f'multistream/{method}/{frame_size}', multi_pitches[method, frame_size][i], smoothed)
+            if method == 'yinfft':
+                count(results, f'spectral/{method}/{frame_size}', spectral_results[frame_size][i][1], smoothed)
+            track, _ = pitch_track(signal[:num_hops * hop_size], method, frame_size, hop_size, samplerate)
+            count(results, f'pitch_track/{method}/{frame_size}', np.round(track).astype(int), raw)
+
+    failed = False
+    for name, (differences, compared, unit) in results.items():
+        budget = onset_budget if unit == 'onsets' else pitch_budget
+        over = differences > budget * max(compared, 1)
+        failed |= over
+        print(f"{name:40s} {differences:5d} / {compared:6d} {unit} differ (budget {budget:.1%})"
+              f"{'  FAILED' if over else ''}")
+    if failed:
+        print("FAILED")
+        sys.exit(1)
+    print("OK")
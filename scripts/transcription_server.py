@@ -0,0 +1,23 @@
+import os
+import sys
+import asyncio
+
+module_dir = os.path.realpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir))
+if module_dir not in sys.path:
+    sys.path.append(module_dir)
+
+from mpd.server import TranscriptionServer
+
+# config / arguments
+host = '127.0.0.1'
+port = 8765
+hop_size = 512
+
+
+if __name__ == '__main__':
+    server = TranscriptionServer(hop_size)
+    print(f"listening on {host}:{port}")
+    try:
+        asyncio.run(server.serve_forever(host, port))
+    except KeyboardInterrupt:
+        pass
@@ -2,15 +2,18 @@ import os
 import sys
 import csv
 
-import aubio
+from functools import partial
 
 module_dir = os.path.realpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir))
 if module_dir not in sys.path:
     sys.path.append(module_dir)
 
 from mpd.source import create_source
+from mpd.runner import find_files, run_files
 from mpd.onset import AubioOnsetDetector, MadmomFeatureOnsetDetector, MadmomRNNOnsetDetector
 from mpd.pitch import AubioPitchDetector
+from mpd.pipeline import NoteTranscriber
+from mpd.pool import DetectorPool
 
 # config / arguments
 folder = r'C:\Projects\MusicTranscription\MAB-TonyGame\recordings\benchmarks\7'
@@ -19,9 +22,37 @@ folder = r'C:\Projects\MusicTranscription\MAB-TonyGame\recordings\soundtesting_p
 folder = r'C:\Projects\MusicTranscription\MAB-TonyGame\recordings\benchmarks\8'
 # destination folder for mock CSV
 dest = r'C:\Projects\MusicTranscription\MAB-TonyGame\recordings\\soundtesting_pipeline\8_latentpolyphony_tune_boosting'
+processes = None  # worker processes (None: one per core, 1: serial)
+detector_pool = DetectorPool()  # of the process, reuses the detectors of the previous files
 
 # C:\Projects\MusicTranscription\MAB-TonyGame\recordings\soundtesting_pipeline
 
+
+def process_file(path, od, pd, hop_size, sample_limit, filter_method):
+    """ onset+pitch detection of a single file, writes the mock csv. returns a message to print or None """
+    # get onset+pitches of the wav file
+    src = create_source(path, hop_size=hop_size, verbose=False)
+    od, pd = detector_pool.acquire(od, src.samplerate), detector_pool.acquire(pd, src.samplerate)
+    try:
+        transcriber = NoteTranscriber(od, pd, sample_limit, prefilter=filter_method)
+        events = transcriber.transcribe(src, create_detectors=False)
+        pitches = {event.onset_ms: event.pitch for event in events}  # onset[ms]:pitch[midi]
+    finally:
+        detector_pool.release(od)
+        detector_pool.release(pd)
+
+    path_csv = (path.replace(folder, dest) if dest else folder)[:-3] + "csv"
+    if not os.path.exists(path_csv):
+        if not os.path.exists(os.path.dirname(path_csv)):
+            os.makedirs(os.path.dirname(path_csv), exist_ok=True)  # several workers may create it at once
+        with open(path_csv, mode='w', newline="\n") as f:
+            writer = csv.writer(f, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+            for onset in pitches:
+                writer.writerow([onset, pitches[onset]])
+    else:
+        return f"Did not create file {path_csv}, file already exists!"
+
+
 if __name__ == '__main__':
     hop_size = 512
     onset_method = 'specflux'
@@ -41,51 +72,9 @@ if __name__ == '__main__':
     pd = AubioPitchDetector(pitch_method, hop_size, pitch_frame_size, history_length)
 
     sample_limit = (history_length + 1) * hop_size
-    for subdir, dirs, files in os.walk(folder):
-        for file in files:
-            if len(sys.argv) > 2 and file != sys.argv[2]:
-                continue
-            path = os.path.join(subdir, file)
-            if path.endswith('.wav'):
-                # get onset+pitches of the wav file
-                src = create_source(path, hop_size=hop_size, verbose=False)
-
-                od.create_detector(src.samplerate)
-                pd.create_detector(src.samplerate)
-
-                af = aubio.digital_filter(order=3)  # 7 for A-Filter, 5 for C-Filter, 3 for biquad
-                if filter_method == 'lowpass':
-                    if src.samplerate == 44100:
-                        af.set_biquad(.07909669122050075, .1581933824410015, .07909669122050075, -1.1486877651747005, .4650745300567037)  # q=0.85, f=4700
-                    elif src.samplerate == 48000:
-                        af.set_biquad(.06844301311767674, .13688602623535348, .06844301311767674, -1.2193255395824403, .4930975920531473)  # q=0.85, f=4700
-                        # self.filter_obj.set_biquad(0.01801576198494065, 0.0360315239698813,  0.01801576198494065, -1.4631087710168378, 0.5351718189566004)  # q=0.5, f=2350
-
-                pitches = {}  # onset[ms]:pitch[midi]
-                total_read = 0
-                last_onset = -sample_limit
-                while True:
-                    samples, read = src()
-                    total_read += read
-
-                    onset = od.process_next(samples)
-                    last_onset = max(onset, last_onset)
-                    pitch = pd.process_next(af(samples))
-
-                    samples_past_limit_after_onset = total_read - sample_limit - last_onset
-                    if samples_past_limit_after_onset < 0 < samples_past_limit_after_onset + hop_size:  # and pitch > 0:
-                        pitches[round(last_onset / src.samplerate * 1000)] = pitch
-
-                    if read < src.hop_size:
-                        break
-
-                path_csv = (path.replace(folder, dest) if dest else folder)[:-3] + "csv"
-                if not os.path.exists(path_csv):
-                    if not os.path.exists(os.path.dirname(path_csv)):
-                        os.mkdir(os.path.dirname(path_csv))
-                    with open(path_csv, mode='w', newline="\n") as f:
-                        writer = csv.writer(f, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
-                        for onset in pitches:
-                            writer.writerow([onset, pitches[onset]])
-                else:
-                    print(f"Did not create file {path_csv}, file already exists!")
+    paths = find_files([folder], '.wav', only=sys.argv[2] if len(sys.argv) > 2 else None)
+    write_file = partial(process_file, od=od, pd=pd, hop_size=hop_size, sample_limit=sample_limit,
+                         filter_method=filter_method)
+    for path, message in run_files(write_file, paths, processes):
+        if message:
+            print(message)
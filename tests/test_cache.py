@@ -0,0 +1,37 @@
+import numpy as np
+
+from mpd.cache import FeatureCache, cached_raw_track, detector_params
+from mpd.onset import AubioOnsetDetector
+from mpd.synth import PianoSynth, write_wav
+
+
+def synthetic_wav(tmp_path) -> str:
+    path = str(tmp_path / 'piece.wav')
+    samples, _ = PianoSynth(44100, 3., seed=1).piece(0)
+    write_wav(path, samples, 44100)
+    return path
+
+
+def test_odf_entry_shared_by_thresholds(tmp_path):
+    path = synthetic_wav(tmp_path)
+    cache = FeatureCache(str(tmp_path / 'cache'))
+    first = AubioOnsetDetector('specflux', 512, 2048, 50)
+    second = AubioOnsetDetector('specflux', 512, 2048, 80)
+    second.threshold, second.silence = 0.5, -70
+
+    odf = cached_raw_track(cache, path, first, 512, pitch_frame_sizes=()).odf
+    again = cached_raw_track(cache, path, second, 512, pitch_frame_sizes=()).odf
+
+    assert len([key for _, _, key in cache.entries() if key.startswith('odf_')]) == 1
+    np.testing.assert_array_equal(odf, again)
+
+
+def test_detector_params_ignore_runtime_state():
+    fresh = AubioOnsetDetector('specflux', 512, 2048, 50)
+    used = AubioOnsetDetector('specflux', 512, 2048, 50)
+    used.create_detector(44100)
+    for hop in np.random.default_rng(0).uniform(-.5, .5, (20, 512)).astype(np.float32):
+        used.process_next(hop)
+
+    assert detector_params(used) == detector_params(fresh)
+    assert detector_params(used) != detector_params(AubioOnsetDetector('specflux', 512, 2048, 80))
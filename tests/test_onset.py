@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+from mpd.onset import AubioOnsetDetector, MadmomFeatureOnsetDetector
+from mpd.synth import PianoSynth
+
+hop_size = 512
+
+
+def streamed(detector, samples):
+    """ process_next for all complete hops of samples on a freshly created detector """
+    detector.create_detector(44100)
+    hops = samples[:len(samples) // hop_size * hop_size].reshape(-1, hop_size)
+    return np.array([detector.process_next(hop) for hop in hops])
+
+
+@pytest.fixture(scope='module')
+def samples():
+    return PianoSynth(44100, 4., seed=2).piece(0)[0]
+
+
+def test_aubio_process_array_starts_fresh(samples):
+    detector = AubioOnsetDetector('specflux', hop_size, 2048, 50)
+    expected = streamed(detector, samples)  # leaves the detector at the end of the signal
+    np.testing.assert_array_equal(detector.process_array(samples), expected)
+    np.testing.assert_array_equal(detector.process_array(samples), expected)
+
+
+def test_madmom_feature_process_array_starts_fresh(samples):
+    pytest.importorskip('madmom')
+    detector = MadmomFeatureOnsetDetector('superflux', hop_size, 2048, 50)
+    expected = streamed(detector, samples)
+    np.testing.assert_array_equal(detector.process_array(samples), expected)
+    np.testing.assert_array_equal(detector.process_array(samples), expected)
+
+
+def test_madmom_feature_process_array_needs_samplerate(samples):
+    pytest.importorskip('madmom')
+    with pytest.raises(ValueError):
+        MadmomFeatureOnsetDetector('superflux', hop_size, 2048, 50).process_array(samples)